@@ -0,0 +1,91 @@
+"""Throughput of the Selenium backend by pool size and browser profile
+
+Scrapes the same negotiations through the stand-in, whose pages link
+stylesheets, images and fonts served with latency, with a full and a lean
+Chrome profile. Needs Chrome and its driver installed.
+
+Run from the project root: python -m benchmarks.bench_driver_pool
+"""
+
+import argparse
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from selenium.common.exceptions import WebDriverException
+
+from benchmarks.standin_server import StandinConfig, start_server
+from core.driver_pool import DriverPool, create_driver
+from core.scraping import CargaMaquinaClient
+
+
+def run_config(
+    base_url: str, drivers: int, lean: bool, negotiations: int
+) -> tuple[float, int]:
+    """Seconds to scrape the negotiations and how many succeeded"""
+    client = CargaMaquinaClient(
+        "benchmark", "benchmark", backend="selenium", base_url=base_url, drivers=drivers
+    )
+    # The login may have opened a driver of the default profile, both profiles
+    # run headless so only the lean settings differ
+    client.driver_pool.close()
+    client.driver_pool = DriverPool(
+        drivers, factory=functools.partial(create_driver, lean=lean, headless=True)
+    )
+    try:
+        # Chrome start up is left out, the service keeps the drivers open
+        client.driver_pool.warm_up()
+        client.get_requested_materials([])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=drivers) as executor:
+            results = list(
+                executor.map(
+                    client.nfe_data_scraping,
+                    [str(1000 + index) for index in range(negotiations)],
+                )
+            )
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close()
+    return elapsed, sum(1 for result in results if result is not None)
+
+
+def run(negotiations: int = 20, max_drivers: int = 4, assets: int = 4) -> None:
+    """Compare the pool sizes and profiles"""
+    server = start_server(
+        config=StandinConfig(
+            nfe_lines=50, latency=0.05, assets=assets, asset_latency=0.1
+        )
+    )
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(
+        f"{negotiations} negotiations, {assets * 3} assets per page "
+        "(100 ms each), 50 ms page latency"
+    )
+    try:
+        for drivers in sorted({1, max_drivers}):
+            for lean in (False, True):
+                elapsed, scraped = run_config(base_url, drivers, lean, negotiations)
+                profile = "lean" if lean else "full"
+                print(
+                    f"{drivers} drivers, {profile}: {elapsed:6.2f} s, "
+                    f"{scraped / elapsed:5.2f} NFes/s ({scraped}/{negotiations} ok)"
+                )
+    except WebDriverException as e:
+        print(f"Error: {e}")
+    finally:
+        server.shutdown()
+
+
+def main() -> None:
+    """Parse the arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--negotiations", type=int, default=20)
+    parser.add_argument("--max-drivers", type=int, default=4)
+    parser.add_argument("--assets", type=int, default=4)
+    args = parser.parse_args()
+    run(args.negotiations, args.max_drivers, args.assets)
+
+
+if __name__ == "__main__":
+    main()
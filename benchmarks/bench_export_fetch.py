@@ -0,0 +1,45 @@
+"""Benchmark of the chunked pending materials download against the stand-in
+
+Run from the project root: python -m benchmarks.bench_export_fetch
+"""
+
+import time
+from datetime import datetime as dt
+
+from benchmarks.standin_server import (
+    SESSION_COOKIE,
+    SESSION_ID,
+    StandinConfig,
+    start_server,
+)
+from core.export_fetcher import PendingMaterialsFetcher
+from core.scraping import PENDING_MATERIALS_PATH, create_session
+
+
+def run(rows: int = 20_000, latency: float = 0.2) -> None:
+    """Download the whole export with different worker counts"""
+    server = start_server(
+        config=StandinConfig(pending_rows=rows, codes=2_000, latency=latency)
+    )
+    url = f"http://127.0.0.1:{server.server_address[1]}{PENDING_MATERIALS_PATH}"
+    cookies = {SESSION_COOKIE: SESSION_ID}
+    year = dt.now().year
+
+    print(f"{rows} rows, {latency * 1000:.0f} ms server latency")
+    for workers in (1, 3, 6, 12):
+        fetcher = PendingMaterialsFetcher(create_session(), url, workers=workers)
+        start = time.perf_counter()
+        materials = list(fetcher.iter_materials(year, cookies))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(stats.latency for stats in fetcher.last_stats)
+        print(
+            f"workers {workers:>2}: {len(materials)} materials, "
+            f"{len(fetcher.last_stats)} pages in {elapsed * 1000:.0f} ms "
+            f"(page p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+            f"max {latencies[-1] * 1000:.0f} ms)"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    run()
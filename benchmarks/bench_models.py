@@ -0,0 +1,146 @@
+"""Benchmark of the record types: memory per record and serialization time
+
+Compares the slotted records and their serializers with the plain
+dataclasses, the pending materials as dicts and dataclasses.asdict used
+before, on synthetic NFes of 10 000 lines.
+
+Run from the project root: python -m benchmarks.bench_models
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from typing import Callable, Dict, List
+
+from benchmarks.bench_printer_labels import synthetic_nfe_data
+from core.models import Material, NFeData, OrderData
+
+
+@dataclass
+class LegacyOrderData:
+    """OrderData before the slots"""
+
+    address: str
+    order: str
+    code: str
+    description: str
+    qty: float
+    qty_total: float
+    unit_type: str
+
+
+@dataclass
+class LegacyNFeData:
+    """NFeData before the slots, with the pending materials as dicts"""
+
+    date: str
+    nfe_number: int
+    supplier_name: str
+    orders: List[LegacyOrderData] = field(default_factory=list)
+    pending_materials: List[Dict] = field(default_factory=list)
+
+
+def legacy_nfe_data(nfe_data: NFeData) -> LegacyNFeData:
+    """Same NFe in the legacy records"""
+    return LegacyNFeData(
+        date=nfe_data.date,
+        nfe_number=nfe_data.nfe_number,
+        supplier_name=nfe_data.supplier_name,
+        orders=[
+            LegacyOrderData(**{**order.to_dict(), "order": str(order.order)})
+            for order in nfe_data.orders
+        ],
+        pending_materials=[material.to_dict() for material in nfe_data.pending_materials],
+    )
+
+
+def memory_per_record(build: Callable[[], list], count: int) -> float:
+    """Bytes allocated per record while building count records"""
+    tracemalloc.start()
+    records = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(records) == count
+    return size / count
+
+
+def best_time(function: Callable[[], object], repeat: int = 5) -> float:
+    """Best time of a few calls"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(lines: int = 10_000) -> None:
+    """Measure the records of an NFe with the given number of orders and pending materials"""
+    nfe_data = synthetic_nfe_data(lines, lines, seed=1)
+    legacy = legacy_nfe_data(nfe_data)
+    orders = [order.to_dict() for order in nfe_data.orders]
+    materials = [material.to_dict() for material in nfe_data.pending_materials]
+    print(f"{lines} orders and {lines} pending materials")
+
+    rows = [
+        (
+            "order",
+            memory_per_record(
+                lambda: [LegacyOrderData(**order) for order in orders], lines
+            ),
+            memory_per_record(
+                lambda: [OrderData(**order) for order in orders], lines
+            ),
+        ),
+        (
+            "pending material",
+            memory_per_record(lambda: [dict(material) for material in materials], lines),
+            memory_per_record(
+                lambda: [
+                    Material(
+                        date(2026, 2, 1),
+                        material["code"],
+                        material["op_number"],
+                        material["product"],
+                        material["pending_qty"],
+                    )
+                    for material in materials
+                ],
+                lines,
+            ),
+        ),
+    ]
+    for name, before, after in rows:
+        print(f"{name:>16}: {before:6.0f} B -> {after:6.0f} B per record")
+
+    # The old to_json serialized asdict, which deep copies every field
+    legacy_json = best_time(lambda: json.dumps(asdict(legacy), ensure_ascii=False))
+    new_json = best_time(lambda: json.dumps(nfe_data.to_dict(), ensure_ascii=False))
+    compact = nfe_data.to_compact()
+    compact_time = best_time(nfe_data.to_compact)
+    json_text = json.dumps(nfe_data.to_dict(), ensure_ascii=False)
+    load_json = best_time(lambda: NFeData.from_dict(json.loads(json_text)))
+    load_compact = best_time(lambda: NFeData.from_compact(compact))
+    json_size = len(json_text.encode())
+    assert NFeData.from_compact(compact) == nfe_data
+
+    print(f"asdict + json : {legacy_json * 1000:7.1f} ms")
+    print(f"to_dict + json: {new_json * 1000:7.1f} ms, {json_size / 1024:6.0f} KiB")
+    print(f"to_compact    : {compact_time * 1000:7.1f} ms, {len(compact.encode()) / 1024:6.0f} KiB")
+    print(f"load json     : {load_json * 1000:7.1f} ms")
+    print(f"from_compact  : {load_compact * 1000:7.1f} ms")
+
+
+def main() -> None:
+    """Parse the arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=10_000)
+    args = parser.parse_args()
+    run(args.lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Scaling of the stock labels rendering with the number of processes
+
+Each pool renders the NFe once before the timing, as the shared pool of a
+batch is already running after the first large NFe.
+
+Run from the project root: python -m benchmarks.bench_parallel_render
+"""
+
+import argparse
+import os
+import time
+
+from benchmarks.bench_printer_labels import synthetic_nfe_data
+from core.generate_labels import (
+    PdfWriter,
+    create_render_pool,
+    generate_stock_labels_parallel,
+)
+
+
+def run(orders: int = 400, max_workers: int | None = None) -> None:
+    """Render the same NFe with 1, 2, 4... processes up to the core count"""
+    if PdfWriter is None:
+        print("pypdf não instalado, a renderização é sempre serial")
+        return
+    nfe_data = synthetic_nfe_data(orders, 0)
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = sorted({1, max_workers} | {2**n for n in range(8) if 2**n < max_workers})
+
+    print(f"orders: {orders} ({orders * 2} pages), cores: {os.cpu_count()}")
+    serial_time = 0.0
+    for workers in counts:
+        with create_render_pool(workers) as executor:
+            generate_stock_labels_parallel(nfe_data, workers, 0, executor)
+            start = time.perf_counter()
+            document = generate_stock_labels_parallel(nfe_data, workers, 0, executor)
+            elapsed = time.perf_counter() - start
+        serial_time = serial_time or elapsed
+        print(
+            f"{workers:>3} processes: {elapsed:7.2f} s, "
+            f"speedup {serial_time / elapsed:4.2f}x, {len(document) / 1024:8.0f} KiB"
+        )
+
+
+def main() -> None:
+    """Parse the arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--max-workers", type=int)
+    args = parser.parse_args()
+    run(args.orders, args.max_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark of the NFe page and pending materials export parsers
+
+Run from the project root: python -m benchmarks.bench_parsing
+"""
+
+import time
+from datetime import datetime as dt
+
+from bs4 import BeautifulSoup
+
+from benchmarks import fixtures
+from core.parsing import iter_pending_materials, parse_nfe_page
+
+
+def legacy_pending_materials(html: str, min_year: int) -> list:
+    """Export parsing as done by get_requested_materials before the parsing layer"""
+    soup = BeautifulSoup(html, "html.parser")
+    materials = []
+    for tr in soup.find_all("tr")[1:]:
+        creation_date = dt.strptime(tr.find_all("td")[0].text.strip(), "%d/%m/%y")
+        code = tr.find_all("td")[1].text.strip()
+        op_number = str(tr.find_all("td")[3].text.strip())
+        product = tr.find_all("td")[5].text.strip()
+        pending_qty = tr.find_all("td")[8].text.strip().split(" ")[0]
+        unit_type = tr.find_all("td")[8].text.strip().split(" ")[-1]
+        if (creation_date.year < min_year) or (unit_type == "mt"):
+            continue
+        if "." in pending_qty:
+            pending_qty = float(pending_qty.replace(".", ""))
+        materials.append((creation_date, code, op_number, product, float(pending_qty)))
+    return materials
+
+
+def legacy_nfe_orders(html: str) -> list:
+    """NFe table parsing as done by get_nfe_data before the parsing layer"""
+    soup = BeautifulSoup(html, "html.parser")
+    orders = []
+    for tr in soup.find_all("table")[1].find_all("tr")[1:]:
+        orders.append(
+            (
+                tr.find_all("td")[3].text.strip(),
+                tr.find_all("td")[4].text.strip(),
+                tr.find_all("td")[5].text.strip(),
+                tr.find_all("td")[6].text.strip(),
+                float(tr.find_all("td")[8].text.strip().split(" ")[0]),
+                tr.find_all("td")[8].text.strip().split(" ")[-1].upper(),
+            )
+        )
+    return orders
+
+
+def timed(function, *args) -> tuple[float, int]:
+    """Elapsed seconds and number of records of a parser call"""
+    start = time.perf_counter()
+    records = function(*args)
+    return time.perf_counter() - start, len(records)
+
+
+def run() -> None:
+    """Time both parsers on synthetic pages of increasing size"""
+    year = dt.now().year
+    for rows in (1_000, 5_000, 20_000):
+        html = fixtures.pending_materials_page(rows, codes=2_000)
+        legacy_time, legacy_count = timed(legacy_pending_materials, html, year)
+        new_time, new_count = timed(
+            lambda page: list(iter_pending_materials(page, year)), html
+        )
+        assert legacy_count == new_count
+        print(
+            f"export {rows:>6} rows: legacy {legacy_time * 1000:8.1f} ms"
+            f" | new {new_time * 1000:8.1f} ms | {legacy_time / new_time:.1f}x"
+        )
+
+    for lines in (100, 1_000, 5_000):
+        html = fixtures.nfe_page(lines)
+        legacy_time, legacy_count = timed(legacy_nfe_orders, html)
+        new_time, new_count = timed(lambda page: list(parse_nfe_page(page)[2]), html)
+        assert legacy_count == new_count
+        print(
+            f"NFe    {lines:>6} lines: legacy {legacy_time * 1000:7.1f} ms"
+            f" | new {new_time * 1000:8.1f} ms | {legacy_time / new_time:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,81 @@
+"""Time per NFe with the pending materials download after or during the page scraping
+
+Scrapes negotiations through the stand-in with the HTTP backend and the
+pending materials cache disabled, so every NFe downloads the export, first
+one after the other as get_nfe_data did before the prefetch and then with
+the download overlapped with the NFe page.
+
+Run from the project root: python -m benchmarks.bench_pending_overlap
+"""
+
+import argparse
+import time
+from typing import Callable, List
+
+from benchmarks.standin_server import StandinConfig, start_server
+from core.models import NFeData
+from core.scraping import CargaMaquinaClient
+
+
+def time_negotiations(
+    scrape: Callable[[str], NFeData | None], negotiations: int
+) -> List[float]:
+    """Seconds of each negotiation scraped one at a time"""
+    times: List[float] = []
+    for index in range(negotiations):
+        start = time.perf_counter()
+        nfe_data = scrape(str(1000 + index))
+        times.append(time.perf_counter() - start)
+        assert nfe_data is not None
+    return times
+
+
+def run(negotiations: int = 10, latency: float = 0.3, rows: int = 2_000) -> None:
+    """Compare the sequential and the overlapped pending materials download"""
+    server = start_server(
+        config=StandinConfig(nfe_lines=50, pending_rows=rows, latency=latency)
+    )
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    client = CargaMaquinaClient(
+        "benchmark",
+        "benchmark",
+        backend="http",
+        base_url=base_url,
+        pending_cache_ttl=0,
+    )
+    print(
+        f"{negotiations} negotiations, {rows} export rows, "
+        f"{latency * 1000:.0f} ms server latency"
+    )
+    try:
+        sequential = time_negotiations(
+            lambda negociation_id: client.get_nfe_data(
+                client.http_scraper.fetch_nfe_html(negociation_id)
+            ),
+            negotiations,
+        )
+        overlapped = time_negotiations(client.nfe_data_scraping, negotiations)
+    finally:
+        client.close()
+        server.shutdown()
+
+    for name, times in (("sequential", sequential), ("overlapped", overlapped)):
+        times.sort()
+        print(
+            f"{name}: median {times[len(times) // 2] * 1000:6.0f} ms, "
+            f"max {times[-1] * 1000:6.0f} ms per NFe"
+        )
+
+
+def main() -> None:
+    """Parse the arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--negotiations", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--rows", type=int, default=2_000)
+    args = parser.parse_args()
+    run(args.negotiations, args.latency, args.rows)
+
+
+if __name__ == "__main__":
+    main()
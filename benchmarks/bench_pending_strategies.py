@@ -0,0 +1,85 @@
+"""Requests, bytes and latency of the per-code queries and the whole export
+
+Gets the pending materials of NFes with more and more codes from the
+stand-in, once with one filtered query per code and once with the whole
+export, and prints the strategy QueryPlanner chooses after seeing both.
+
+Run from the project root: python -m benchmarks.bench_pending_strategies
+"""
+
+import argparse
+import time
+from datetime import datetime as dt
+
+from benchmarks.fixtures import material_code
+from benchmarks.standin_server import (
+    SESSION_COOKIE,
+    SESSION_ID,
+    StandinConfig,
+    start_server,
+)
+from core.export_fetcher import PendingMaterialsFetcher, QueryPlanner, date_chunks
+from core.scraping import PENDING_MATERIALS_PATH, create_session
+
+
+def run(
+    rows: int = 20_000,
+    codes: int = 2_000,
+    latency: float = 0.2,
+    code_counts: tuple[int, ...] = (1, 3, 6, 12, 30, 60, 150),
+) -> None:
+    """Compare the strategies for each number of codes"""
+    server = start_server(
+        config=StandinConfig(pending_rows=rows, codes=codes, latency=latency)
+    )
+    url = f"http://127.0.0.1:{server.server_address[1]}{PENDING_MATERIALS_PATH}"
+    cookies = {SESSION_COOKIE: SESSION_ID}
+    year = dt.now().year
+    fetcher = PendingMaterialsFetcher(create_session(), url)
+    planner = QueryPlanner(
+        fetcher.workers, len(date_chunks(year, fetcher.months_per_chunk))
+    )
+    print(f"{rows} rows of {codes} codes, {latency * 1000:.0f} ms server latency")
+
+    try:
+        start = time.perf_counter()
+        exported = sum(1 for _ in fetcher.iter_materials(year, cookies))
+        elapsed = time.perf_counter() - start
+        planner.record("export", fetcher.last_stats, elapsed)
+        print(
+            f"export    : {len(fetcher.last_stats):4} requests, "
+            f"{sum(s.bytes for s in fetcher.last_stats) / 1024:7.0f} KiB, "
+            f"{elapsed * 1000:6.0f} ms, {exported} materials"
+        )
+        for count in code_counts:
+            # Codes spread over the export, as the codes of a real NFe
+            nfe_codes = [
+                material_code(1 + index * codes // count) for index in range(count)
+            ]
+            start = time.perf_counter()
+            index, stats = fetcher.fetch_codes(nfe_codes, year, cookies)
+            elapsed = time.perf_counter() - start
+            planner.record("codes", stats, elapsed)
+            print(
+                f"{count:3} codes : {len(stats):4} requests, "
+                f"{sum(s.bytes for s in stats) / 1024:7.0f} KiB, "
+                f"{elapsed * 1000:6.0f} ms, "
+                f"{sum(len(materials) for materials in index.values())} materials, "
+                f"auto chooses {planner.choose(count)}"
+            )
+    finally:
+        server.shutdown()
+
+
+def main() -> None:
+    """Parse the arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--codes", type=int, default=2_000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    run(args.rows, args.codes, args.latency)
+
+
+if __name__ == "__main__":
+    main()
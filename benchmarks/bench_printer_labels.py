@@ -0,0 +1,66 @@
+"""Benchmark of the label output formats: PDF against ZPL and EPL
+
+Prints the render time and the size sent to the printer by each format.
+The ZPL and EPL layouts are checked against golden files in
+tests/test_printer_labels.py.
+
+Run from the project root: python -m benchmarks.bench_printer_labels
+"""
+
+import random
+import time
+from datetime import date
+
+from benchmarks.fixtures import UNITS, WORDS, material_code
+from core.generate_labels import LABEL_FORMATS, generate_nfe_labels
+from core.models import Material, NFeData, OrderData
+from core.qr_cache import qr_cache
+
+
+def synthetic_nfe_data(orders: int, pending: int, seed: int = 0) -> NFeData:
+    """Reconciled NFe data with the given number of orders and pending materials"""
+    rng = random.Random(seed)
+    return NFeData(
+        date="17/10/2026",
+        nfe_number=100000 + seed,
+        supplier_name=f"FORNECEDOR{seed}",
+        orders=[
+            OrderData(
+                address=f"RUA {rng.randint(1, 9)} PRATELEIRA {rng.randint(1, 20)}",
+                order=rng.randint(1000, 9999),
+                code=material_code(index),
+                description=" ".join(rng.choices(WORDS, k=rng.randint(3, 8))),
+                qty=float(rng.randint(1, 500)),
+                qty_total=float(rng.randint(500, 900)),
+                unit_type=rng.choice(UNITS).upper(),
+            )
+            for index in range(orders)
+        ],
+        pending_materials=[
+            Material(
+                creation_date=date(2026, 2, 1),
+                code=material_code(index),
+                op_number=f"OP {rng.randint(1, 99999)}",
+                product=f"PRODUTO {rng.randint(1, 999)}",
+                pending_qty=float(rng.randint(1, 300)),
+            )
+            for index in range(pending)
+        ],
+    )
+
+
+def run(orders: int = 200, pending: int = 50) -> None:
+    """Render the same NFe in every format"""
+    nfe_data = synthetic_nfe_data(orders, pending)
+    print(f"orders: {orders} (2 copies each), pending materials: {pending}")
+    for label_format in LABEL_FORMATS:
+        qr_cache.clear()
+        start = time.perf_counter()
+        documents = generate_nfe_labels(nfe_data, label_format=label_format)
+        elapsed = time.perf_counter() - start
+        size = sum(len(document) for document in documents.values())
+        print(f"{label_format}: {elapsed * 1000:8.1f} ms, {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,40 @@
+"""Benchmark of the NFe reconciliation against the legacy nested loop
+
+The randomized checks of the engine are in tests/test_reconciliation.py.
+
+Run from the project root: python -m benchmarks.bench_reconciliation
+"""
+
+import copy
+import random
+import time
+
+from core.models import Material
+from core.reconciliation import reconcile
+from tests.reconciliation_cases import legacy_reconcile, synthetic_nfe
+
+
+def run() -> None:
+    """Time the legacy loop and the indexed engine"""
+    rng = random.Random(42)
+    for lines in (100, 1_000, 5_000):
+        orders, pending_materials = synthetic_nfe(rng, lines, True, max_qty=5_000)
+        timings = []
+        materials = [Material.from_dict(material) for material in pending_materials]
+        for function, pending in (
+            (legacy_reconcile, pending_materials),
+            (reconcile, materials),
+        ):
+            data = copy.deepcopy((orders, pending))
+            start = time.perf_counter()
+            function(*data)
+            timings.append(time.perf_counter() - start)
+        print(
+            f"{lines:>5} lines: legacy {timings[0] * 1000:9.1f} ms"
+            f" | indexed {timings[1] * 1000:7.1f} ms"
+            f" | {timings[0] / timings[1]:.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,78 @@
+"""Import time budget of main.py, the time until the credentials prompt
+
+Runs python -X importtime -c "import main" a few times and fails when the
+best total is over the budget or when a heavy module is imported before
+the prompt.
+
+Run from the project root: python -m benchmarks.bench_startup
+"""
+
+import argparse
+import subprocess
+import sys
+
+BUDGET_MS: float = 60
+# Imported by the warm-up thread, never before the prompt
+HEAVY_MODULES: tuple[str, ...] = (
+    "selenium",
+    "requests",
+    "bs4",
+    "reportlab",
+    "qrcode",
+    "PIL",
+)
+
+
+def import_times() -> dict[str, tuple[int, float]]:
+    """Nesting level and cumulative ms of every module imported with main"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    times: dict[str, tuple[int, float]] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # The interpreter startup modules come before main, at level 0 too
+        if name.strip() != "main" and not name.startswith("   "):
+            times.clear()
+            continue
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (level, int(cumulative) / 1000)
+    return times
+
+
+def run(budget: float = BUDGET_MS, runs: int = 5) -> bool:
+    """Check the budget, True when it is met"""
+    samples = [import_times() for _ in range(runs)]
+    best = min(samples, key=lambda times: times["main"][1])
+    heavy = sorted(name for name in best if name.split(".")[0] in HEAVY_MODULES)
+    # Direct imports of main
+    top = sorted(
+        ((ms, name) for name, (level, ms) in best.items() if level == 1),
+        reverse=True,
+    )[:8]
+
+    total = best["main"][1]
+    print(f"import main: {total:.1f} ms (budget {budget:.0f} ms)")
+    for ms, name in top:
+        print(f"  {name}: {ms:.1f} ms")
+    if heavy:
+        print(f"heavy modules imported before the prompt: {', '.join(heavy[:10])}")
+    return total <= budget and not heavy
+
+
+def main() -> None:
+    """Exit with an error when the budget is exceeded"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.budget, args.runs) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark of the text layout used by draw_text, before and after the cache
+
+Run from the project root: python -m benchmarks.bench_text_layout
+"""
+
+import random
+import time
+
+from reportlab.lib.pagesizes import mm
+from reportlab.pdfbase import pdfmetrics
+
+from core.generate_labels import register_fonts
+from core.text_layout import layout_text
+
+DESCRIPTIONS = [
+    "PARAFUSO SEXTAVADO INOX M8 X 30MM COM PORCA E ARRUELA",
+    "CHAPA ACO CARBONO 1020 LAMINADA A FRIO 2,00MM",
+    "CABO FLEXIVEL 2,5MM2 750V PRETO ROLO 100M",
+    "ROLAMENTO RIGIDO DE ESFERAS 6204 2RS",
+    "TUBO INDUSTRIAL REDONDO 1.1/2 X 1,50MM BARRA 6M",
+]
+ADDRESSES = ["A1-B2", "RUA 3 PRATELEIRA 4 NIVEL 2", "ESTOQUE CENTRAL"]
+
+
+def legacy_layout(
+    text: str, font_name: str, font_size: float, max_width: float, wrap: bool = False
+) -> tuple[float, tuple[str, ...]]:
+    """Font size and lines as computed by draw_text before the layout cache"""
+    if wrap:
+        font_size = 8
+        lines = []
+        current_line = ""
+        for word in text.split(" "):
+            test_line = f"{current_line} {word}".strip()
+            if pdfmetrics.stringWidth(test_line, font_name, font_size) <= max_width:
+                current_line = test_line
+            else:
+                lines.append(current_line)
+                current_line = word
+        lines.append(current_line)
+        return font_size, tuple(lines)
+
+    while font_size > 1:
+        if pdfmetrics.stringWidth(text, font_name, font_size) <= max_width:
+            break
+        font_size -= 1
+    return font_size, (text,)
+
+
+def stock_label_texts(rng: random.Random) -> list[tuple]:
+    """Arguments of every draw_text call of one stock label"""
+    code = f"MP{rng.randint(1, 40):05d}"
+    qty = rng.randint(1, 500)
+    return [
+        ("17/10/2026", "Arial-Bold", 10, 80 * mm, False),
+        ("NF 123456", "Arial-Bold", 13, 85 * mm, False),
+        (rng.choice(ADDRESSES), "Arial", 5, 15 * mm, True),
+        (str(rng.randint(1000, 1100)), "Arial-Bold", 11, 85 * mm, False),
+        ("FORNECEDOR", "Arial-Bold", 22, 85 * mm, False),
+        (code, "Arial", 16, 85 * mm, False),
+        (rng.choice(DESCRIPTIONS), "Arial", 8, 82 * mm, True),
+        (f"Quantidade: {qty} UN", "Arial", 10, 85 * mm, False),
+        (f"Lote Total: {qty} UN", "Arial", 10.5, 85 * mm, False),
+    ]
+
+
+def run(labels: int = 500) -> None:
+    """Time the layout of every text of a batch of stock labels"""
+    register_fonts()
+    rng = random.Random(42)
+    # Each stock label is drawn twice
+    calls = [args for _ in range(labels) for args in stock_label_texts(rng) * 2]
+
+    start = time.perf_counter()
+    legacy = [legacy_layout(*args) for args in calls]
+    legacy_time = time.perf_counter() - start
+
+    layout_text.cache_clear()
+    start = time.perf_counter()
+    cached = [layout_text(*args) for args in calls]
+    cached_time = time.perf_counter() - start
+
+    mismatches = sum(
+        1
+        for (old_size, old_lines), (new_size, new_lines) in zip(legacy, cached)
+        if old_lines != new_lines or abs(old_size - new_size) > 1e-9
+    )
+
+    print(f"labels: {labels} ({len(calls)} draw_text calls)")
+    print(f"legacy: {legacy_time * 1e6 / labels:.1f} us/label")
+    print(f"cached: {cached_time * 1e6 / labels:.1f} us/label")
+    print(f"speedup: {legacy_time / cached_time:.1f}x")
+    print(f"mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    run()
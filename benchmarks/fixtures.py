@@ -0,0 +1,111 @@
+"""Synthetic CargaMaquina HTML pages used by the benchmarks and the stand-in server"""
+
+import random
+from datetime import datetime as dt, timedelta
+
+UNITS: list[str] = ["un", "pc", "kg", "cx"]
+WORDS: list[str] = [
+    "PARAFUSO", "PORCA", "ARRUELA", "CHAPA", "TUBO", "CABO", "ROLAMENTO",
+    "INOX", "ACO", "CARBONO", "SEXTAVADO", "FLEXIVEL", "M8", "30MM", "2,5MM2",
+]
+
+
+def material_code(index: int) -> str:
+    """Material code used in the synthetic pages"""
+    return f"MP{index:05d}"
+
+
+def login_page() -> str:
+    """Login page with the same form fields as CargaMaquina"""
+    return """<html><body>
+<form id="login-form" action="/site/login" method="post">
+<input type="hidden" name="YII_CSRF_TOKEN" value="standin-token">
+<input type="text" name="LoginForm[username]" id="LoginForm_username">
+<input type="password" name="LoginForm[password]" id="LoginForm_password">
+<input type="submit" name="yt0" value="Entrar">
+</form>
+</body></html>"""
+
+
+def compra_list_page(negociation_id: str, compra_id: str) -> str:
+    """Compra list filtered by negotiation with the checkbox and the view link"""
+    return f"""<html><body>
+<a id="linkVisualizar" href="/compra/visualizar/id/{compra_id}">Visualizar</a>
+<table><tr><th></th><th>Negociação</th></tr>
+<tr><td><input type="checkbox" id="compraSelecionados_0" value="{compra_id}"></td>
+<td>{negociation_id}</td></tr></table>
+</body></html>"""
+
+
+def nfe_page(lines: int, seed: int = 0, codes: int | None = None) -> str:
+    """NFe view page with a material table of the given number of lines"""
+    rng = random.Random(seed)
+    codes = codes or max(lines // 2, 1)
+    rows: list[str] = []
+    for index in range(lines):
+        description = " ".join(rng.choices(WORDS, k=rng.randint(3, 8)))
+        rows.append(
+            "<tr>"
+            f"<td>{index + 1}</td><td></td><td></td>"
+            f"<td>{rng.randint(1000, 9999)}</td>"
+            f"<td>RUA {rng.randint(1, 9)} PRATELEIRA {rng.randint(1, 20)}</td>"
+            f"<td>{material_code(rng.randint(1, codes))}</td>"
+            f"<td>{description}</td><td></td>"
+            f"<td>{rng.randint(1, 500)} {rng.choice(UNITS)}</td>"
+            "</tr>"
+        )
+    return f"""<html><body>
+<input id="FaturamentoGrid_0_observacao" value="NF - {100000 + seed}">
+<span class="select2-chosen">FORNECEDOR{seed} LTDA</span>
+<table><tr><th>Dados</th></tr></table>
+<table>
+<tr><th>#</th><th></th><th></th><th>Pedido</th><th>Endereço</th><th>Código</th>
+<th>Descrição</th><th></th><th>Quantidade</th></tr>
+{"".join(rows)}
+</table>
+</body></html>"""
+
+
+def pending_materials_records(
+    rows: int, seed: int = 0, codes: int = 500, start: dt | None = None
+) -> list[tuple[dt, str]]:
+    """Creation date and HTML of each row of the exportarPedidoFaltaMP report"""
+    rng = random.Random(seed)
+    start = start or dt(dt.now().year, 1, 1)
+    records: list[tuple[dt, str]] = []
+    for _ in range(rows):
+        creation_date = start + timedelta(days=rng.randint(0, 300))
+        records.append(
+            (
+                creation_date,
+                "<tr>"
+                f"<td>{creation_date.strftime('%d/%m/%y')}</td>"
+                f"<td>{material_code(rng.randint(1, codes))}</td><td></td>"
+                f"<td>OP {rng.randint(1, 99999)}</td><td></td>"
+                f"<td>PRODUTO {rng.randint(1, 999)}</td><td></td><td></td>"
+                f"<td>{rng.randint(1, 300)} {rng.choice(UNITS)}</td>"
+                "</tr>",
+            )
+        )
+    return records
+
+
+def pending_materials_rows(
+    rows: int, seed: int = 0, codes: int = 500, start: dt | None = None
+) -> list[str]:
+    """Rows of the exportarPedidoFaltaMP report"""
+    return [row for _, row in pending_materials_records(rows, seed, codes, start)]
+
+
+def render_pending_materials(rows: list[str]) -> str:
+    """exportarPedidoFaltaMP report with the given rows"""
+    return f"""<html><body><table>
+<tr><th>Criação</th><th>Código</th><th></th><th>OP</th><th></th><th>Produto</th>
+<th></th><th></th><th>Falta</th></tr>
+{"".join(rows)}
+</table></body></html>"""
+
+
+def pending_materials_page(rows: int, seed: int = 0, codes: int = 500) -> str:
+    """exportarPedidoFaltaMP report with the given number of rows"""
+    return render_pending_materials(pending_materials_rows(rows, seed, codes))
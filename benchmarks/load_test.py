@@ -0,0 +1,195 @@
+"""End-to-end load test of main.py against the stand-in
+
+Starts the stand-in and runs python -m main --batch with the HTTP backend
+on N negotiation IDs, printing to a directory, in a scratch folder under
+tmp/loadtest so the saved session, job store and metrics of the real runs
+are left alone. Reports the throughput, the p50/p95/p99 latency of the
+negotiations, the failures and the peak memory of the run.
+
+The credentials are written to the standard input of main.py, which
+getpass reads only without a terminal, so it needs a POSIX system.
+
+Run from the project root:
+    python -m benchmarks.load_test --negotiations 100 --workers 4
+    python -m benchmarks.load_test --latency 0.2 --error-rate 0.01
+"""
+
+import argparse
+import json
+import math
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import List
+
+from benchmarks.standin_server import StandinConfig, start_server
+from core.generate_labels import TMP_FOLDER
+from core.options import LABEL_FORMATS, PENDING_SOURCES
+
+try:
+    import resource
+except ImportError:  # Windows, the peak memory is not reported
+    resource = None
+
+PROJECT_ROOT: pathlib.Path = pathlib.Path(__file__).resolve().parent.parent
+LOADTEST_FOLDER: pathlib.Path = TMP_FOLDER / "loadtest"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def peak_memory_mib() -> float | None:
+    """Peak resident memory of the finished child processes"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Bytes on macOS, KiB on Linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def read_latencies(metrics_file: pathlib.Path) -> tuple[dict[str, List[float]], int]:
+    """Seconds of each negotiation of the batch by status, and the export retries"""
+    latencies: dict[str, List[float]] = {}
+    retries = 0
+    if not metrics_file.exists():
+        return latencies, retries
+    with open(metrics_file, "r", encoding="utf-8") as file:
+        for line in file:
+            event = json.loads(line)
+            if event["name"] == "batch.negociation":
+                latencies.setdefault(event["labels"]["status"], []).append(
+                    event["seconds"]
+                )
+            elif event["name"] == "pending_retries":
+                retries += event["value"]
+    return latencies, retries
+
+
+def run(args: argparse.Namespace) -> int:
+    """Run one load test, the exit code of main.py"""
+    server = start_server(
+        config=StandinConfig(
+            nfe_lines=args.nfe_lines,
+            pending_rows=args.pending_rows,
+            codes=args.codes,
+            latency=args.latency,
+            error_rate=args.error_rate,
+        )
+    )
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    workdir = (LOADTEST_FOLDER / time.strftime("%Y%m%d-%H%M%S")).resolve()
+    workdir.mkdir(parents=True)
+    (workdir / "ids.txt").write_text(
+        "\n".join(str(1000 + index) for index in range(args.negotiations)),
+        encoding="utf-8",
+    )
+    command = [
+        sys.executable,
+        "-m",
+        "main",
+        "--backend",
+        "http",
+        "--batch",
+        "ids.txt",
+        "--workers",
+        str(args.workers),
+        "--render-workers",
+        str(args.render_workers),
+        "--label-format",
+        args.label_format,
+        "--pending-source",
+        args.pending_source,
+        "--printer-backend",
+        "directory",
+        "--printer",
+        "printed",
+        "--metrics",
+        "jsonl",
+    ]
+    env = {
+        **os.environ,
+        "CARGAMAQUINA_URL": base_url,
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [str(PROJECT_ROOT), os.environ.get("PYTHONPATH")])
+        ),
+    }
+    print(
+        f"{args.negotiations} negotiations, {args.workers} workers, "
+        f"{args.latency * 1000:.0f} ms latency, {args.error_rate:.1%} errors, "
+        f"{args.nfe_lines} lines per NFe, {args.pending_rows} export rows"
+    )
+    try:
+        start = time.perf_counter()
+        result = subprocess.run(
+            command,
+            cwd=workdir,
+            env=env,
+            input="loadtest\nloadtest\n",
+            capture_output=True,
+            text=True,
+            check=False,
+            # Without a controlling terminal getpass reads the standard input
+            start_new_session=True,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    (workdir / "output.log").write_text(result.stdout + result.stderr, encoding="utf-8")
+    if result.returncode != 0:
+        print(f"main.py saiu com {result.returncode}, veja {workdir / 'output.log'}")
+        print(result.stderr[-2000:])
+        return result.returncode
+
+    latencies, retries = read_latencies(workdir / "tmp" / "metrics" / "metrics.jsonl")
+    succeeded = sorted(
+        latency
+        for status in ("ok", "cached", "stale")
+        for latency in latencies.get(status, [])
+    )
+    failed = len(latencies.get("error", []))
+    printed = [path for path in (workdir / "printed").glob("*") if path.suffix != ".part"]
+    print(
+        f"ok {len(succeeded)}, failed {failed}, printed {len(printed)} files, "
+        f"{retries} pending materials requests retried"
+    )
+    print(
+        f"throughput: {len(succeeded) / elapsed:.2f} NFes/s "
+        f"({elapsed:.1f} s including start up and login)"
+    )
+    if succeeded:
+        print(
+            "latency: "
+            + ", ".join(
+                f"p{q} {percentile(succeeded, q) * 1000:.0f} ms" for q in (50, 95, 99)
+            )
+            + f", max {succeeded[-1] * 1000:.0f} ms"
+        )
+    memory = peak_memory_mib()
+    if memory is not None:
+        print(f"peak memory: {memory:.0f} MiB")
+    print(f"output in {workdir}")
+    return 0
+
+
+def main() -> None:
+    """Parse the arguments and run the load test"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--negotiations", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--render-workers", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--nfe-lines", type=int, default=20)
+    parser.add_argument("--pending-rows", type=int, default=2_000)
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--label-format", choices=LABEL_FORMATS, default="pdf")
+    parser.add_argument("--pending-source", choices=PENDING_SOURCES, default="export")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Local stand-in for CargaMaquina serving synthetic HTML
+
+Run from the project root: python -m benchmarks.standin_server --port 8000
+and point the client to it with CARGAMAQUINA_URL=http://127.0.0.1:8000
+"""
+
+import argparse
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime as dt
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import fixtures
+
+SESSION_COOKIE = "PHPSESSID"
+SESSION_ID = "standin-session"
+
+
+@dataclass
+class StandinConfig:
+    """Sizes of the pages served by the stand-in"""
+
+    nfe_lines: int = 20
+    pending_rows: int = 200
+    codes: int = 50
+    latency: float = 0.0
+    # Stylesheets, images and fonts linked by every page, like the real site
+    assets: int = 0
+    asset_latency: float = 0.0
+    # Fraction of the compra, NFe and export pages answered with a 500
+    error_rate: float = 0.0
+
+
+ASSET_TYPES: dict[str, str] = {
+    "css": "text/css",
+    "png": "image/png",
+    "woff2": "font/woff2",
+}
+
+
+def asset_tags(count: int) -> str:
+    """Links to the static assets of a page"""
+    tags: list[str] = []
+    for index in range(count):
+        tags.append(f'<link rel="stylesheet" href="/static/{index}.css">')
+        tags.append(f'<img src="/static/{index}.png">')
+        tags.append(
+            f"<style>@font-face {{font-family: f{index}; "
+            f"src: url(/static/{index}.woff2)}} body {{font-family: f{index}}}</style>"
+        )
+    return "".join(tags)
+
+
+@lru_cache(maxsize=8)
+def pending_records(rows: int, codes: int) -> list:
+    """Synthetic export rows, generated once per size"""
+    return fixtures.pending_materials_records(rows, codes=codes)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Handler of the CargaMaquina pages used by the client"""
+
+    config: StandinConfig = StandinConfig()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the benchmark output clean"""
+
+    def _send_html(self, html: str, headers: dict[str, str] | None = None) -> None:
+        if self.config.assets:
+            html = html.replace("<body>", "<body>" + asset_tags(self.config.assets), 1)
+        body = html.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self, location: str, headers: dict[str, str] | None = None) -> None:
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _logged_in(self) -> bool:
+        return f"{SESSION_COOKIE}={SESSION_ID}" in self.headers.get("Cookie", "")
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the login, compra, NFe view and pending materials pages"""
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/static/"):
+            self._send_asset(url.path)
+            return
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        if url.path == "/site/login":
+            self._send_html(fixtures.login_page())
+            return
+        if not self._logged_in():
+            self._redirect("/site/login")
+            return
+        # The home page is left out, the client probes it to check the session
+        if (
+            url.path != "/"
+            and self.config.error_rate
+            and random.random() < self.config.error_rate
+        ):
+            self.send_error(500)
+            return
+
+        if url.path == "/":
+            self._send_html("<html><body>CargaMaquina stand-in</body></html>")
+        elif url.path == "/compra":
+            negociation_id = query.get("Compra[negociacao]", ["0"])[0]
+            compra_id = "".join(c for c in negociation_id if c.isdigit()) or "0"
+            self._send_html(fixtures.compra_list_page(negociation_id, compra_id))
+        elif url.path.startswith("/compra/visualizar/id/"):
+            compra_id = int(url.path.rsplit("/", 1)[-1])
+            self._send_html(
+                fixtures.nfe_page(self.config.nfe_lines, compra_id, self.config.codes)
+            )
+        elif url.path == "/pedido/exportarPedidoFaltaMP":
+            self._send_html(self._pending_materials(query))
+        else:
+            self.send_error(404)
+
+    def _send_asset(self, path: str) -> None:
+        """Dummy asset of 16 KiB, served after the asset latency"""
+        if self.config.asset_latency:
+            time.sleep(self.config.asset_latency)
+        extension = path.rsplit(".", 1)[-1]
+        body = b"/* */" if extension == "css" else bytes(16 * 1024)
+        self.send_response(200)
+        self.send_header("Content-Type", ASSET_TYPES.get(extension, "application/octet-stream"))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _pending_materials(self, query: dict) -> str:
+        """Export rows filtered by creation date and material, paginated like the report"""
+        records = pending_records(self.config.pending_rows, self.config.codes)
+        start = query.get("Pedido[_inicioCriacao]", [""])[0]
+        end = query.get("Pedido[_fimCriacao]", [""])[0]
+        if start and end:
+            first = dt.strptime(start, "%d/%m/%Y")
+            last = dt.strptime(end, "%d/%m/%Y")
+            records = [record for record in records if first <= record[0] <= last]
+        material = query.get("Pedido[_nomeMaterial]", [""])[0]
+        if material:
+            # The real report matches part of the material, not the exact code
+            records = [record for record in records if material in record[1]]
+
+        page_size = int(query.get("pageSize", ["0"])[0] or 0)
+        page = int(query.get("Pedido_page", ["1"])[0] or 1)
+        if page_size:
+            records = records[(page - 1) * page_size : page * page_size]
+        return fixtures.render_pending_materials([row for _, row in records])
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Accept any credentials on the login form"""
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if urlparse(self.path).path != "/site/login" or not form.get(
+            "LoginForm[username]"
+        ):
+            self._redirect("/site/login")
+            return
+        self._redirect(
+            "/", {"Set-Cookie": f"{SESSION_COOKIE}={SESSION_ID}; Path=/"}
+        )
+
+
+def start_server(
+    host: str = "127.0.0.1", port: int = 0, config: StandinConfig | None = None
+) -> ThreadingHTTPServer:
+    """Start the stand-in in a background thread, port 0 picks a free port"""
+    handler = type(
+        "ConfiguredStandinHandler",
+        (StandinHandler,),
+        {"config": config or StandinConfig()},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    """Run the stand-in until interrupted"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--nfe-lines", type=int, default=20)
+    parser.add_argument("--pending-rows", type=int, default=200)
+    parser.add_argument("--codes", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos")
+    parser.add_argument("--assets", type=int, default=0, help="css, png e fonte por página")
+    parser.add_argument("--asset-latency", type=float, default=0.0, help="segundos")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fração das páginas com erro 500"
+    )
+    args = parser.parse_args()
+
+    config = StandinConfig(
+        args.nfe_lines,
+        args.pending_rows,
+        args.codes,
+        args.latency,
+        args.assets,
+        args.asset_latency,
+        args.error_rate,
+    )
+    server = start_server(args.host, args.port, config)
+    print(f"Stand-in em http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
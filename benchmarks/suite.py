@@ -0,0 +1,234 @@
+"""Benchmark suite of the label pipeline stages on synthetic NFes
+
+Times each stage separately (HTML parse, reconciliation, QR generation and
+PDF write) for NFes of several sizes, tracks the peak memory of each stage
+with tracemalloc and saves the results as JSON, so two commits can be
+compared.
+
+The 5000 lines NFe takes most of the run (about 25 minutes in total),
+use --sizes 10 100 1000 for a quick check.
+
+Run from the project root:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --sizes 10 100 --compare tmp/benchmarks/<old>.json
+"""
+
+import argparse
+import copy
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime as dt
+from typing import Callable, List
+
+from benchmarks.fixtures import nfe_page, pending_materials_page
+from core.generate_labels import TMP_FOLDER, generate_nfe_labels
+from core.models import Material, NFeData, OrderData
+from core.parsing import iter_pending_materials, parse_nfe_page
+from core.qr_cache import qr_cache
+from core.reconciliation import reconcile
+
+SIZES: tuple[int, ...] = (10, 100, 1000, 5000)
+RESULTS_FOLDER: pathlib.Path = TMP_FOLDER / "benchmarks"
+
+
+@dataclass
+class StageResult:
+    """Timing and peak memory of one stage for one NFe size"""
+
+    stage: str
+    lines: int
+    seconds: float
+    runs: int
+    peak_kib: float
+
+
+def git_commit() -> str:
+    """Short hash of the checked out commit, "unknown" outside a repository"""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return result.stdout.strip()
+
+
+def measure(
+    stage: str,
+    lines: int,
+    function: Callable[[], object],
+    setup: Callable[[], None] | None = None,
+    repeat: int = 3,
+    memory: bool = True,
+) -> StageResult:
+    """Best time of a few runs, and the peak memory of one more run"""
+    best = float("inf")
+    runs = 0
+    while runs < repeat:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+        runs += 1
+        # Slow stages of the big NFes are run once
+        if best > 2:
+            break
+
+    peak = 0
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return StageResult(stage, lines, best, runs, peak / 1024)
+
+
+def run_size(lines: int, repeat: int, memory: bool) -> List[StageResult]:
+    """Run every stage on a synthetic NFe of the given number of lines"""
+    year = dt.now().year
+    html = nfe_page(lines, seed=lines)
+    # About half of the NFe codes have pending materials in the export
+    export_html = pending_materials_page(lines, seed=lines, codes=lines)
+    results: List[StageResult] = []
+
+    parsed: dict = {}
+
+    def parse() -> None:
+        nfe_number, supplier_name, orders = parse_nfe_page(html)
+        orders = list(orders)
+        codes = {order.code for order in orders}
+        materials: List[Material] = [
+            material
+            for material in iter_pending_materials(export_html, year)
+            if material.code in codes
+        ]
+        parsed["nfe"] = (nfe_number, supplier_name, orders)
+        parsed["pending"] = materials
+
+    results.append(measure("parse", lines, parse, repeat=repeat, memory=memory))
+
+    nfe_number, supplier_name, parsed_orders = parsed["nfe"]
+    inputs: dict = {}
+    reconciled: dict = {}
+
+    def copy_inputs() -> None:
+        inputs["orders"] = copy.deepcopy(parsed_orders)
+        inputs["pending"] = copy.deepcopy(parsed["pending"])
+
+    def reconcile_stage() -> None:
+        reconciled["result"] = reconcile(inputs["orders"], inputs["pending"])
+
+    results.append(
+        measure("reconcile", lines, reconcile_stage, copy_inputs, repeat, memory)
+    )
+
+    orders: List[OrderData] = reconciled["result"][0]
+    nfe_data = NFeData(
+        date=dt.now().strftime("%d/%m/%Y"),
+        nfe_number=nfe_number,
+        supplier_name=supplier_name,
+        orders=orders,
+        pending_materials=reconciled["result"][1],
+    )
+
+    def qr_codes() -> None:
+        for order in orders:
+            qr_cache.get_png(f"{order.code};{int(order.qty)}")
+
+    results.append(measure("qr", lines, qr_codes, qr_cache.clear, repeat, memory))
+
+    # The QR codes are warm, the PDF stage only measures the drawing and writing
+    def pdf() -> None:
+        generate_nfe_labels(nfe_data)
+
+    results.append(measure("pdf", lines, pdf, repeat=repeat, memory=memory))
+    return results
+
+
+def compare(results: List[StageResult], baseline_path: str, threshold: float) -> None:
+    """Print the time ratio of each stage against a previous results file"""
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = {
+            (result["stage"], result["lines"]): result
+            for result in json.load(file)["results"]
+        }
+    print(f"\nComparação com {baseline_path}")
+    for result in results:
+        old = baseline.get((result.stage, result.lines))
+        if old is None or not old["seconds"]:
+            continue
+        ratio = result.seconds / old["seconds"]
+        # Differences under a millisecond are noise
+        slower = result.seconds - old["seconds"] > 0.001
+        flag = "  REGRESSÃO" if slower and ratio > 1 + threshold else ""
+        print(
+            f"{result.stage:>9} {result.lines:>5} linhas: "
+            f"{old['seconds'] * 1000:9.1f} ms -> {result.seconds * 1000:9.1f} ms "
+            f"({ratio:.2f}x){flag}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the tracemalloc runs"
+    )
+    parser.add_argument("--output", help="JSON file, tmp/benchmarks/<commit>.json")
+    parser.add_argument("--compare", help="previous JSON file to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="slowdown flagged as regression"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Run the suite and save the results"""
+    args = parse_args()
+    commit = git_commit()
+    results: List[StageResult] = []
+    for lines in args.sizes:
+        for result in run_size(lines, args.repeat, not args.no_memory):
+            results.append(result)
+            peak = "" if args.no_memory else f", pico {result.peak_kib:9.0f} KiB"
+            print(
+                f"{result.stage:>9} {result.lines:>5} linhas: "
+                f"{result.seconds * 1000:9.1f} ms{peak}"
+            )
+
+    output = pathlib.Path(args.output or RESULTS_FOLDER / f"{commit}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "commit": commit,
+                "date": dt.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "results": [asdict(result) for result in results],
+            },
+            file,
+            indent=4,
+        )
+    print(f"Resultados salvos em {output}")
+
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
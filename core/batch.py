@@ -0,0 +1,181 @@
+"""Module to scrape and generate labels for many negotiations concurrently"""
+
+import os
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from core.generate_labels import TMP_FOLDER, generate_nfe_labels
+from core.job_store import JobStore
+from core.metrics import metrics
+from core.scraping import CargaMaquinaClient
+
+BATCH_FOLDER: pathlib.Path = TMP_FOLDER / "batch"
+
+
+@dataclass
+class BatchResult:
+    """Result of one negotiation in a batch"""
+
+    negociation_id: str
+    ok: bool
+    output_dir: str
+    elapsed: float
+    files: List[str] = field(default_factory=list)
+    documents: Dict[str, bytes] = field(default_factory=dict, repr=False)
+    error: str = ""
+    cached: bool = False
+    stale: bool = False
+
+
+def read_negociation_ids(sources: List[str]) -> List[str]:
+    """Read negotiation IDs from files (one per line) or comma separated lists"""
+    negociation_ids: List[str] = []
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source, "r", encoding="utf-8") as file:
+                items = file.read().replace(",", "\n").splitlines()
+        else:
+            items = source.split(",")
+        negociation_ids.extend(item.strip() for item in items if item.strip())
+    # Repeated IDs would print the same labels twice
+    return list(dict.fromkeys(negociation_ids))
+
+
+def process_negociation(
+    client: CargaMaquinaClient,
+    negociation_id: str,
+    output_root: pathlib.Path = BATCH_FOLDER,
+    label_format: str = "pdf",
+    render_workers: int = 1,
+    store: JobStore | None = None,
+    rescrape: bool = False,
+) -> BatchResult:
+    """Scrape one negotiation and generate its labels in its own folder
+
+    With a store, a negotiation already saved in it is not scraped again
+    unless rescrape is set, and a scraped one is saved in it. A saved one is
+    reconciled with the current pending materials, its labels are reused when
+    the result did not change and rendered again (stale) when it did.
+    """
+    start = time.perf_counter()
+    safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in negociation_id)
+    output_dir = output_root / safe_id
+
+    # A label left open in a viewer on Windows fails this negotiation only
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for old_file in output_dir.glob("*_labels.*"):
+            old_file.unlink()
+        documents: Dict[str, bytes] = {}
+        stale = False
+        # Receipts saved before the parsed NFe was kept are scraped again
+        parsed = (
+            store.get_parsed_nfe(negociation_id)
+            if store is not None and not rescrape
+            else None
+        )
+        cached = parsed is not None
+        if cached:
+            nfe_data = client.reconcile_nfe(parsed, str(output_dir))
+            stale = nfe_data != store.get_nfe_data(negociation_id)
+            if not stale:
+                documents = store.get_documents(negociation_id, label_format)
+        else:
+            scraped = client.scrape_nfe(negociation_id, str(output_dir))
+            if scraped is None:
+                raise ValueError("Não foi possível obter os dados da NFe")
+            parsed, nfe_data = scraped
+        if documents:
+            for name, document in documents.items():
+                (output_dir / name).write_bytes(document)
+        else:
+            documents = generate_nfe_labels(
+                nfe_data, output_dir, label_format, render_workers
+            )
+            if store is not None:
+                store.save(negociation_id, nfe_data, documents, label_format, parsed)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        elapsed = time.perf_counter() - start
+        metrics.observe("batch.negociation", elapsed, status="error")
+        return BatchResult(
+            negociation_id=negociation_id,
+            ok=False,
+            output_dir=str(output_dir),
+            elapsed=elapsed,
+            error=f"{type(e).__name__}: {e}",
+        )
+
+    elapsed = time.perf_counter() - start
+    status = ("stale" if stale else "cached") if cached else "ok"
+    metrics.observe("batch.negociation", elapsed, status=status)
+    return BatchResult(
+        negociation_id=negociation_id,
+        ok=True,
+        output_dir=str(output_dir),
+        elapsed=elapsed,
+        files=[str(output_dir / name) for name in documents],
+        documents=documents,
+        cached=cached,
+        stale=stale,
+    )
+
+
+def run_batch(
+    client: CargaMaquinaClient,
+    negociation_ids: List[str],
+    workers: int = 4,
+    output_root: pathlib.Path = BATCH_FOLDER,
+    label_format: str = "pdf",
+    render_workers: int = 1,
+    store: JobStore | None = None,
+    rescrape: bool = False,
+) -> List[BatchResult]:
+    """Process the negotiations on a bounded pool, results in the input order"""
+    results: dict[str, BatchResult] = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            executor.submit(
+                process_negociation,
+                client,
+                negociation_id,
+                output_root,
+                label_format,
+                render_workers,
+                store,
+                rescrape,
+            ): negociation_id
+            for negociation_id in negociation_ids
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.negociation_id] = result
+    return [results[negociation_id] for negociation_id in negociation_ids]
+
+
+def print_summary(results: List[BatchResult], elapsed: float) -> None:
+    """Print the success or failure of each negotiation"""
+    print("\nResumo do lote")
+    for result in results:
+        if not result.ok:
+            status = "FALHA"
+        elif result.stale:
+            # The pending materials changed since the negotiation was saved
+            status = "SALVA, PENDÊNCIAS MUDARAM"
+        else:
+            status = "SALVA" if result.cached else "OK"
+        detail = ", ".join(result.files) if result.ok else result.error
+        print(f"{result.negociation_id}: {status} ({result.elapsed:.1f}s) {detail}")
+    cached = sum(1 for result in results if result.ok and result.cached)
+    if cached:
+        print(
+            f"{cached} negociações já salvas foram reconciliadas sem consultar "
+            "a NFe de novo, use --rescrape para consultar"
+        )
+    succeeded = sum(1 for result in results if result.ok)
+    print(
+        f"{succeeded}/{len(results)} negociações processadas em {elapsed:.1f}s "
+        f"({len(results) / elapsed if elapsed else 0:.2f}/s)"
+    )
@@ -0,0 +1,183 @@
+"""Module with a pool of Chrome drivers for concurrent scraping
+
+Each negotiation checks out its own driver, so several NFes are scraped at
+the same time. Drivers are recycled after max_uses checkouts or when
+they stop answering. By default they are the visible Chrome the client
+always used; the lean profile runs headless, returns the page load when
+the DOM is ready and doesn't download images, fonts and stylesheets.
+"""
+
+import contextlib
+import functools
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterator, List
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+
+from core.metrics import metrics
+
+BLOCKED_URLS: List[str] = [
+    "*.css",
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.svg",
+    "*.ico",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+]
+
+
+def chrome_options(lean: bool = False, headless: bool = False) -> Options:
+    """Chrome options, with the eager page load and no images when lean"""
+    options = Options()
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+    if lean:
+        options.page_load_strategy = "eager"
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2}
+        )
+    return options
+
+
+def create_driver(lean: bool = False, headless: bool = False) -> webdriver.Chrome:
+    """Open Chrome, blocking the stylesheets and fonts when lean"""
+    driver = webdriver.Chrome(options=chrome_options(lean, headless))
+    if lean:
+        # Chrome has no setting for stylesheets and fonts, the DevTools can block them
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+def is_alive(driver: webdriver.Chrome) -> bool:
+    """Whether the browser still answers"""
+    try:
+        _ = driver.current_url
+    except WebDriverException:
+        return False
+    return True
+
+
+@dataclass
+class PooledDriver:
+    """A driver of the pool, its uses and the version of its cookies"""
+
+    driver: webdriver.Chrome
+    uses: int = 0
+    cookies_version: int = -1
+
+
+class DriverPool:
+    """Bounded pool of drivers, checked out by one thread at a time"""
+
+    def __init__(
+        self,
+        size: int = 1,
+        max_uses: int = 50,
+        factory: Callable[[], webdriver.Chrome] | None = None,
+        lean: bool = False,
+    ):
+        self.size = max(size, 1)
+        self.max_uses = max_uses
+        # The lean profile is still being verified, so it is opt-in
+        self.factory = factory or functools.partial(
+            create_driver, lean=lean, headless=lean
+        )
+        self.created: int = 0
+        self.recycled: int = 0
+        self._idle: "queue.LifoQueue[PooledDriver]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._all: List[PooledDriver] = []
+        self._closed = False
+
+    def _create(self) -> PooledDriver:
+        with metrics.span("scraping.driver_start"):
+            pooled = PooledDriver(self.factory())
+        with self._lock:
+            self.created += 1
+            self._all.append(pooled)
+        metrics.count("drivers", result="created")
+        return pooled
+
+    def _discard(self, pooled: PooledDriver, reason: str) -> None:
+        with self._lock:
+            if pooled in self._all:
+                self._all.remove(pooled)
+            if reason != "closed":
+                self.recycled += 1
+        metrics.count("drivers", result=reason)
+        try:
+            pooled.driver.quit()
+        except WebDriverException:
+            pass
+
+    @contextlib.contextmanager
+    def checkout(self, timeout: float | None = None) -> Iterator[PooledDriver]:
+        """Borrow a driver, waiting while all of them are in use"""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"Nenhum navegador livre em {timeout}s")
+        try:
+            if self._closed:
+                raise RuntimeError("O pool de navegadores foi fechado")
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                pooled = self._create()
+            try:
+                yield pooled
+            except BaseException:
+                # A failed page may have been the browser crashing
+                if not is_alive(pooled.driver):
+                    self._discard(pooled, "crashed")
+                else:
+                    self._give_back(pooled)
+                raise
+            self._give_back(pooled)
+        finally:
+            self._slots.release()
+
+    def _give_back(self, pooled: PooledDriver) -> None:
+        pooled.uses += 1
+        if self._closed or pooled.uses >= self.max_uses:
+            self._discard(pooled, "recycled")
+        else:
+            self._idle.put(pooled)
+
+    def warm_up(self, count: int | None = None) -> None:
+        """Open drivers ahead of the first requests, in free slots of the pool"""
+        wanted = min(count or self.size, self.size)
+        while not self._closed:
+            # Holding a slot, no checkout can open a driver past the size
+            if not self._slots.acquire(blocking=False):
+                return
+            try:
+                with self._lock:
+                    if len(self._all) >= wanted:
+                        return
+                self._idle.put(self._create())
+            finally:
+                self._slots.release()
+
+    def close(self) -> None:
+        """Quit every driver, the ones in use are quit when given back"""
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled, "closed")
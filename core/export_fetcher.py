@@ -0,0 +1,321 @@
+"""Module to download the pending materials export in parallel chunks
+
+The export can also be queried once per material code, filtered by the
+server. QueryPlanner chooses between those queries and the whole export
+from the number of codes and the latency seen so far.
+"""
+
+import math
+import threading
+import time
+from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from datetime import date
+from typing import Dict, Iterator, List
+
+import requests
+
+from core.models import Material
+from core.parsing import iter_export_rows, material_from_cells
+from core.session_store import check_response
+
+PAGE_PARAM: str = "Pedido_page"
+
+
+@dataclass
+class ChunkStats:
+    """Latency and size of one downloaded page of the export"""
+
+    start: date
+    end: date
+    page: int
+    rows: int
+    bytes: int
+    latency: float
+    material: str = ""
+    attempts: int = 1
+
+
+def export_params(
+    start: date, end: date, page_size: int, material: str = ""
+) -> Dict[str, str]:
+    """Filters of the exportarPedidoFaltaMP report for a creation date range"""
+    return {
+        "Pedido[_nomeMaterial]": material,
+        "Pedido[_solicitante]": "",
+        "Pedido[status_id]": "",
+        "Pedido[situacao]": "TODAS",
+        "Pedido[_qtdeFornecida]": "Parcialmente",
+        "Pedido[_inicioCriacao]": start.strftime("%d/%m/%Y"),
+        "Pedido[_fimCriacao]": end.strftime("%d/%m/%Y"),
+        "pageSize": str(page_size),
+    }
+
+
+def date_chunks(year: int, months_per_chunk: int = 1) -> List[tuple[date, date]]:
+    """Split the whole year in ranges of creation dates"""
+    return range_chunks(date(year, 1, 1), date(year, 12, 31), months_per_chunk)
+
+
+def range_chunks(
+    start: date, end: date, months_per_chunk: int = 1
+) -> List[tuple[date, date]]:
+    """Split a range of creation dates in ranges of whole months, clipped to it"""
+    chunks: List[tuple[date, date]] = []
+    year, month = start.year, start.month
+    while date(year, month, 1) <= end:
+        last_year, last_month = divmod(month - 1 + months_per_chunk - 1, 12)
+        last_year, last_month = year + last_year, last_month + 1
+        chunk_end = date(last_year, last_month, monthrange(last_year, last_month)[1])
+        chunks.append((max(start, date(year, month, 1)), min(end, chunk_end)))
+        year, month = (last_year + 1, 1) if last_month == 12 else (last_year, last_month + 1)
+    return chunks
+
+
+class PendingMaterialsFetcher:
+    """Fetch the export by date range chunks and pages over a pooled session"""
+
+    def __init__(
+        self,
+        session: requests.Session,
+        url: str,
+        workers: int = 6,
+        page_size: int = 500,
+        months_per_chunk: int = 1,
+        max_pages: int = 200,
+        timeout: int = 20,
+        retries: int = 2,
+        retry_backoff: float = 0.5,
+    ):
+        self.session = session
+        self.url = url
+        self.workers = workers
+        self.page_size = page_size
+        self.months_per_chunk = months_per_chunk
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        # Stats of the last download started, each call fills its own list
+        self.last_stats: List[ChunkStats] = []
+        self._stats_lock = threading.Lock()
+
+    def _get_page(
+        self, params: Dict[str, str], cookies: dict
+    ) -> tuple[requests.Response, int]:
+        """Get one page of the export and the attempts it took
+
+        Server errors and dropped connections are retried up to retries times,
+        waiting retry_backoff, then twice as long, between the attempts.
+        """
+        attempt = 1
+        while True:
+            try:
+                response = self.session.get(
+                    self.url, params=params, cookies=cookies, timeout=self.timeout
+                )
+                if response.status_code < 500 or attempt > self.retries:
+                    response.raise_for_status()
+                    return response, attempt
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt > self.retries:
+                    raise
+            time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            attempt += 1
+
+    def _fetch_chunk(
+        self,
+        start: date,
+        end: date,
+        cookies: dict,
+        material: str,
+        stats: List[ChunkStats],
+    ) -> List[List[str]]:
+        """Fetch every page of a date range, until a page is not full"""
+        rows: List[List[str]] = []
+        previous_first_row: List[str] | None = None
+        for page in range(1, self.max_pages + 1):
+            params = export_params(start, end, self.page_size, material)
+            params[PAGE_PARAM] = str(page)
+            request_start = time.perf_counter()
+            response, attempts = self._get_page(params, cookies)
+            check_response(response)
+            page_rows = list(iter_export_rows(response.text))
+            with self._stats_lock:
+                stats.append(
+                    ChunkStats(
+                        start=start,
+                        end=end,
+                        page=page,
+                        rows=len(page_rows),
+                        bytes=len(response.content),
+                        latency=time.perf_counter() - request_start,
+                        material=material,
+                        attempts=attempts,
+                    )
+                )
+
+            # A server that ignores the page parameter repeats the first page
+            if page_rows and page_rows[0] == previous_first_row:
+                break
+            rows.extend(page_rows)
+            if len(page_rows) < self.page_size:
+                break
+            previous_first_row = page_rows[0]
+        return rows
+
+    def iter_cells(
+        self,
+        start: date,
+        end: date,
+        cookies: dict | None = None,
+        stats: List[ChunkStats] | None = None,
+    ) -> Iterator[List[str]]:
+        """Yield the cells of the rows created in the range as the chunks arrive
+
+        The stats of the requests are appended to stats, or to a new list,
+        and last_stats points to it.
+        """
+        stats = [] if stats is None else stats
+        self.last_stats = stats
+        chunks = range_chunks(start, end, self.months_per_chunk)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self._fetch_chunk, chunk_start, chunk_end, cookies or {}, "", stats
+                )
+                for chunk_start, chunk_end in chunks
+            ]
+            for future in as_completed(futures):
+                yield from future.result()
+
+    def iter_materials(
+        self,
+        year: int,
+        cookies: dict | None = None,
+        stats: List[ChunkStats] | None = None,
+    ) -> Iterator[Material]:
+        """Yield the pending materials of the year as the chunks arrive"""
+        for cells in self.iter_cells(
+            date(year, 1, 1), date(year, 12, 31), cookies, stats
+        ):
+            material = material_from_cells(cells, year)
+            if material is not None:
+                yield material
+
+    def fetch_codes(
+        self, codes: List[str], year: int, cookies: dict | None = None
+    ) -> tuple[Dict[str, List[Material]], List[ChunkStats]]:
+        """Query the year once per code in parallel, with the stats of the requests"""
+        stats: List[ChunkStats] = []
+        index: Dict[str, List[Material]] = {code: [] for code in codes}
+        start, end = date(year, 1, 1), date(year, 12, 31)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(
+                    self._fetch_chunk, start, end, cookies or {}, code, stats
+                ): code
+                for code in index
+            }
+            for future in as_completed(futures):
+                code = futures[future]
+                for cells in future.result():
+                    material = material_from_cells(cells, year)
+                    # The report matches part of the material name, other codes come along
+                    if material is not None and material.code == code:
+                        index[code].append(material)
+        return index, stats
+
+    def print_stats(self) -> None:
+        """Print the latency of each downloaded page"""
+        for stats in sorted(self.last_stats, key=lambda s: (s.start, s.page)):
+            print(
+                f"{stats.start:%d/%m/%Y} - {stats.end:%d/%m/%Y} página {stats.page}: "
+                f"{stats.rows} linhas, {stats.bytes / 1024:.0f} KiB, "
+                f"{stats.latency * 1000:.0f} ms"
+            )
+
+
+@dataclass
+class StrategyStats:
+    """Lookups, requests, bytes and time of one way of getting the pending materials"""
+
+    lookups: int = 0
+    requests: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    # Moving averages of one request and of one whole lookup
+    request_latency: float | None = None
+    lookup_seconds: float | None = None
+
+
+class QueryPlanner:
+    """Choose per-code queries or the whole export by their expected time
+
+    The export takes ceil(chunks / workers) rounds of requests and is cached
+    for every NFe, the per-code queries take ceil(codes / workers) rounds
+    for one NFe. Until both were seen, the fewer rounds win.
+    """
+
+    def __init__(self, workers: int = 6, chunks: int = 12, smoothing: float = 0.3):
+        self.workers = workers
+        self.chunks = chunks
+        self.smoothing = smoothing
+        self.strategies: Dict[str, StrategyStats] = {
+            "codes": StrategyStats(),
+            "export": StrategyStats(),
+        }
+        self._lock = threading.Lock()
+
+    def _average(self, old: float | None, new: float) -> float:
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def record(self, strategy: str, stats: List[ChunkStats], seconds: float) -> None:
+        """Add the requests of one lookup to the stats of the strategy"""
+        with self._lock:
+            totals = self.strategies[strategy]
+            totals.lookups += 1
+            totals.requests += len(stats)
+            totals.bytes += sum(chunk.bytes for chunk in stats)
+            totals.seconds += seconds
+            for chunk in stats:
+                totals.request_latency = self._average(
+                    totals.request_latency, chunk.latency
+                )
+            totals.lookup_seconds = self._average(totals.lookup_seconds, seconds)
+
+    def report(self) -> Dict[str, Dict]:
+        """Stats of each strategy as plain dictionaries"""
+        with self._lock:
+            return {
+                strategy: asdict(stats) for strategy, stats in self.strategies.items()
+            }
+
+    def estimate(self, strategy: str, codes: int) -> float | None:
+        """Expected seconds of a lookup of the codes, None before any request"""
+        with self._lock:
+            codes_stats = self.strategies["codes"]
+            export_stats = self.strategies["export"]
+            if strategy == "export" and export_stats.lookup_seconds is not None:
+                return export_stats.lookup_seconds
+            # Any request of the report tells the latency of the other strategy
+            latency = (
+                codes_stats.request_latency
+                if strategy == "codes" and codes_stats.request_latency is not None
+                else export_stats.request_latency or codes_stats.request_latency
+            )
+        if latency is None:
+            return None
+        count = codes if strategy == "codes" else self.chunks
+        return math.ceil(count / self.workers) * latency
+
+    def choose(self, codes: int) -> str:
+        """Strategy expected to be faster for an NFe with the number of codes"""
+        codes_seconds = self.estimate("codes", codes)
+        export_seconds = self.estimate("export", codes)
+        if codes_seconds is None or export_seconds is None:
+            codes_rounds = math.ceil(codes / self.workers)
+            export_rounds = math.ceil(self.chunks / self.workers)
+            return "codes" if codes_rounds < export_rounds else "export"
+        return "codes" if codes_seconds < export_seconds else "export"
@@ -1,302 +1,411 @@
-"""Module to generate and print labels from a json file"""
-
-import json
-import pathlib
-import qrcode
-from PIL import Image
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import mm
-from reportlab.lib.colors import white, black
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-
-
-WIDTH, HEIGHT = 85 * mm, 70 * mm
-MARGIN = 5 * mm
-LOGO_PATH = pathlib.Path(__file__).parent / "assets/img/fk-logo.png"
-
-TMP_FOLDER = pathlib.Path().parent / "tmp"
-TMP_FOLDER.mkdir(exist_ok=True)
-
-FONTS_PATH: pathlib.Path = pathlib.Path(__file__).parent / "assets/fonts"
-FONTS: list[TTFont] = [
-    TTFont("Arial", FONTS_PATH / "Arial.ttf"),
-    TTFont("Arial-Bold", FONTS_PATH / "Arial-Bold.ttf"),
-]
-for font in FONTS:
-    pdfmetrics.registerFont(font)
-
-
-def get_middle_x_coord(pdf, text: str, font_name, font_size) -> float:
-    """Get the middle x coordinate of the text"""
-    text_width = pdf.stringWidth(text, font_name, font_size)
-    x: float = (WIDTH - text_width) / 2
-    return x
-
-
-def draw_text(
-    pdf: canvas,
-    y: float,
-    text: str,
-    x: float = None,
-    max_width: float = 75 * mm,
-    font_name: str = "Arial-Bold",
-    font_size=22,
-    pending: bool = False,
-    wrap: bool = False,
-) -> None:
-    """Draw responsive text in the middle of the page"""
-
-    if wrap:
-        font_size = 8
-        pdf.setFont(font_name, font_size)
-        words = text.split(" ")
-        lines = []
-        current_line = ""
-        for word in words:
-            test_line = f"{current_line} {word}".strip()
-            if pdf.stringWidth(test_line, font_name, font_size) <= max_width:
-                current_line = test_line
-            else:
-                lines.append(current_line)
-                current_line = word
-        lines.append(current_line)
-        for line in lines:
-            if x is None:
-                x = get_middle_x_coord(pdf, line, font_name, font_size)
-                if pending:
-                    x -= 5 * mm
-            pdf.drawString(x, y, line)
-            y -= font_size + 5
-
-        return
-
-    while font_size > 1:  # Limite inferior para o tamanho da fonte
-        text_width = pdf.stringWidth(text, font_name, font_size)
-        if text_width <= max_width:
-            break  # O texto cabe dentro do limite
-        font_size -= 1  # Reduz o tamanho da fonte
-
-    pdf.setFont(font_name, font_size)
-
-    if x is None:
-        x = get_middle_x_coord(pdf, text, font_name, font_size)
-        if pending:
-            x -= 5 * mm
-        pdf.drawString(x, y, text)
-
-    else:
-        pdf.drawString(x, y, text)
-
-
-def generate_pending_materials_labels(data: dict):
-    """Generate and print labels from a json file"""
-
-    pdf = canvas.Canvas(
-        f"{TMP_FOLDER / 'pending_labels.pdf'}", pagesize=(WIDTH, HEIGHT)
-    )
-    rectangle_x = WIDTH - 10 * mm
-
-    if data["pending_materials"] == []:
-        return
-
-    for material in data["pending_materials"]:
-
-        if material["pending_qty"] == 0:
-            continue
-
-        pdf.setFillColor(black)
-        pdf.rect(0, 0, WIDTH, HEIGHT, stroke=0, fill=1)
-        pdf.setFillColor(white)
-        pdf.rect(
-            rectangle_x,
-            MARGIN,
-            10 * mm,
-            HEIGHT - MARGIN - MARGIN,
-            stroke=0,
-            fill=1,
-        )
-        pdf.rect(5*mm, 5*mm, WIDTH-20*mm, 10*mm, stroke=0, fill=1)
-
-        draw_text(
-            pdf, HEIGHT - 15 * mm, material["op_number"], pending=True, font_size=18
-        )
-        draw_text(
-            pdf,
-            HEIGHT - 30 * mm,
-            material["product"],
-            pending=True,
-            font_name="Arial",
-            font_size=21,
-        )
-        draw_text(
-            pdf,
-            HEIGHT - 45 * mm,
-            material["code"],
-            pending=True,
-            font_name="Arial",
-            font_size=19.5,
-        )
-        pdf.setFillColor(black)
-        draw_text(
-            pdf,
-            8 * mm,
-            f"QUANTIDADE: {int(material["pending_qty"])} UND",
-            pending=True,
-            font_name="Arial",
-            font_size=10,
-        )
-        pdf.showPage()
-
-    pdf.save()
-
-
-def generate_stock_labels(data: dict):
-    """Generate and print labels from a json file"""
-
-    pdf = canvas.Canvas(f"{TMP_FOLDER / 'stock_labels.pdf'}", pagesize=(WIDTH, HEIGHT))
-
-    date: str = data["date"]
-    nfe: int = data["nfe_number"]
-    supplier_name: str = data["supplier_name"]
-
-    if data["orders"] == []:
-        return
-
-    for order in data["orders"]:
-
-        if order["qty"] == 0:
-            continue
-
-        # Generate QRCode
-        logo = Image.open(LOGO_PATH)
-        qr_size_mm = 15
-        qr_pixels = int(qr_size_mm * (300 / 25.4))
-
-        qr = qrcode.QRCode(
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=qr_pixels // 41,
-            border=1
-        )
-        qr.add_data(f"{order['code']};{int(order['qty'])}")
-        qr.make()
-
-        # Generate QRCode Image
-        qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-        qr_img = qr_img.resize((qr_pixels, qr_pixels), Image.Resampling.LANCZOS)
-        logo_size = int(qr_pixels * 0.3)
-        logo = logo.resize((logo_size, logo_size), Image.Resampling.LANCZOS)
-        pos = ((qr_img.size[0] - logo.size[0]) // 2, (qr_img.size[1] - logo.size[1]) // 2)
-        qr_img.paste(logo, pos)
-        qr_code_path = f"./tmp/qr-code-{order['code']}.png"
-        qr_img.save(qr_code_path)
-
-        # Generate Label
-        for _ in range(2):
-            pdf.setFillColor(black)
-            pdf.rect(0, HEIGHT - 40 * mm, width=WIDTH, height=10 * mm, stroke=0, fill=1)
-            pdf.setStrokeColor(white)
-            pdf.rect(0.4 * mm, 5 * mm, 65 * mm, 15 * mm, stroke=1, fill=0)
-
-            draw_text(
-                pdf, HEIGHT - MARGIN, date, MARGIN, max_width=80 * mm, font_size=10
-            )
-
-            # QrCode with logo
-            pdf.drawImage(
-                qr_code_path,
-                MARGIN,
-                HEIGHT - 25 * mm,
-                width=15 * mm,
-                height=15 * mm,
-                mask="auto",
-            )
-
-            draw_text(
-                pdf,
-                HEIGHT - 7 * mm,
-                f"NF {nfe}",
-                max_width=85 * mm,
-                font_name="Arial-Bold",
-                font_size=13,
-            )
-
-            draw_text(
-                pdf,
-                HEIGHT - 6 * mm,
-                f"{order["address"]}",
-                x=65 * mm,
-                max_width=15 * mm,
-                font_name="Arial",
-                font_size=5,
-                wrap=True,
-            )
-
-            draw_text(
-                pdf,
-                HEIGHT - 15 * mm,
-                order["order"],
-                max_width=85 * mm,
-                font_name="Arial-Bold",
-                font_size=11,
-            )
-
-            draw_text(
-                pdf,
-                HEIGHT - 25 * mm,
-                supplier_name,
-                max_width=85 * mm,
-                font_name="Arial-Bold",
-                font_size=22,
-            )
-            pdf.setFillColor(white)
-            draw_text(
-                pdf,
-                HEIGHT - 37 * mm,
-                order["code"],
-                max_width=85 * mm,
-                font_name="Arial",
-                font_size=16,
-            )
-            pdf.setFillColor(black)
-            draw_text(
-                pdf,
-                HEIGHT - 45 * mm,
-                order["description"],
-                max_width=82 * mm,
-                font_name="Arial",
-                font_size=8,
-                wrap=True,
-            )
-            draw_text(
-                pdf,
-                MARGIN + 10 * mm - MARGIN,
-                f"Quantidade: {int(order['qty'])} {order['unit_type']}",
-                max_width=85 * mm,
-                font_name="Arial",
-                font_size=10,
-            )
-            draw_text(
-                pdf,
-                MARGIN,
-                f"Lote Total: {int(order['qty_total'])} {order['unit_type']}",
-                max_width=85 * mm,
-                font_name="Arial",
-                font_size=10.5,
-            )
-            pdf.showPage()
-    pdf.save()
-
-
-def generate_nfe_labels():
-    """Generate and print labels from a json file"""
-
-    with open(f"{TMP_FOLDER / 'nfe_data.json'}", "r", encoding="utf-8") as file:
-        data = json.load(file)
-        if data["pending_materials"] != []:
-            generate_pending_materials_labels(data)
-        generate_stock_labels(data)
-
-
-if __name__ == "__main__":
-    generate_nfe_labels()
+"""Module to generate the label PDFs of an NFe"""
+
+import dataclasses
+import functools
+import io
+import multiprocessing
+import os
+import pathlib
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import mm
+from reportlab.lib.colors import white, black
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from core.metrics import metrics
+from core.models import NFeData
+from core.options import LABEL_FORMATS
+from core.qr_cache import qr_cache
+from core.text_layout import layout_text, string_width
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # Environments synced before pypdf was added render on one process
+    PdfReader = PdfWriter = None
+
+
+WIDTH, HEIGHT = 85 * mm, 70 * mm
+MARGIN = 5 * mm
+
+# Orders below which starting the processes costs more than it saves
+PARALLEL_THRESHOLD: int = 100
+
+# Shared by the NFes of a batch or of the service, see get_render_pool
+_render_pool: ProcessPoolExecutor | None = None
+_render_pool_lock = threading.Lock()
+
+# Created on first write, importing this module must not touch the disk
+TMP_FOLDER = pathlib.Path().parent / "tmp"
+
+FONTS_PATH: pathlib.Path = pathlib.Path(__file__).parent / "assets/fonts"
+FONT_FILES: dict[str, str] = {
+    "Arial": "Arial.ttf",
+    "Arial-Bold": "Arial-Bold.ttf",
+}
+
+
+@functools.cache
+def register_fonts() -> None:
+    """Load and register the TTF fonts once, before the first text is measured"""
+    for font_name, file_name in FONT_FILES.items():
+        pdfmetrics.registerFont(TTFont(font_name, FONTS_PATH / file_name))
+
+
+def get_middle_x_coord(pdf, text: str, font_name, font_size) -> float:
+    """Get the middle x coordinate of the text"""
+    text_width = string_width(text, font_name, font_size)
+    x: float = (WIDTH - text_width) / 2
+    return x
+
+
+def draw_text(
+    pdf: canvas,
+    y: float,
+    text: str,
+    x: float = None,
+    max_width: float = 75 * mm,
+    font_name: str = "Arial-Bold",
+    font_size=22,
+    pending: bool = False,
+    wrap: bool = False,
+) -> None:
+    """Draw responsive text in the middle of the page"""
+
+    # Fitted size and wrapped lines are memoized for repeated texts
+    font_size, lines = layout_text(text, font_name, font_size, max_width, wrap)
+    pdf.setFont(font_name, font_size)
+
+    for line in lines:
+        if x is None:
+            x = get_middle_x_coord(pdf, line, font_name, font_size)
+            if pending:
+                x -= 5 * mm
+        pdf.drawString(x, y, line)
+        y -= font_size + 5
+
+
+@metrics.timed("labels.pending")
+def generate_pending_materials_labels(nfe_data: NFeData) -> bytes | None:
+    """Generate the pending materials labels PDF"""
+    register_fonts()
+
+    if nfe_data.pending_materials == []:
+        return None
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(WIDTH, HEIGHT))
+    rectangle_x = WIDTH - 10 * mm
+
+    # Background rectangles, stored once and referenced by every page
+    pdf.beginForm("pending_background")
+    pdf.setFillColor(black)
+    pdf.rect(0, 0, WIDTH, HEIGHT, stroke=0, fill=1)
+    pdf.setFillColor(white)
+    pdf.rect(
+        rectangle_x,
+        MARGIN,
+        10 * mm,
+        HEIGHT - MARGIN - MARGIN,
+        stroke=0,
+        fill=1,
+    )
+    pdf.rect(5*mm, 5*mm, WIDTH-20*mm, 10*mm, stroke=0, fill=1)
+    pdf.endForm()
+
+    for material in nfe_data.pending_materials:
+
+        if material.pending_qty == 0:
+            continue
+
+        pdf.doForm("pending_background")
+        pdf.setFillColor(white)
+        draw_text(
+            pdf, HEIGHT - 15 * mm, material.op_number, pending=True, font_size=18
+        )
+        draw_text(
+            pdf,
+            HEIGHT - 30 * mm,
+            material.product,
+            pending=True,
+            font_name="Arial",
+            font_size=21,
+        )
+        draw_text(
+            pdf,
+            HEIGHT - 45 * mm,
+            material.code,
+            pending=True,
+            font_name="Arial",
+            font_size=19.5,
+        )
+        pdf.setFillColor(black)
+        draw_text(
+            pdf,
+            8 * mm,
+            f"QUANTIDADE: {int(material.pending_qty)} UND",
+            pending=True,
+            font_name="Arial",
+            font_size=10,
+        )
+        pdf.showPage()
+
+    pdf.save()
+    return buffer.getvalue()
+
+
+@metrics.timed("labels.stock")
+def generate_stock_labels(nfe_data: NFeData) -> bytes | None:
+    """Generate the stock labels PDF, two copies of each order"""
+    register_fonts()
+
+    date: str = nfe_data.date
+    nfe: int = nfe_data.nfe_number
+    supplier_name: str = nfe_data.supplier_name
+
+    if nfe_data.orders == []:
+        return None
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(WIDTH, HEIGHT))
+
+    # Header bar and box, stored once and referenced by every label
+    pdf.beginForm("stock_background")
+    pdf.setFillColor(black)
+    pdf.rect(0, HEIGHT - 40 * mm, width=WIDTH, height=10 * mm, stroke=0, fill=1)
+    pdf.setStrokeColor(white)
+    pdf.rect(0.4 * mm, 5 * mm, 65 * mm, 15 * mm, stroke=1, fill=0)
+    pdf.endForm()
+
+    for index, order in enumerate(nfe_data.orders):
+
+        if order.qty == 0:
+            continue
+
+        # QRCode with logo, rendered once per payload and kept in memory
+        qr_code_image = qr_cache.get_image(order.code, int(order.qty))
+
+        # Generate Label once as a form, both copies reference the same content
+        label_form = f"stock_label_{index}"
+        pdf.beginForm(label_form)
+        pdf.doForm("stock_background")
+        pdf.setFillColor(black)
+
+        draw_text(
+            pdf, HEIGHT - MARGIN, date, MARGIN, max_width=80 * mm, font_size=10
+        )
+
+        # QrCode with logo
+        pdf.drawImage(
+            qr_code_image,
+            MARGIN,
+            HEIGHT - 25 * mm,
+            width=15 * mm,
+            height=15 * mm,
+            mask="auto",
+        )
+
+        draw_text(
+            pdf,
+            HEIGHT - 7 * mm,
+            f"NF {nfe}",
+            max_width=85 * mm,
+            font_name="Arial-Bold",
+            font_size=13,
+        )
+
+        draw_text(
+            pdf,
+            HEIGHT - 6 * mm,
+            order.address,
+            x=65 * mm,
+            max_width=15 * mm,
+            font_name="Arial",
+            font_size=5,
+            wrap=True,
+        )
+
+        draw_text(
+            pdf,
+            HEIGHT - 15 * mm,
+            str(order.order),
+            max_width=85 * mm,
+            font_name="Arial-Bold",
+            font_size=11,
+        )
+
+        draw_text(
+            pdf,
+            HEIGHT - 25 * mm,
+            supplier_name,
+            max_width=85 * mm,
+            font_name="Arial-Bold",
+            font_size=22,
+        )
+        pdf.setFillColor(white)
+        draw_text(
+            pdf,
+            HEIGHT - 37 * mm,
+            order.code,
+            max_width=85 * mm,
+            font_name="Arial",
+            font_size=16,
+        )
+        pdf.setFillColor(black)
+        draw_text(
+            pdf,
+            HEIGHT - 45 * mm,
+            order.description,
+            max_width=82 * mm,
+            font_name="Arial",
+            font_size=8,
+            wrap=True,
+        )
+        draw_text(
+            pdf,
+            MARGIN + 10 * mm - MARGIN,
+            f"Quantidade: {int(order.qty)} {order.unit_type}",
+            max_width=85 * mm,
+            font_name="Arial",
+            font_size=10,
+        )
+        draw_text(
+            pdf,
+            MARGIN,
+            f"Lote Total: {int(order.qty_total)} {order.unit_type}",
+            max_width=85 * mm,
+            font_name="Arial",
+            font_size=10.5,
+        )
+        pdf.endForm()
+        for _ in range(2):
+            pdf.doForm(label_form)
+            pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def merge_pdfs(parts: list[bytes]) -> bytes:
+    """Join PDFs in the given order, sharing the objects they have in common"""
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(PdfReader(io.BytesIO(part)))
+    writer.compress_identical_objects()
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _init_render_process() -> None:
+    """Keep the render processes out of the metrics files of the parent"""
+    metrics.disable()
+
+
+def create_render_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool for the stock labels
+
+    Spawned instead of forked, a forked child would inherit the locks that
+    other threads hold at that moment, like the QR cache or the metrics lock.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_render_process,
+    )
+
+
+def get_render_pool(workers: int) -> ProcessPoolExecutor:
+    """The pool shared by every NFe, started with workers processes on first use"""
+    global _render_pool  # pylint: disable=global-statement
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = create_render_pool(workers)
+        return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    """Stop the processes of the shared pool, if it was started"""
+    global _render_pool  # pylint: disable=global-statement
+    with _render_pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+@metrics.timed("labels.stock_parallel")
+def generate_stock_labels_parallel(
+    nfe_data: NFeData,
+    workers: int | None = None,
+    threshold: int = PARALLEL_THRESHOLD,
+    executor: Executor | None = None,
+) -> bytes | None:
+    """Generate the stock labels PDF splitting the orders between processes
+
+    Each process renders a contiguous range of orders and the parts are
+    merged in the NFe order. Small NFes, a single worker or a missing pypdf
+    render on this process. Without an executor the shared pool is used, so
+    concurrent NFes share the same workers processes.
+    """
+    orders = [order for order in nfe_data.orders if order.qty != 0]
+    workers = workers or os.cpu_count() or 1
+    shards_count = min(workers, len(orders))
+    if PdfWriter is None or shards_count < 2 or len(orders) < threshold:
+        return generate_stock_labels(nfe_data)
+
+    shard_size = -(-len(orders) // shards_count)
+    shards = [
+        dataclasses.replace(
+            nfe_data, orders=orders[start : start + shard_size], pending_materials=[]
+        )
+        for start in range(0, len(orders), shard_size)
+    ]
+    executor = executor or get_render_pool(workers)
+    parts = list(executor.map(generate_stock_labels, shards))
+    return merge_pdfs(parts)
+
+
+def generate_nfe_labels(
+    nfe_data: NFeData,
+    output_dir: pathlib.Path | None = None,
+    label_format: str = "pdf",
+    render_workers: int = 1,
+) -> dict[str, bytes]:
+    """Generate the labels of an NFe, saving them too when output_dir is given"""
+
+    documents: dict[str, bytes] = {}
+    if label_format == "pdf":
+        pending_labels = generate_pending_materials_labels(nfe_data)
+        if pending_labels is not None:
+            documents["pending_labels.pdf"] = pending_labels
+        stock_labels = generate_stock_labels_parallel(nfe_data, render_workers)
+        if stock_labels is not None:
+            documents["stock_labels.pdf"] = stock_labels
+    elif label_format in LABEL_FORMATS:
+        # Imported here because core.zpl_labels uses the page size of this module
+        from core.zpl_labels import generate_printer_labels
+
+        documents = generate_printer_labels(nfe_data, label_format)
+    else:
+        raise ValueError(f"Format must be one of {LABEL_FORMATS}, got {label_format}")
+
+    if metrics.enabled:
+        pending_count = sum(
+            1 for material in nfe_data.pending_materials if material.pending_qty != 0
+        )
+        stock_count = sum(1 for order in nfe_data.orders if order.qty != 0)
+        metrics.count("labels", pending_count, kind="pending")
+        # Each stock label is printed twice
+        metrics.count("labels", 2 * stock_count, kind="stock")
+        for name, document in documents.items():
+            metrics.count("label_bytes", len(document), document=name)
+
+    if output_dir is not None:
+        output_dir = pathlib.Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for name, document in documents.items():
+            (output_dir / name).write_bytes(document)
+    return documents
+
+
+if __name__ == "__main__":
+    generate_nfe_labels(NFeData.from_json(f"{TMP_FOLDER / 'nfe_data.json'}"), TMP_FOLDER)
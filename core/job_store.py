@@ -0,0 +1,266 @@
+"""Module to keep the scraped NFes and their labels in a local SQLite database
+
+Each negotiation keeps its NFe as parsed, its reconciled NFeData and the
+documents rendered for it, so a torn or jammed label is reprinted without
+scraping CargaMaquina again and a repeated negotiation ID is detected before
+it is scraped. The parsed NFe is reconciled again when the pending materials
+change, without scraping it.
+The least recently used negotiations are evicted when the documents pass
+max_bytes.
+"""
+
+import dataclasses
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import List
+
+from core.models import NFeData
+
+JOB_STORE_PATH: pathlib.Path = pathlib.Path("./tmp/jobs.sqlite3")
+MAX_BYTES: int = 500 * 1024 * 1024
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS receipts (
+    negociation_id TEXT PRIMARY KEY,
+    nfe_number INTEGER NOT NULL,
+    supplier_name TEXT NOT NULL,
+    nfe_data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    parsed_data TEXT
+);
+CREATE INDEX IF NOT EXISTS receipts_nfe_number ON receipts (nfe_number);
+CREATE INDEX IF NOT EXISTS receipts_used_at ON receipts (used_at);
+CREATE TABLE IF NOT EXISTS documents (
+    negociation_id TEXT NOT NULL
+        REFERENCES receipts (negociation_id) ON DELETE CASCADE,
+    label_format TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (negociation_id, label_format, name)
+);
+"""
+
+
+class JobStore:
+    """SQLite store of the receipts, keyed by negotiation ID and NFe number"""
+
+    def __init__(
+        self, path: str | pathlib.Path = JOB_STORE_PATH, max_bytes: int = MAX_BYTES
+    ):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by the batch and service threads
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(SCHEMA)
+            columns = {
+                row[1]
+                for row in self._connection.execute("PRAGMA table_info(receipts)")
+            }
+            # Stores made before the parsed NFe was kept
+            if "parsed_data" not in columns:
+                self._connection.execute(
+                    "ALTER TABLE receipts ADD COLUMN parsed_data TEXT"
+                )
+
+    def save(
+        self,
+        negociation_id: str,
+        nfe_data: NFeData,
+        documents: dict[str, bytes],
+        label_format: str = "pdf",
+        parsed: NFeData | None = None,
+    ) -> None:
+        """Keep the NFe data and replace its documents of the format
+
+        parsed is the NFe before the reconciliation, the one already saved
+        is kept without it.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO receipts (negociation_id, nfe_number, supplier_name, "
+                "nfe_data, created_at, used_at, parsed_data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (negociation_id) DO UPDATE SET "
+                "nfe_number = excluded.nfe_number, "
+                "supplier_name = excluded.supplier_name, "
+                "nfe_data = excluded.nfe_data, used_at = excluded.used_at, "
+                "parsed_data = COALESCE(excluded.parsed_data, parsed_data)",
+                (
+                    negociation_id,
+                    nfe_data.nfe_number,
+                    nfe_data.supplier_name,
+                    nfe_data.to_compact(),
+                    now,
+                    now,
+                    None if parsed is None else parsed.to_compact(),
+                ),
+            )
+            self._connection.execute(
+                "DELETE FROM documents WHERE negociation_id = ? AND label_format = ?",
+                (negociation_id, label_format),
+            )
+            self._connection.executemany(
+                "INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+                [
+                    (negociation_id, label_format, name, document, len(document))
+                    for name, document in documents.items()
+                ],
+            )
+            self._evict(keep=negociation_id)
+
+    def _evict(self, keep: str) -> None:
+        """Delete the least recently used receipts while over max_bytes"""
+        total = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM documents"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._connection.execute(
+            "SELECT receipts.negociation_id, COALESCE(SUM(documents.size), 0) "
+            "FROM receipts LEFT JOIN documents USING (negociation_id) "
+            "WHERE receipts.negociation_id != ? "
+            "GROUP BY receipts.negociation_id ORDER BY receipts.used_at",
+            (keep,),
+        ).fetchall()
+        evicted: List[tuple[str]] = []
+        for negociation_id, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((negociation_id,))
+            total -= size
+        self._connection.executemany(
+            "DELETE FROM receipts WHERE negociation_id = ?", evicted
+        )
+
+    def __contains__(self, negociation_id: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM receipts WHERE negociation_id = ?", (negociation_id,)
+            ).fetchone()
+        return row is not None
+
+    def find(self, key: str) -> str | None:
+        """Negotiation ID of a negotiation ID or an NFe number, the latest one"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT negociation_id FROM receipts WHERE negociation_id = ?", (key,)
+            ).fetchone()
+            if row is None and key.strip().isdigit():
+                row = self._connection.execute(
+                    "SELECT negociation_id FROM receipts WHERE nfe_number = ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (int(key),),
+                ).fetchone()
+        return None if row is None else row[0]
+
+    def get_nfe_data(self, negociation_id: str) -> NFeData | None:
+        """Reconciled NFe data of a negotiation"""
+        return self._get_data(negociation_id, "nfe_data")
+
+    def get_parsed_nfe(self, negociation_id: str) -> NFeData | None:
+        """NFe data of a negotiation before the reconciliation, if it was saved"""
+        return self._get_data(negociation_id, "parsed_data")
+
+    def _get_data(self, negociation_id: str, column: str) -> NFeData | None:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                f"SELECT {column} FROM receipts WHERE negociation_id = ?",
+                (negociation_id,),
+            ).fetchone()
+            if row is None or row[0] is None:
+                return None
+            self._touch(negociation_id)
+        return NFeData.from_compact(row[0])
+
+    def get_documents(
+        self, negociation_id: str, label_format: str = "pdf"
+    ) -> dict[str, bytes]:
+        """Saved documents of a negotiation, empty when there are none"""
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT name, content FROM documents "
+                "WHERE negociation_id = ? AND label_format = ? ORDER BY name",
+                (negociation_id, label_format),
+            ).fetchall()
+            if rows:
+                self._touch(negociation_id)
+        return {name: bytes(content) for name, content in rows}
+
+    def _touch(self, negociation_id: str) -> None:
+        self._connection.execute(
+            "UPDATE receipts SET used_at = ? WHERE negociation_id = ?",
+            (time.time(), negociation_id),
+        )
+
+    def total_bytes(self) -> int:
+        """Size of all the saved documents"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM documents"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database"""
+        with self._lock:
+            self._connection.close()
+
+
+def select_orders(nfe_data: NFeData, order: str) -> NFeData:
+    """NFe data with only the orders of a material code or order number"""
+    orders = [
+        order_data
+        for order_data in nfe_data.orders
+        if order in (order_data.code, str(order_data.order))
+    ]
+    if not orders:
+        raise ValueError(f"Nenhum pedido ou código {order} na NF {nfe_data.nfe_number}")
+    # A single order reprints only its stock labels
+    return dataclasses.replace(nfe_data, orders=orders, pending_materials=[])
+
+
+def stored_documents(
+    store: JobStore, negociation_id: str, label_format: str = "pdf", order: str = ""
+) -> dict[str, bytes]:
+    """Documents to reprint from the store, rendered again only for one order"""
+    if not order:
+        documents = store.get_documents(negociation_id, label_format)
+        if documents:
+            return documents
+    nfe_data = store.get_nfe_data(negociation_id)
+    if nfe_data is None:
+        return {}
+    # Imported here, a whole NFe reprint does not need reportlab
+    from core.generate_labels import (  # pylint: disable=import-outside-toplevel
+        generate_nfe_labels,
+    )
+
+    if order:
+        return generate_nfe_labels(
+            select_orders(nfe_data, order), label_format=label_format
+        )
+    documents = generate_nfe_labels(nfe_data, label_format=label_format)
+    store.save(negociation_id, nfe_data, documents, label_format)
+    return documents
+
+
+_job_store: JobStore | None = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Get the job store, opening it on first use"""
+    global _job_store  # pylint: disable=global-statement
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+    return _job_store
@@ -0,0 +1,203 @@
+"""Module to time the stages of a receipt and count what each one produced
+
+Metrics are off until configure is called, main.py does it after parsing
+the METRICS environment variable or the --metrics flag, with the sinks
+separated by commas:
+"jsonl" appends every event to tmp/metrics/metrics.jsonl and "prometheus"
+keeps the totals in tmp/metrics/etiquetas.prom for the node_exporter
+textfile collector.
+"""
+
+import contextlib
+import functools
+import json
+import pathlib
+import threading
+import time
+from typing import Callable, ContextManager, Iterable, Iterator
+
+SINKS: tuple[str, ...] = ("jsonl", "prometheus")
+METRICS_FOLDER: pathlib.Path = pathlib.Path("./tmp/metrics")
+PREFIX: str = "etiquetas"
+
+# Shared by every span while the metrics are off, entering it costs nothing
+_DISABLED_SPAN = contextlib.nullcontext()
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def label_key(labels: dict) -> LabelKey:
+    """Hashable and sorted form of the labels of a metric"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels: LabelKey) -> str:
+    """Labels in the Prometheus exposition format"""
+    if not labels:
+        return ""
+    escaped = (
+        name
+        + '="'
+        + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """Spans and counters of the receiving pipeline"""
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.sinks: tuple[str, ...] = ()
+        self.folder: pathlib.Path = METRICS_FOLDER
+        self._lock = threading.Lock()
+        self._durations: dict[tuple[str, LabelKey], list[float]] = {}
+        self._counters: dict[tuple[str, LabelKey], float] = {}
+        self._jsonl_file = None
+
+    def configure(
+        self, sinks: str | Iterable[str] | None, folder: str | None = None
+    ) -> None:
+        """Choose the sinks, "jsonl,prometheus" or a list; empty turns metrics off"""
+        self.close()
+        if isinstance(sinks, str):
+            sinks = [sink.strip() for sink in sinks.split(",")]
+        sinks = tuple(sink for sink in sinks or () if sink)
+        for sink in sinks:
+            if sink not in SINKS:
+                raise ValueError(f"Metrics sink must be one of {SINKS}, got {sink}")
+        self.sinks = sinks
+        self.folder = pathlib.Path(folder) if folder else METRICS_FOLDER
+        self.enabled = bool(sinks)
+        if self.enabled:
+            self.folder.mkdir(parents=True, exist_ok=True)
+        if "jsonl" in sinks:
+            self._jsonl_file = open(  # pylint: disable=consider-using-with
+                self.folder / "metrics.jsonl", "a", encoding="utf-8"
+            )
+
+    def _write_event(self, event: dict) -> None:
+        if self._jsonl_file is not None:
+            self._jsonl_file.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._jsonl_file.flush()
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record the duration of a stage"""
+        if not self.enabled:
+            return
+        key = (name, label_key(labels))
+        with self._lock:
+            total = self._durations.setdefault(key, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+            self._write_event(
+                {
+                    "time": time.time(),
+                    "type": "span",
+                    "name": name,
+                    "seconds": round(seconds, 6),
+                    "labels": labels,
+                }
+            )
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """Add to a counter, like the orders or the bytes of a receipt"""
+        if not self.enabled:
+            return
+        key = (name, label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._write_event(
+                {
+                    "time": time.time(),
+                    "type": "count",
+                    "name": name,
+                    "value": value,
+                    "labels": labels,
+                }
+            )
+
+    def span(self, name: str, **labels) -> ContextManager:
+        """Time the block, with status="error" when it raises"""
+        if not self.enabled:
+            return _DISABLED_SPAN
+        return self._span(name, labels)
+
+    @contextlib.contextmanager
+    def _span(self, name: str, labels: dict) -> Iterator[None]:
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, status=status, **labels)
+
+    def timed(self, name: str) -> Callable:
+        """Decorator that wraps every call of the function in a span"""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self._span(name, {}):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def prometheus_text(self) -> str:
+        """Totals in the Prometheus text exposition format"""
+        lines: list[str] = [
+            f"# HELP {PREFIX}_stage_seconds Time spent in each stage of a receipt",
+            f"# TYPE {PREFIX}_stage_seconds summary",
+        ]
+        with self._lock:
+            durations = sorted(self._durations.items())
+            counters = sorted(self._counters.items())
+        for (name, labels), (calls, seconds) in durations:
+            stage_labels = format_labels((("stage", name),) + labels)
+            lines.append(f"{PREFIX}_stage_seconds_sum{stage_labels} {seconds:.6f}")
+            lines.append(f"{PREFIX}_stage_seconds_count{stage_labels} {calls:.0f}")
+        declared: set[str] = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{format_labels(labels)} {value:.15g}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Rewrite the Prometheus textfile with the current totals"""
+        if "prometheus" not in self.sinks:
+            return
+        file_path = self.folder / f"{PREFIX}.prom"
+        # The collector must never read a half written file
+        partial_path = file_path.with_name(f"{file_path.name}.part")
+        partial_path.write_text(self.prometheus_text(), encoding="utf-8")
+        partial_path.replace(file_path)
+
+    def disable(self) -> None:
+        """Turn the metrics off without flushing, as in the render processes"""
+        # A flush here would overwrite the Prometheus file of the parent
+        self.enabled = False
+        self.sinks = ()
+        self._jsonl_file = None
+
+    def close(self) -> None:
+        """Flush the totals and close the JSON-lines log"""
+        if self.enabled:
+            self.flush()
+        if self._jsonl_file is not None:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+
+
+metrics = Metrics()
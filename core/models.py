@@ -0,0 +1,217 @@
+"""Dataclasses shared by the scraping, parsing and label modules
+
+The records are slotted and typed: quantities are floats, numeric order
+numbers are ints and creation dates are dates. to_dict builds the plain
+dictionaries field by field instead of dataclasses.asdict, which deep copies
+every value, and the compact form drops the keys of each row for the
+job store.
+"""
+
+import json
+from dataclasses import dataclass, field
+from datetime import date
+from typing import List, Dict
+
+DATE_FORMAT: str = "%d/%m/%y"
+
+
+@dataclass(slots=True)
+class Material:
+    """Dataclass to represent a pending material"""
+
+    creation_date: date
+    code: str
+    op_number: str
+    product: str
+    pending_qty: float
+
+    def to_dict(self) -> Dict:
+        """Convert the instance to a dictionary, with the date as in the export"""
+        return {
+            "creation_date": self.creation_date.strftime(DATE_FORMAT),
+            "code": self.code,
+            "op_number": self.op_number,
+            "product": self.product,
+            "pending_qty": self.pending_qty,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Material":
+        """Create the instance from a dictionary made by to_dict"""
+        # dd/mm/yy sliced, strptime is the slowest part of loading an NFe
+        day, month, year = data["creation_date"].split("/")
+        return cls(
+            creation_date=date(2000 + int(year), int(month), int(day)),
+            code=data["code"],
+            op_number=data["op_number"],
+            product=data["product"],
+            pending_qty=float(data["pending_qty"]),
+        )
+
+    def copy(self) -> "Material":
+        """Copy that can be reconciled without changing the cached one"""
+        return Material(
+            self.creation_date, self.code, self.op_number, self.product, self.pending_qty
+        )
+
+
+@dataclass(slots=True)
+class PendingMaterials:
+    """Dataclass to represent a list of pending materials"""
+
+    pending_materials: List[Material] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        """Convert the istance to a dictionary"""
+        return {
+            "pending_materials": [
+                material.to_dict() for material in self.pending_materials
+            ]
+        }
+
+    def to_json(self) -> dict:
+        """Convert to json"""
+        data: Dict = self.to_dict()
+        with open("./tmp/pending_materials.json", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+
+        return data
+
+
+@dataclass(slots=True)
+class OrderData:
+    """Dataclass to represent an order"""
+
+    address: str
+    order: int | str
+    code: str
+    description: str
+    qty: float
+    qty_total: float
+    unit_type: str
+
+    def to_dict(self) -> Dict:
+        """Convert the instance to a dictionary"""
+        return {
+            "address": self.address,
+            "order": self.order,
+            "code": self.code,
+            "description": self.description,
+            "qty": self.qty,
+            "qty_total": self.qty_total,
+            "unit_type": self.unit_type,
+        }
+
+    def copy(self) -> "OrderData":
+        """Copy that can be reconciled without changing the parsed one"""
+        return OrderData(
+            self.address,
+            self.order,
+            self.code,
+            self.description,
+            self.qty,
+            self.qty_total,
+            self.unit_type,
+        )
+
+
+@dataclass(slots=True)
+class NFeData:
+    """Dataclass to represent an NFe and generate a JSON file to generate labels"""
+
+    date: str
+    nfe_number: int
+    supplier_name: str
+    orders: List[OrderData] = field(default_factory=list)
+    pending_materials: List[Material] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        """Convert the istance to a dictionary"""
+        return {
+            "date": self.date,
+            "nfe_number": self.nfe_number,
+            "supplier_name": self.supplier_name,
+            "orders": [order.to_dict() for order in self.orders],
+            "pending_materials": [
+                material.to_dict() for material in self.pending_materials
+            ],
+        }
+
+    def to_json(self, path: str = "./tmp/nfe_data.json") -> str:
+        """Convert to json"""
+        data: str = json.dumps(self.to_dict(), ensure_ascii=False, indent=4)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "NFeData":
+        """Create the instance from a dictionary made by to_dict"""
+        return cls(
+            date=data["date"],
+            nfe_number=data["nfe_number"],
+            supplier_name=data["supplier_name"],
+            orders=[OrderData(**order) for order in data["orders"]],
+            pending_materials=[
+                Material.from_dict(material) for material in data["pending_materials"]
+            ],
+        )
+
+    @classmethod
+    def from_json(cls, path: str = "./tmp/nfe_data.json") -> "NFeData":
+        """Load the instance from a file made by to_json"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def to_compact(self) -> str:
+        """JSON with the rows as arrays in field order and no whitespace"""
+        return json.dumps(
+            [
+                self.date,
+                self.nfe_number,
+                self.supplier_name,
+                [
+                    [
+                        order.address,
+                        order.order,
+                        order.code,
+                        order.description,
+                        order.qty,
+                        order.qty_total,
+                        order.unit_type,
+                    ]
+                    for order in self.orders
+                ],
+                [
+                    [
+                        material.creation_date.toordinal(),
+                        material.code,
+                        material.op_number,
+                        material.product,
+                        material.pending_qty,
+                    ]
+                    for material in self.pending_materials
+                ],
+            ],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_compact(cls, text: str | bytes) -> "NFeData":
+        """Load the instance from to_compact, or from a to_dict JSON"""
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return cls.from_dict(data)
+        nfe_date, nfe_number, supplier_name, orders, pending_materials = data
+        return cls(
+            date=nfe_date,
+            nfe_number=nfe_number,
+            supplier_name=supplier_name,
+            orders=[OrderData(*order) for order in orders],
+            pending_materials=[
+                Material(date.fromordinal(ordinal), code, op_number, product, qty)
+                for ordinal, code, op_number, product, qty in pending_materials
+            ],
+        )
@@ -0,0 +1,17 @@
+"""Choices of the command line options, kept free of heavy imports
+
+main.py reads them before asking for the credentials, while selenium,
+requests and reportlab are still being imported in the background.
+"""
+
+# Ways to read CargaMaquina: a Chrome window or plain HTTP requests
+BACKENDS: tuple[str, ...] = ("selenium", "http")
+
+PRINT_BACKENDS: tuple[str, ...] = ("windows", "cups", "raw", "directory")
+
+LABEL_FORMATS: tuple[str, ...] = ("pdf", "zpl", "epl")
+
+# Where the pending materials come from: the whole export downloaded and
+# cached in memory, the local SQLite mirror synced incrementally, one query
+# filtered by the server per NFe code, or codes and export chosen by cost
+PENDING_SOURCES: tuple[str, ...] = ("export", "mirror", "codes", "auto")
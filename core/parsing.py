@@ -0,0 +1,183 @@
+"""Module to parse the NFe page and the pending materials export into records
+
+The pages are read with an event based parser that only keeps the table
+cells, instead of building a BeautifulSoup tree of the whole page.
+"""
+
+from datetime import datetime as dt
+from html.parser import HTMLParser
+from typing import Iterator, List
+
+from core.models import Material, OrderData
+
+CHUNK_SIZE: int = 64 * 1024
+
+
+class TableParser(HTMLParser):
+    """Collect the cells of every table row and the fields of the NFe header"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[tuple[int, List[str]]] = []
+        self.inputs: dict[str, str] = {}
+        self.spans: dict[str, str] = {}
+        self._tables: int = 0
+        self._open_tables: List[int] = []
+        self._cells: List[str] | None = None
+        self._row_table: int = -1
+        self._text: List[str] | None = None
+        self._span_classes: List[str] = []
+        self._span_depth: int = 0
+        self._span_text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self._open_tables.append(self._tables)
+            self._tables += 1
+        elif tag == "tr":
+            self._close_row()
+            self._cells = []
+            self._row_table = self._open_tables[-1] if self._open_tables else -1
+        elif tag == "td" and self._cells is not None:
+            self._close_cell()
+            self._text = []
+        elif tag == "input":
+            attributes = dict(attrs)
+            if attributes.get("id"):
+                self.inputs.setdefault(attributes["id"], attributes.get("value") or "")
+        elif tag == "span":
+            if self._span_depth:
+                self._span_depth += 1
+                return
+            classes = (dict(attrs).get("class") or "").split()
+            self._span_classes = [name for name in classes if name not in self.spans]
+            if self._span_classes:
+                self._span_depth = 1
+                self._span_text = []
+
+    def handle_endtag(self, tag):
+        if tag == "td":
+            self._close_cell()
+        elif tag == "tr":
+            self._close_row()
+        elif tag == "table":
+            self._close_row()
+            if self._open_tables:
+                self._open_tables.pop()
+        elif tag == "span" and self._span_depth:
+            self._span_depth -= 1
+            if not self._span_depth:
+                for name in self._span_classes:
+                    self.spans[name] = "".join(self._span_text)
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+        if self._span_depth:
+            self._span_text.append(data)
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+    def _close_cell(self) -> None:
+        if self._text is not None and self._cells is not None:
+            self._cells.append("".join(self._text).strip())
+        self._text = None
+
+    def _close_row(self) -> None:
+        self._close_cell()
+        if self._cells is not None:
+            self.rows.append((self._row_table, self._cells))
+        self._cells = None
+
+
+def iter_rows(
+    html: str | bytes, parser: TableParser | None = None
+) -> Iterator[tuple[int, List[str]]]:
+    """Yield (table index, cells) for every row while the page is parsed"""
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    parser = parser or TableParser()
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start : start + CHUNK_SIZE])
+        yield from parser.rows
+        parser.rows.clear()
+    parser.close()
+    yield from parser.rows
+    parser.rows.clear()
+
+
+def parse_nfe_page(html: str) -> tuple[int, str, Iterator[OrderData]]:
+    """Get the NFe number, the supplier name and the NFe orders"""
+    parser = TableParser()
+    # The materials table is the second table of the page, skipping its header
+    rows = [cells for table, cells in iter_rows(html, parser) if table == 1][1:]
+    nfe_number: int = int(
+        parser.inputs["FaturamentoGrid_0_observacao"].split("-")[-1].strip()
+    )
+    supplier_name: str = parser.spans["select2-chosen"].strip().split(" ")[0]
+    return nfe_number, supplier_name, (order_from_cells(cells) for cells in rows)
+
+
+def order_from_cells(cells: List[str]) -> OrderData:
+    """Build an order from the cells of a row of the NFe materials table"""
+    qty_cell: List[str] = cells[8].split(" ")
+    qty = float(qty_cell[0])
+    return OrderData(
+        address=cells[4],
+        order=int(cells[3]) if cells[3].isdigit() else cells[3],
+        code=cells[5],
+        description=cells[6],
+        qty=qty,
+        qty_total=qty,
+        unit_type=qty_cell[-1].upper(),
+    )
+
+
+ExportRow = tuple[dt, str, str, str, float, str]
+
+
+def parse_export_cells(cells: List[str]) -> ExportRow:
+    """Creation date, code, OP, product, pending quantity and unit of an export row"""
+    creation_date: dt = dt.strptime(cells[0], "%d/%m/%y")
+    qty_cell: List[str] = cells[8].split(" ")
+    # Thousands separator, "1.200" means 1200
+    pending_qty: float = float(qty_cell[0].replace(".", ""))
+    return creation_date, cells[1], cells[3], cells[5], pending_qty, qty_cell[-1]
+
+
+def material_from_cells(
+    cells: List[str], min_year: int, skip_units: tuple[str, ...] = ("mt",)
+) -> Material | None:
+    """Build a pending material from an export row, None when it is filtered out"""
+    creation_date, code, op_number, product, pending_qty, unit_type = (
+        parse_export_cells(cells)
+    )
+    if (creation_date.year < min_year) or (unit_type in skip_units):
+        return None
+    return Material(
+        creation_date=creation_date.date(),
+        code=code,
+        op_number=op_number,
+        product=product,
+        pending_qty=pending_qty,
+    )
+
+
+def iter_export_rows(html: str | bytes) -> Iterator[List[str]]:
+    """Yield the cells of the export rows, skipping the header"""
+    rows = iter_rows(html)
+    next(rows, None)
+    for _, cells in rows:
+        yield cells
+
+
+def iter_pending_materials(
+    html: str | bytes, min_year: int, skip_units: tuple[str, ...] = ("mt",)
+) -> Iterator[Material]:
+    """Yield the rows of the pending materials export created since min_year"""
+    for cells in iter_export_rows(html):
+        material = material_from_cells(cells, min_year, skip_units)
+        if material is not None:
+            yield material
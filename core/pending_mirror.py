@@ -0,0 +1,216 @@
+"""Module with a local SQLite mirror of the pending materials export
+
+Every row of the export created since first_year (the year before the
+current one by default) is kept, of any unit, indexed by material code and
+creation date, so the pending materials of an NFe are an indexed query
+instead of a download of the whole export.
+
+A sync downloads only the rows created since the watermark, the day of the
+last sync, and replaces the mirror rows of that range. Rows created before
+it still change: their pending quantity goes down as the OPs are supplied
+and they leave the export once fully supplied. An incremental sync does not
+see that, so the whole range is downloaded again every full_sync_interval
+and a lookup may report an older row up to that late. The client syncs in
+the background (on the keep-warm thread in service mode) and its lookups
+answer from the rows already mirrored, only the first sync is waited.
+"""
+
+import pathlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Dict, Iterable, List
+
+from core.metrics import metrics
+from core.models import Material
+from core.parsing import parse_export_cells
+
+MIRROR_PATH: pathlib.Path = pathlib.Path("./tmp/pending_materials.sqlite3")
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS materials (
+    creation_date TEXT NOT NULL,
+    code TEXT NOT NULL,
+    op_number TEXT NOT NULL,
+    product TEXT NOT NULL,
+    pending_qty REAL NOT NULL,
+    unit TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS materials_code_date ON materials (code, creation_date);
+CREATE INDEX IF NOT EXISTS materials_date ON materials (creation_date);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Seconds an older row may be stale, see the module docstring
+FULL_SYNC_INTERVAL: float = 900
+
+# Fetches the cells of the export rows created in a range of dates
+FetchRows = Callable[[date, date], Iterable[List[str]]]
+
+
+@dataclass
+class SyncStats:
+    """Range, duration and row counts of one sync"""
+
+    full: bool
+    start: date
+    end: date
+    fetched_rows: int
+    removed_rows: int
+    total_rows: int
+    seconds: float
+
+
+class PendingMaterialsMirror:
+    """SQLite copy of the export, synced by creation date ranges"""
+
+    def __init__(
+        self,
+        path: str | pathlib.Path = MIRROR_PATH,
+        first_year: int | None = None,
+        full_sync_interval: float = FULL_SYNC_INTERVAL,
+    ):
+        self.path = pathlib.Path(path)
+        self.first_year = first_year or date.today().year - 1
+        self.full_sync_interval = full_sync_interval
+        self.last_sync: SyncStats | None = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def _get_state(self, key: str) -> str | None:
+        row = self._connection.execute(
+            "SELECT value FROM sync_state WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _set_state(self, key: str, value: str) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (key, value)
+        )
+
+    @property
+    def age(self) -> float | None:
+        """Seconds since the last sync, None when the mirror was never synced"""
+        with self._lock:
+            synced_at = self._get_state("synced_at")
+        return None if synced_at is None else time.time() - float(synced_at)
+
+    def sync(self, fetch_rows: FetchRows, full: bool = False) -> SyncStats:
+        """Download the rows since the watermark, or all of them when a full sync is due"""
+        with self._sync_lock:
+            return self._sync(fetch_rows, full)
+
+    def _sync(self, fetch_rows: FetchRows, full: bool) -> SyncStats:
+        with self._lock:
+            watermark = self._get_state("watermark")
+            full_synced_at = float(self._get_state("full_synced_at") or 0)
+        full = (
+            full
+            or watermark is None
+            or time.time() - full_synced_at > self.full_sync_interval
+        )
+        today = date.today()
+        # The watermark day is downloaded again, rows may have been added after the sync
+        start = date(self.first_year, 1, 1) if full else date.fromisoformat(watermark)
+
+        sync_start = time.perf_counter()
+        rows = []
+        with metrics.span("pending_mirror.fetch", full=full):
+            for cells in fetch_rows(start, today):
+                creation_date, code, op_number, product, pending_qty, unit = (
+                    parse_export_cells(cells)
+                )
+                rows.append(
+                    (
+                        creation_date.date().isoformat(),
+                        code,
+                        op_number,
+                        product,
+                        pending_qty,
+                        unit,
+                    )
+                )
+
+        # Replaced in one transaction, a lookup never sees the range half written
+        with self._lock, self._connection:
+            # A full sync also drops the rows of the years before first_year
+            removed = self._connection.execute(
+                "DELETE FROM materials WHERE creation_date >= ?",
+                ("" if full else start.isoformat(),),
+            ).rowcount
+            self._connection.executemany(
+                "INSERT INTO materials VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            now = str(time.time())
+            self._set_state("watermark", today.isoformat())
+            self._set_state("synced_at", now)
+            if full:
+                self._set_state("full_synced_at", now)
+            total = self._connection.execute(
+                "SELECT COUNT(*) FROM materials"
+            ).fetchone()[0]
+
+        stats = SyncStats(
+            full=full,
+            start=start,
+            end=today,
+            fetched_rows=len(rows),
+            removed_rows=removed,
+            total_rows=total,
+            seconds=time.perf_counter() - sync_start,
+        )
+        self.last_sync = stats
+        metrics.observe("pending_mirror.sync", stats.seconds, full=full)
+        metrics.count("pending_mirror_rows", len(rows), full=full)
+        return stats
+
+    def lookup(
+        self, codes: Iterable[str], min_year: int, skip_units: tuple[str, ...] = ("mt",)
+    ) -> Dict[str, List[Material]]:
+        """Pending materials of the codes created since min_year, by code"""
+        codes = list(dict.fromkeys(codes))
+        index: Dict[str, List[Material]] = {}
+        if not codes:
+            return index
+        # One query per chunk, SQLite limits the number of parameters
+        for offset in range(0, len(codes), 500):
+            chunk = codes[offset : offset + 500]
+            query = (
+                "SELECT creation_date, code, op_number, product, pending_qty "
+                "FROM materials "
+                f"WHERE code IN ({','.join('?' * len(chunk))}) "
+                "AND creation_date >= ? "
+            )
+            if skip_units:
+                query += f"AND unit NOT IN ({','.join('?' * len(skip_units))}) "
+            query += "ORDER BY code, creation_date, rowid"
+            with self._lock:
+                rows = self._connection.execute(
+                    query, (*chunk, date(min_year, 1, 1).isoformat(), *skip_units)
+                ).fetchall()
+            for creation_date, code, op_number, product, pending_qty in rows:
+                index.setdefault(code, []).append(
+                    Material(
+                        creation_date=date.fromisoformat(creation_date),
+                        code=code,
+                        op_number=op_number,
+                        product=product,
+                        pending_qty=pending_qty,
+                    )
+                )
+        return index
+
+    def close(self) -> None:
+        """Close the database"""
+        with self._lock:
+            self._connection.close()
@@ -1,43 +1,82 @@
-"""Module to print labels from a list of file paths on a Default Printer"""
-
-import os
-import platform
-import time
-
-if platform.system() == "Windows":
-    import win32api
-    import win32print
-
-
-def print_labels(file_paths: list[str]) -> None:
-    """Print labels from a list of file paths"""
-
-    printer_name = win32print.GetDefaultPrinter()
-    printer = win32print.OpenPrinter(printer_name)
-
-    try:
-        for file_path in file_paths:
-            abs_path = os.path.abspath(file_path)
-            if not os.path.exists(file_path):
-                continue
-            win32api.ShellExecute(0, "print", abs_path, None, ".", 0)
-            time.sleep(3)
-    except FileNotFoundError:
-        print("Arquivo nao encontrado")
-        return
-    except win32api.error as e:
-        print(f"Erro ao imprimir: {e}")
-        return
-    finally:
-        win32print.ClosePrinter(printer)
-
-    print("Etiquetas impressas com sucesso")
-
-    for file_path in file_paths:
-        if not os.path.exists(file_path):
-            continue
-        os.remove(file_path)
-
-
-if __name__ == "_main_":
-    print_labels(["./tmp/pending_labels.pdf", "./tmp/stock_labels.pdf"])
+"""Module to print labels on the configured printer through the print queue"""
+
+import os
+import platform
+
+from core.metrics import metrics
+from core.print_queue import PrintJob, PrintQueue, create_backend
+
+DEFAULT_BACKEND: str = "windows" if platform.system() == "Windows" else "cups"
+
+_print_queue: PrintQueue | None = None
+
+
+def configure_printer(
+    backend_name: str | None = None, target: str | None = None
+) -> PrintQueue:
+    """Choose the printer backend, by default from PRINT_BACKEND and PRINTER"""
+    global _print_queue  # pylint: disable=global-statement
+
+    backend_name = backend_name or os.environ.get("PRINT_BACKEND", DEFAULT_BACKEND)
+    target = target or os.environ.get("PRINTER")
+    if _print_queue is not None:
+        _print_queue.close()
+    _print_queue = PrintQueue(create_backend(backend_name, target))
+    return _print_queue
+
+
+def get_print_queue() -> PrintQueue:
+    """Get the print queue, configuring it on first use"""
+    if _print_queue is None:
+        return configure_printer()
+    return _print_queue
+
+
+def wait_jobs(jobs: list[PrintJob]) -> bool:
+    """Wait the jobs and report the latency of each one"""
+    for job in jobs:
+        job.wait()
+        metrics.observe("print.job", job.latency, status=job.status)
+        metrics.count("print_bytes", len(job.document))
+        if job.ok:
+            print(f"{job.name} impresso em {job.latency:.1f}s")
+        else:
+            print(f"Erro ao imprimir {job.name}: {job.error}")
+    return all(job.ok for job in jobs)
+
+
+def print_documents(documents: dict[str, bytes]) -> bool:
+    """Print in-memory PDFs and wait until the printer finishes them"""
+
+    if not documents:
+        return True
+    with metrics.span("print.documents"):
+        jobs = get_print_queue().submit_documents(documents)
+        printed = wait_jobs(jobs)
+    if printed:
+        print("Etiquetas impressas com sucesso")
+        return True
+    return False
+
+
+def print_labels(file_paths: list[str]) -> None:
+    """Print labels from a list of file paths"""
+
+    documents: dict[str, bytes] = {}
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, "rb") as file:
+            documents[os.path.basename(file_path)] = file.read()
+
+    if not print_documents(documents):
+        return
+
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            continue
+        os.remove(file_path)
+
+
+if __name__ == "__main__":
+    print_labels(["./tmp/pending_labels.pdf", "./tmp/stock_labels.pdf"])
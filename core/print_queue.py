@@ -0,0 +1,326 @@
+"""Module with the print job queue and its printer backends"""
+
+import abc
+import itertools
+import os
+import pathlib
+import platform
+import queue
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+
+from core.options import PRINT_BACKENDS as BACKENDS
+
+if platform.system() == "Windows":
+    import win32api
+    import win32print
+
+
+class PrintError(Exception):
+    """Error raised by a backend when a job could not be printed"""
+
+
+@dataclass
+class PrintJob:
+    """A document sent to the printer and the timestamps of its life cycle"""
+
+    job_id: int
+    name: str
+    document: bytes = field(repr=False)
+    submitted_at: float = field(default_factory=time.perf_counter)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    status: str = "queued"
+    error: str = ""
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def latency(self) -> float:
+        """Seconds from the submission to the end of the job"""
+        return self.finished_at - self.submitted_at if self.finished_at else 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Whether the job was printed"""
+        return self.status == "done"
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait the end of the job, True when it finished"""
+        return self._done.wait(timeout)
+
+    def finish(self, status: str, error: str = "") -> None:
+        """Record the end of the job and wake up who is waiting for it"""
+        self.status = status
+        self.error = error
+        self.finished_at = time.perf_counter()
+        self._done.set()
+
+
+class PrintBackend(abc.ABC):
+    """Base class of the printer backends"""
+
+    name: str = ""
+
+    @abc.abstractmethod
+    def print_document(self, job: PrintJob) -> None:
+        """Print the job document, returning only when the job is finished"""
+
+
+def remove_tmp_dir(tmp_dir: str) -> bool:
+    """Remove a temporary folder, False when a file in it is still open"""
+    try:
+        shutil.rmtree(tmp_dir)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    return True
+
+
+class WindowsSpoolerBackend(PrintBackend):
+    """Print PDFs through the Windows shell and follow the job in the spooler"""
+
+    name = "windows"
+
+    def __init__(
+        self,
+        printer_name: str | None = None,
+        job_timeout: float = 120,
+        # The fixed wait used before the spooler was followed
+        appear_timeout: float = 3,
+        poll_interval: float = 0.25,
+    ):
+        self.printer_name = printer_name
+        self.job_timeout = job_timeout
+        self.appear_timeout = appear_timeout
+        self.poll_interval = poll_interval
+        # Folders whose PDF the viewer still held, removed after a later job
+        self._stale_dirs: list[str] = []
+        self._stale_lock = threading.Lock()
+
+    def print_document(self, job: PrintJob) -> None:
+        printer_name = self.printer_name or win32print.GetDefaultPrinter()
+        tmp_dir = tempfile.mkdtemp(prefix="etiquetas-")
+        file_path = os.path.join(tmp_dir, f"{job.job_id}-{job.name}")
+        with open(file_path, "wb") as file:
+            file.write(job.document)
+
+        printer = win32print.OpenPrinter(printer_name)
+        try:
+            if self.printer_name:
+                win32api.ShellExecute(
+                    0, "printto", file_path, f'"{printer_name}"', ".", 0
+                )
+            else:
+                win32api.ShellExecute(0, "print", file_path, None, ".", 0)
+            self._wait_spooler(printer, os.path.basename(file_path))
+        except win32api.error as e:
+            raise PrintError(f"Erro ao imprimir: {e}") from e
+        finally:
+            win32print.ClosePrinter(printer)
+            # A job that was printed does not fail because the viewer holds the file
+            with self._stale_lock:
+                self._stale_dirs.append(tmp_dir)
+                self._stale_dirs = [
+                    stale_dir
+                    for stale_dir in self._stale_dirs
+                    if not remove_tmp_dir(stale_dir)
+                ]
+
+    def _wait_spooler(self, printer, document_name: str) -> None:
+        """Wait the job to enter and then leave the printer queue"""
+        start = time.monotonic()
+        seen = False
+        while True:
+            jobs = win32print.EnumJobs(printer, 0, 999, 1)
+            spooled = any(
+                document_name in (spool_job.get("pDocument") or "")
+                for spool_job in jobs
+            )
+            elapsed = time.monotonic() - start
+            if spooled:
+                seen = True
+            elif seen:
+                return
+            elif elapsed > self.appear_timeout:
+                # The PDF viewer named the job differently, it can't be followed
+                return
+            if elapsed > self.job_timeout:
+                raise PrintError(f"Tempo esgotado aguardando {document_name}")
+            time.sleep(self.poll_interval)
+
+
+class CupsBackend(PrintBackend):
+    """Print with the CUPS lp command and follow the job with lpstat"""
+
+    name = "cups"
+
+    def __init__(
+        self,
+        printer_name: str | None = None,
+        job_timeout: float = 120,
+        poll_interval: float = 0.5,
+        command_timeout: float = 30,
+    ):
+        self.printer_name = printer_name
+        self.job_timeout = job_timeout
+        self.poll_interval = poll_interval
+        self.command_timeout = command_timeout
+
+    def print_document(self, job: PrintJob) -> None:
+        command = ["lp", "-t", job.name]
+        if self.printer_name:
+            command += ["-d", self.printer_name]
+        try:
+            result = subprocess.run(
+                command + ["-"],
+                input=job.document,
+                capture_output=True,
+                check=False,
+                timeout=self.command_timeout,
+            )
+        except FileNotFoundError as e:
+            raise PrintError("Comando lp não encontrado, instale o CUPS") from e
+        except subprocess.TimeoutExpired as e:
+            raise PrintError(f"lp não respondeu em {self.command_timeout}s") from e
+        if result.returncode != 0:
+            raise PrintError(result.stderr.decode(errors="replace").strip())
+
+        match = re.search(r"request id is (\S+)", result.stdout.decode(errors="replace"))
+        if match:
+            self._wait_completed(match.group(1))
+
+    def _wait_completed(self, request_id: str) -> None:
+        """Wait the request to leave the not-completed jobs list"""
+        deadline = time.monotonic() + self.job_timeout
+        while time.monotonic() < deadline:
+            try:
+                result = subprocess.run(
+                    ["lpstat", "-W", "not-completed", "-o"],
+                    capture_output=True,
+                    check=False,
+                    timeout=self.command_timeout,
+                )
+            except subprocess.TimeoutExpired:
+                # A busy scheduler, asked again until the job deadline
+                continue
+            pending = {
+                line.split()[0]
+                for line in result.stdout.decode(errors="replace").splitlines()
+                if line.strip()
+            }
+            if request_id not in pending:
+                return
+            time.sleep(self.poll_interval)
+        raise PrintError(f"Tempo esgotado aguardando {request_id}")
+
+
+class RawSocketBackend(PrintBackend):
+    """Send the document as is to a network printer on port 9100"""
+
+    name = "raw"
+
+    def __init__(self, host: str, port: int = 9100, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def print_document(self, job: PrintJob) -> None:
+        try:
+            with socket.create_connection(
+                (self.host, self.port), timeout=self.timeout
+            ) as connection:
+                connection.sendall(job.document)
+                connection.shutdown(socket.SHUT_WR)
+                # The printer closes the connection once it read the whole job
+                try:
+                    while connection.recv(1024):
+                        pass
+                except socket.timeout:
+                    pass
+        except OSError as e:
+            raise PrintError(f"Erro ao enviar para {self.host}:{self.port}: {e}") from e
+
+
+class DirectoryBackend(PrintBackend):
+    """Save each job in a folder, to test the printing flow without a printer"""
+
+    name = "directory"
+
+    def __init__(self, directory: str | pathlib.Path):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def print_document(self, job: PrintJob) -> None:
+        file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{job.job_id:05d}-{job.name}"
+        file_path = self.directory / file_name
+        partial_path = file_path.with_name(f"{file_path.name}.part")
+        partial_path.write_bytes(job.document)
+        partial_path.replace(file_path)
+
+
+def create_backend(name: str, target: str | None = None) -> PrintBackend:
+    """Create a backend by name, target is the printer, host:port or folder"""
+    if name == "windows":
+        return WindowsSpoolerBackend(target)
+    if name == "cups":
+        return CupsBackend(target)
+    if name == "raw":
+        if not target:
+            raise ValueError("O backend raw precisa de host[:porta]")
+        host, _, port = target.partition(":")
+        return RawSocketBackend(host, int(port or 9100))
+    if name == "directory":
+        return DirectoryBackend(target or "./tmp/printed")
+    raise ValueError(f"Backend must be one of {BACKENDS}, got {name}")
+
+
+class PrintQueue:
+    """Queue of print jobs consumed by worker threads"""
+
+    def __init__(self, backend: PrintBackend, workers: int = 1):
+        self.backend = backend
+        self._jobs: queue.Queue[PrintJob | None] = queue.Queue()
+        self._ids = itertools.count(1)
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, name: str, document: bytes) -> PrintJob:
+        """Queue a document and return its job without waiting"""
+        job = PrintJob(job_id=next(self._ids), name=name, document=document)
+        self._jobs.put(job)
+        return job
+
+    def submit_documents(self, documents: dict[str, bytes]) -> list[PrintJob]:
+        """Queue several named documents"""
+        return [self.submit(name, document) for name, document in documents.items()]
+
+    def _work(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            job.started_at = time.perf_counter()
+            job.status = "printing"
+            try:
+                self.backend.print_document(job)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                job.finish("failed", str(e))
+            else:
+                job.finish("done")
+
+    def close(self) -> None:
+        """Finish the queued jobs and stop the workers"""
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
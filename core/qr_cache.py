@@ -0,0 +1,106 @@
+"""Module to render and cache the QR codes printed on stock labels"""
+
+import hashlib
+import io
+import pathlib
+import threading
+from collections import OrderedDict
+
+import qrcode
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+LOGO_PATH = pathlib.Path(__file__).parent / "assets/img/fk-logo.png"
+
+QR_SIZE_MM = 15
+QR_PIXELS = int(QR_SIZE_MM * (300 / 25.4))
+LOGO_SIZE = int(QR_PIXELS * 0.3)
+
+
+class QRCodeCache:
+    """LRU cache of rendered QR codes keyed by their payload (code;qty)"""
+
+    def __init__(self, max_size: int = 512, disk_path: pathlib.Path | None = None):
+        self.max_size = max_size
+        self.disk_path = disk_path
+        self._images: OrderedDict[str, bytes] = OrderedDict()
+        self._logo: Image.Image | None = None
+        self._lock = threading.Lock()
+        if self.disk_path is not None:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+
+    def _get_logo(self) -> Image.Image:
+        """Open and scale the logo only once"""
+        if self._logo is None:
+            with Image.open(LOGO_PATH) as logo:
+                self._logo = logo.resize(
+                    (LOGO_SIZE, LOGO_SIZE), Image.Resampling.LANCZOS
+                )
+        return self._logo
+
+    def _disk_file(self, payload: str) -> pathlib.Path:
+        """Path of the persisted PNG for a payload"""
+        # Hashed, payloads that differ only in punctuation must not share a file
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return self.disk_path / f"qr-code-{digest}.png"
+
+    def _render(self, payload: str) -> bytes:
+        """Render the QR code with the logo in the middle as PNG bytes"""
+        qr = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_H,
+            box_size=QR_PIXELS // 41,
+            border=1,
+        )
+        qr.add_data(payload)
+        qr.make()
+
+        qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+        qr_img = qr_img.resize((QR_PIXELS, QR_PIXELS), Image.Resampling.LANCZOS)
+        logo = self._get_logo()
+        pos = ((qr_img.size[0] - logo.size[0]) // 2, (qr_img.size[1] - logo.size[1]) // 2)
+        qr_img.paste(logo, pos)
+
+        buffer = io.BytesIO()
+        qr_img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def get_png(self, payload: str) -> bytes:
+        """Get the PNG bytes of a QR code, rendering it on a cache miss"""
+        with self._lock:
+            if payload in self._images:
+                self._images.move_to_end(payload)
+                return self._images[payload]
+
+        png: bytes | None = None
+        if self.disk_path is not None:
+            disk_file = self._disk_file(payload)
+            if disk_file.exists():
+                png = disk_file.read_bytes()
+
+        if png is None:
+            png = self._render(payload)
+            if self.disk_path is not None:
+                self._disk_file(payload).write_bytes(png)
+
+        with self._lock:
+            self._images[payload] = png
+            self._images.move_to_end(payload)
+            while len(self._images) > self.max_size:
+                self._images.popitem(last=False)
+        return png
+
+    def get_image(self, code: str, qty: int) -> ImageReader:
+        """Get an in-memory image of the QR code ready for pdf.drawImage"""
+        return ImageReader(io.BytesIO(self.get_png(f"{code};{qty}")))
+
+    def warm_up(self) -> None:
+        """Load the logo now, so the first label doesn't wait for it"""
+        self._get_logo()
+
+    def clear(self) -> None:
+        """Remove every cached QR code from memory"""
+        with self._lock:
+            self._images.clear()
+
+
+qr_cache = QRCodeCache()
@@ -0,0 +1,62 @@
+"""Module to split the NFe quantities between pending materials and stock"""
+
+import math
+from operator import attrgetter
+from typing import Dict, List
+
+from core.models import Material, OrderData
+
+
+def sort_by_creation_date(pending_materials: List[Material]) -> List[Material]:
+    """Sort pending materials from the oldest to the newest, keeping ties in order"""
+    return sorted(pending_materials, key=attrgetter("creation_date"))
+
+
+def reconcile(
+    orders: List[OrderData], pending_materials: List[Material]
+) -> tuple[List[OrderData], List[Material]]:
+    """Allocate the received quantities to the pending materials.
+
+    The oldest pending materials are served first. Each one takes what is
+    left of its code across the NFe orders, in the NFe order. The
+    quantities of the given orders and pending materials are updated in
+    place. Returns the orders and the pending materials (sorted by creation
+    date) that still have quantity.
+    """
+    orders_by_code: Dict[str, List[OrderData]] = {}
+    available: Dict[str, float] = {}
+    for order in orders:
+        orders_by_code.setdefault(order.code, []).append(order)
+        available[order.code] = available.get(order.code, 0) + order.qty
+
+    pending_materials = sort_by_creation_date(pending_materials)
+    for pending_material in pending_materials:
+        code = pending_material.code
+        if code not in orders_by_code:
+            continue
+
+        # Keep the fractional part, the pending quantity is reduced in whole units
+        pending_qty = pending_material.pending_qty
+        if available[code] <= 0:
+            pending_qty = 0
+        elif pending_qty > available[code]:
+            # Less than one unit received (0.3 KG for 0.5 pending) allocates none
+            pending_qty = max(pending_qty - math.ceil(pending_qty - available[code]), 0)
+        pending_material.pending_qty = pending_qty
+        available[code] -= pending_qty
+
+        for order in orders_by_code[code]:
+            if pending_qty <= 0:
+                break
+            allocated = min(order.qty, pending_qty)
+            order.qty -= allocated
+            pending_qty -= allocated
+
+    return (
+        [order for order in orders if order.qty != 0],
+        [
+            pending_material
+            for pending_material in pending_materials
+            if pending_material.pending_qty > 0
+        ],
+    )
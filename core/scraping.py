@@ -1,353 +1,716 @@
-"""
-Scraping with selenium and requests
-"""
-
-import json
-import os
-from dataclasses import dataclass, field, asdict
-from typing import List, Dict
-from datetime import datetime as dt
-import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import (
-    NoSuchElementException,
-    TimeoutException,
-    WebDriverException,
-)
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-
-
-@dataclass
-class Material:
-    """Dataclass to represent a pending material"""
-
-    creation_date: str
-    code: str
-    op_number: str
-    product: str
-    pending_qty: float
-
-
-@dataclass
-class PendingMaterials:
-    """Dataclass to represent a list of pending materials"""
-
-    pending_materials: List[Material] = field(default_factory=list)
-
-    def to_dict(self) -> Dict:
-        """Convert the istance to a dictionary"""
-        return asdict(self)
-
-    def to_json(self) -> dict:
-        """Convert to json"""
-        with open("./tmp/pending_materials.json", "w", encoding="utf-8") as f:
-            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
-
-        return self.to_dict()
-
-
-@dataclass
-class OrderData:
-    """Dataclass to represent an order"""
-
-    address: str
-    order: int
-    code: str
-    description: str
-    qty: float
-    qty_total: float
-    unit_type: str
-
-
-@dataclass
-class NFeData:
-    """Dataclass to represent an NFe and generate a JSON file to generate labels"""
-
-    date: str
-    nfe_number: int
-    supplier_name: str
-    orders: List[OrderData] = field(default_factory=list)
-    pending_materials: List[Dict] = field(default_factory=list)
-
-    def to_dict(self) -> Dict:
-        """Convert the istance to a dictionary"""
-        return asdict(self)
-
-    def to_json(self) -> str:
-        """Convert to json"""
-        with open("./tmp/nfe_data.json", "w", encoding="utf-8") as f:
-            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
-
-        return json.dumps(self.to_dict(), ensure_ascii=False, indent=4)
-
-
-class CargaMaquinaClient:
-    """Client to interact with CargaMaquina"""
-
-    today = dt.now()
-    username: str
-    password: str
-
-    def __init__(self, username: str, password: str):
-        self.username = username
-        self.password = password
-        self.driver = webdriver.Chrome()
-        self.requests_cookies: dict = {}
-        self.selenium_cookies: dict = {}
-        self._initialize_client()
-
-    def _initialize_client(self):
-        try:
-            self.login()
-        except WebDriverException as e:
-            print(f"Error: {e}")
-
-    def _configure_chrome(self) -> Options:
-        """Configure chrome options to run in headless mode."""
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        return chrome_options
-
-    def _save_cookies(self) -> Dict:
-        """Save cookies to a JSON file"""
-        self.selenium_cookies = self.driver.get_cookies()
-
-        with open("./tmp/cookies.json", "w", encoding="utf-8") as f:
-            json.dump(self.selenium_cookies, f, ensure_ascii=False, indent=4)
-
-        self.requests_cookies = {
-            cookie["name"]: cookie["value"] for cookie in self.selenium_cookies
-        }
-        with open("./tmp/requests_cookies.json", "w", encoding="utf-8") as f:
-            json.dump(self.requests_cookies, f, ensure_ascii=False, indent=4)
-
-    def _load_cookies(self):
-        """Load cookies from a JSON file"""
-        if "cookies.json" in os.listdir():
-            with open("./tmp/cookies.json", "r", encoding="utf-8") as file:
-                self.selenium_cookies = json.load(file)
-        else:
-            raise FileNotFoundError
-        if "requests_cookies.json" in os.listdir():
-            with open("./tmp/requests_cookies.json", "r", encoding="utf-8") as file:
-                self.requests_cookies = json.load(file)
-        else:
-            raise FileNotFoundError
-
-
-    def close(self):
-        self.driver.quit()
-
-    def login(self):
-        """Login to carga maquina and get cookies for requests"""
-        try:
-            self.driver.get(
-                "https://app.cargamaquina.com.br/site/login?c=31.1~78%2C8%5E56%2C8"
-            )
-
-            try:
-                username_input = self.driver.find_element(
-                    by=By.NAME, value="LoginForm[username]"
-                )
-
-                password_input = self.driver.find_element(
-                    by=By.NAME, value="LoginForm[password]"
-                )
-
-                username_input.send_keys(self.username)
-                password_input.send_keys(self.password)
-
-            except NoSuchElementException as e:
-                print(f"Campos de login ou senha não encontrados. {e}")
-
-            login_button = self.driver.find_element(by=By.NAME, value="yt0")
-            login_button.click()
-            self._save_cookies()
-        except TimeoutException as e:
-            print(f"Timeout: {e}")
-        except WebDriverException as e:
-            print(f"Error: {e}")
-
-    def nfe_data_scraping(self, negociation_id: str) -> None:
-        """Scraping NFE data"""
-        try:
-            self.driver.get(
-                f"https://app.cargamaquina.com.br/compra?Compra%5Bnegociacao%5D={negociation_id}"
-            )
-            nfe_checkbox = WebDriverWait(self.driver, 20).until(
-                EC.presence_of_all_elements_located(
-                    (By.XPATH, '//*[@id="compraSelecionados_0"]')
-                )
-            )
-            nfe_checkbox[0].click()
-
-            nfe_view = self.driver.find_element(
-                by=By.XPATH, value='//*[@id="linkVisualizar"]'
-            )
-            nfe_view.click()
-
-            html: str = self.driver.page_source
-            self.get_nfe_data(html)
-
-        except TimeoutException as e:
-            print(f"Timeout: {e}")
-        except WebDriverException as e:
-            print(f"Error: {e}")
-
-    def get_nfe_data(self, html: str) -> str:
-        """Get data from HTML and save it to a JSON format"""
-        soup = BeautifulSoup(html, "html.parser")
-        nfe_number: int = int(
-            soup.find("input", {"id": "FaturamentoGrid_0_observacao"})
-            .get("value")
-            .split("-")[-1]
-            .strip()
-        )
-        supplier_name: str = (
-            soup.find("span", {"class": "select2-chosen"}).text.strip().split(" ")[0]
-        )
-        mp_table = soup.find_all("table")[1]
-        orders: List[OrderData] = []
-        trs = mp_table.find_all("tr")[1:]
-        for tr in trs:
-            order: int = tr.find_all("td")[3].text.strip()
-            address: str = tr.find_all("td")[4].text.strip()
-            code: str = tr.find_all("td")[5].text.strip()
-            description: str = tr.find_all("td")[6].text.strip()
-            qty: float = tr.find_all("td")[8].text.strip().split(" ")[0]
-            unit_type: str = tr.find_all("td")[8].text.strip().split(" ")[-1].upper()
-            orders.append(
-                OrderData(
-                    address=address,
-                    order=order,
-                    code=code,
-                    description=description,
-                    qty=float(qty),
-                    qty_total=float(qty),
-                    unit_type=unit_type,
-                )
-            )
-        nfe_data: NFeData = NFeData(
-            date=dt.now().strftime("%d/%m/%Y"),
-            nfe_number=nfe_number,
-            supplier_name=supplier_name,
-            orders=orders,
-        )
-        # Getting pending materials by codes in Nfe data scraping and sorting by crescent date.
-        codes: list[str] = [order.code for order in nfe_data.orders]
-        pending_materials: dict = self.get_requested_materials(codes)
-        nfe_data.pending_materials = pending_materials["pending_materials"]
-        nfe_data.pending_materials = sorted(
-            nfe_data.pending_materials,
-            key=lambda x: dt.strptime(x["creation_date"], "%d/%m/%y"),
-        )
-
-        print(nfe_data.to_json())
-
-        if nfe_data.pending_materials:
-            for pending_material in nfe_data.pending_materials:
-                for order in nfe_data.orders:
-                    if pending_material["code"] == order.code:
-                        print("Order qty:", order.qty)
-                        print("Pending material qty:", pending_material["pending_qty"])
-                        # Order qty validation
-                        if order.qty == 0:
-                            pending_material["pending_qty"] = 0
-
-                        # Pending material qty validation
-                        if pending_material["pending_qty"] > order.qty:
-                            while pending_material["pending_qty"] > order.qty:
-                                pending_material["pending_qty"] -= 1
-                            order.qty -= pending_material["pending_qty"]
-                        elif pending_material["pending_qty"] < order.qty:
-                            order.qty -= pending_material["pending_qty"]
-                        elif pending_material["pending_qty"] == order.qty:
-                            order.qty -= pending_material["pending_qty"]
-
-            nfe_data.pending_materials = [pending_material for pending_material in nfe_data.pending_materials if pending_material["pending_qty"] > 0]
-        for order in nfe_data.orders:
-            if order.qty == 0:
-                nfe_data.orders.remove(order)
-
-        nfe_data.to_json()
-        return nfe_data
-
-    def get_requested_materials(self, nfe_material_code: List[str]):
-        """Get the data of pending materials in production orders on CargaMaquina"""
-        params: dict[str, str] = {
-            "Pedido[_nomeMaterial]": "",
-            "Pedido[_solicitante]": "",
-            "Pedido[status_id]": "",
-            "Pedido[situacao]": "TODAS",
-            "Pedido[_qtdeFornecida]": "Parcialmente",
-            "Pedido[_inicioCriacao]": f"01/01/{self.today.year}",
-            "Pedido[_fimCriacao]": f"25/12/{self.today.year}",
-            "pageSize": "20",
-        }
-
-        response = requests.get(
-            "https://app.cargamaquina.com.br/pedido/exportarPedidoFaltaMP",
-            params=params,
-            cookies=self.requests_cookies,
-            timeout=20,
-        )
-
-        if not response.ok:
-            print(f"Error to get pending_materials status_code: {response.status_code}")
-            return None
-        try:
-            soup = BeautifulSoup(response.content, "html.parser")
-
-            materials: List[Material] = []
-            trs: list = soup.find_all("tr")[1:]
-            for tr in trs:
-                creation_date: dt = dt.strptime(
-                    tr.find_all("td")[0].text.strip(), "%d/%m/%y"
-                )
-                code: str = tr.find_all("td")[1].text.strip()
-                op_number: str = str(tr.find_all("td")[3].text.strip())
-                product: str = tr.find_all("td")[5].text.strip()
-                pending_qty: str | float = (
-                    tr.find_all("td")[8].text.strip().split(" ")[0]
-                )
-                unit_type: str = tr.find_all("td")[8].text.strip().split(" ")[-1]
-
-                if (creation_date.year < self.today.year) or (unit_type == "mt"):
-                    continue
-
-                if "." in pending_qty:
-                    pending_qty = float(pending_qty.replace(".", ""))
-
-                if code not in nfe_material_code:
-                    continue
-
-                pending_qty = float(pending_qty)
-                materials.append(
-                    Material(
-                        creation_date=creation_date.strftime("%d/%m/%y"),
-                        code=code,
-                        op_number=op_number,
-                        product=product,
-                        pending_qty=pending_qty,
-                    )
-                )
-            pending_materials: PendingMaterials = PendingMaterials(
-                pending_materials=materials
-            )
-            data: dict = pending_materials.to_dict()
-            return data
-
-        except ValueError as e:
-            print(f"Error: {e}")
-
-
-if __name__ == "__main__":
-    client = CargaMaquinaClient(username="your username", password="your password")
-    client.nfe_data_scraping(negociation_id="your negociation id")
+"""
+Scraping with selenium and requests
+"""
+
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, List, Dict
+from datetime import date, datetime as dt
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    TimeoutException,
+    WebDriverException,
+)
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from core.driver_pool import DriverPool, PooledDriver
+from core.export_fetcher import (
+    ChunkStats,
+    PendingMaterialsFetcher,
+    QueryPlanner,
+    date_chunks,
+)
+from core.metrics import metrics
+from core.models import Material, NFeData
+from core.options import BACKENDS, PENDING_SOURCES
+from core.parsing import parse_nfe_page
+from core.pending_mirror import FULL_SYNC_INTERVAL, PendingMaterialsMirror
+from core.reconciliation import reconcile
+from core.session_store import SessionExpired, SessionStore, check_response, is_login_url
+
+BASE_URL: str = os.environ.get("CARGAMAQUINA_URL", "https://app.cargamaquina.com.br")
+LOGIN_PATH: str = "/site/login?c=31.1~78%2C8%5E56%2C8"
+COMPRA_PATH: str = "/compra"
+PENDING_MATERIALS_PATH: str = "/pedido/exportarPedidoFaltaMP"
+# Longest wait for a free driver, a page takes at most about 30 s
+DRIVER_CHECKOUT_TIMEOUT: float = 120
+
+# Pending materials by code of the codes given, once the export or mirror is
+# ready, None when the per-code queries fail
+PendingLookup = Callable[[List[str]], Dict[str, List[Material]] | None]
+
+
+def create_session(pool_size: int = 16) -> requests.Session:
+    """Create a requests session with a connection pool"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def nfe_view_url(soup: BeautifulSoup, nfe_checkbox, page_url: str) -> str | None:
+    """URL of the NFe view linked by the search results, None without a real link"""
+    links = [soup.find(id="linkVisualizar")]
+    row = nfe_checkbox.find_parent("tr")
+    if row is not None:
+        links.extend(row.find_all("a", href=lambda href: href and "visualizar" in href))
+    for link in links:
+        href: str = link.get("href", "") if link else ""
+        if href and href != "#" and not href.startswith("javascript"):
+            return urljoin(page_url, href)
+    return None
+
+
+class HttpScraper:
+    """Scraper that logs in and reads the NFe pages with plain HTTP requests"""
+
+    def __init__(self, session: requests.Session, base_url: str, timeout: int = 20):
+        self.session = session
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def login(self, username: str, password: str) -> None:
+        """Post the login form keeping its hidden fields"""
+        response = self.session.get(
+            f"{self.base_url}{LOGIN_PATH}", timeout=self.timeout
+        )
+        response.raise_for_status()
+        soup = BeautifulSoup(response.text, "html.parser")
+        form = soup.find("input", {"name": "LoginForm[username]"})
+        form = form.find_parent("form") if form else None
+        if form is None:
+            raise ValueError("Formulário de login não encontrado")
+
+        data: dict[str, str] = {
+            field_input["name"]: field_input.get("value", "")
+            for field_input in form.find_all("input")
+            if field_input.get("name")
+        }
+        data["LoginForm[username]"] = username
+        data["LoginForm[password]"] = password
+        action: str = urljoin(response.url, form.get("action") or response.url)
+
+        response = self.session.post(action, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        if "site/login" in response.url:
+            raise ValueError("Usuário ou senha inválidos")
+
+    def fetch_nfe_html(self, negociation_id: str) -> str:
+        """Get the HTML of the NFe page of a negotiation"""
+        response = self.session.get(
+            f"{self.base_url}{COMPRA_PATH}",
+            params={"Compra[negociacao]": negociation_id},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        check_response(response)
+        soup = BeautifulSoup(response.text, "html.parser")
+        nfe_checkbox = soup.find("input", {"id": "compraSelecionados_0"})
+        if nfe_checkbox is None:
+            raise ValueError(f"Nenhuma compra encontrada na negociação {negociation_id}")
+
+        view_url = nfe_view_url(soup, nfe_checkbox, response.url)
+        if view_url is None:
+            raise ValueError(
+                f"Link de visualização da NFe não encontrado na negociação "
+                f"{negociation_id}, use o backend selenium"
+            )
+
+        response = self.session.get(view_url, timeout=self.timeout)
+        response.raise_for_status()
+        check_response(response)
+        return response.text
+
+
+class CargaMaquinaClient:
+    """Client to interact with CargaMaquina"""
+
+    username: str
+    password: str
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        backend: str = "selenium",
+        base_url: str = BASE_URL,
+        pending_cache_ttl: float = 300,
+        drivers: int = 1,
+        max_driver_uses: int = 50,
+        pending_source: str = "export",
+        checkout_timeout: float = DRIVER_CHECKOUT_TIMEOUT,
+        pending_first_year: int | None = None,
+        pending_full_sync_interval: float = FULL_SYNC_INTERVAL,
+        lean_browser: bool = False,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend must be one of {BACKENDS}, got {backend}")
+        if pending_source not in PENDING_SOURCES:
+            raise ValueError(
+                f"Pending source must be one of {PENDING_SOURCES}, got {pending_source}"
+            )
+        self.username = username
+        self.password = password
+        self.backend = backend
+        self.base_url = base_url.rstrip("/")
+        self.session: requests.Session = create_session()
+        self.session_store = SessionStore()
+        self.driver_pool = DriverPool(drivers, max_driver_uses, lean=lean_browser)
+        self.checkout_timeout = checkout_timeout
+        # Bumped on every login, drivers with older cookies get the new ones
+        self._cookies_version: int = 0
+        self.http_scraper = HttpScraper(self.session, self.base_url)
+        self.export_fetcher = PendingMaterialsFetcher(
+            self.session, f"{self.base_url}{PENDING_MATERIALS_PATH}"
+        )
+        self.pending_source = pending_source
+        self.query_planner = QueryPlanner(
+            workers=self.export_fetcher.workers,
+            chunks=len(date_chunks(self.year, self.export_fetcher.months_per_chunk)),
+        )
+        self.requests_cookies: dict = {}
+        self.pending_cache_ttl = pending_cache_ttl
+        self.pending_cache_hits: int = 0
+        self.pending_cache_misses: int = 0
+        self._pending_cache: Dict[str, List[Material]] | None = None
+        self._pending_cache_time: float = 0.0
+        self._pending_cache_lock = threading.Lock()
+        self.pending_mirror: PendingMaterialsMirror | None = (
+            PendingMaterialsMirror(
+                first_year=pending_first_year,
+                full_sync_interval=pending_full_sync_interval,
+            )
+            if pending_source == "mirror"
+            else None
+        )
+        # Gets the pending materials while the NFe page is scraped
+        self._pending_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pending-materials"
+        )
+        # Syncs a stale mirror while the lookups answer from its old rows
+        self._mirror_sync_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pending-mirror"
+        )
+        self._mirror_sync_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self.selenium_cookies: list[dict] = []
+        self._initialize_client()
+
+    def _initialize_client(self):
+        try:
+            self.login()
+        except (WebDriverException, requests.RequestException, ValueError) as e:
+            print(f"Error: {e}")
+
+    def _save_cookies(self, pooled: PooledDriver) -> None:
+        """Save the browser cookies and share them with the requests session"""
+        self.selenium_cookies = pooled.driver.get_cookies()
+        self._cookies_version += 1
+        pooled.cookies_version = self._cookies_version
+        self.requests_cookies = {
+            cookie["name"]: cookie["value"] for cookie in self.selenium_cookies
+        }
+        self.session.cookies.update(self.requests_cookies)
+        self.session_store.save(self.selenium_cookies, self.requests_cookies)
+
+    def _restore_session(self) -> bool:
+        """Reuse the saved cookies when a probe request shows they are still valid"""
+        saved = self.session_store.load()
+        if saved is None:
+            return False
+        selenium_cookies, requests_cookies = saved
+        self.session.cookies.update(requests_cookies)
+        if not self.session_store.probe(self.session, self.base_url):
+            self.session.cookies.clear()
+            metrics.count("session", result="expired")
+            return False
+
+        self.selenium_cookies = selenium_cookies
+        self.requests_cookies = requests_cookies
+        self._cookies_version += 1
+        metrics.count("session", result="restored")
+        print("Sessão anterior reutilizada")
+        return True
+
+    def _add_browser_cookies(self, pooled: PooledDriver) -> None:
+        """Give a driver the cookies of the last login before its next page"""
+        if pooled.cookies_version == self._cookies_version:
+            return
+        # Cookies can only be added to the domain of the current page
+        pooled.driver.get(f"{self.base_url}{LOGIN_PATH}")
+        for cookie in self.selenium_cookies:
+            pooled.driver.add_cookie(cookie)
+        pooled.cookies_version = self._cookies_version
+
+    def refresh_session(self, pooled: PooledDriver | None = None) -> None:
+        """Log in again after a request was bounced to the login page
+
+        Threads without a driver, like the pending materials downloads, log
+        in over HTTP: waiting for a driver while holding the login lock would
+        block the threads that hold the drivers and wait for the lock.
+        """
+        with self._login_lock:
+            # Another thread may have logged in while this one waited
+            if self.session_store.probe(self.session, self.base_url):
+                return
+            self.session.cookies.clear()
+            self.session_store.clear()
+            metrics.count("session", result="refreshed")
+            if pooled is None:
+                with metrics.span("scraping.login"):
+                    self._http_login()
+            else:
+                self.login(pooled)
+
+    def _retry_expired(self, function: Callable, *args):
+        """Call the function, logging in again once if the session expired"""
+        try:
+            return function(*args)
+        except SessionExpired:
+            self.refresh_session()
+            return function(*args)
+
+    @property
+    def year(self) -> int:
+        """Current year, read on each call so a running service sees the new one"""
+        return dt.now().year
+
+    def close(self):
+        self._pending_executor.shutdown(wait=False, cancel_futures=True)
+        # A sync writing to the mirror must end before it is closed
+        self._mirror_sync_executor.shutdown(wait=True)
+        self.driver_pool.close()
+        if self.pending_mirror is not None:
+            self.pending_mirror.close()
+        self.session.close()
+
+    @metrics.timed("scraping.login")
+    def login(self, pooled: PooledDriver | None = None):
+        """Reuse the saved session or login to carga maquina and save the cookies"""
+        if self._restore_session():
+            return
+
+        if self.backend == "http":
+            self._http_login()
+            return
+
+        # A thread scraping an NFe logs in again with the driver it holds
+        if pooled is not None:
+            self._browser_login(pooled)
+            return
+        with self.driver_pool.checkout(self.checkout_timeout) as pooled:
+            self._browser_login(pooled)
+
+    def _http_login(self) -> None:
+        """Post the login form with requests and share the cookies with the drivers"""
+        self.http_scraper.login(self.username, self.password)
+        self.requests_cookies = self.session.cookies.get_dict()
+        # The drivers get them before their next page, see _add_browser_cookies
+        self.selenium_cookies = [
+            {"name": name, "value": value, "path": "/"}
+            for name, value in self.requests_cookies.items()
+        ]
+        self._cookies_version += 1
+        self.session_store.save(self.selenium_cookies, self.requests_cookies)
+
+    def _browser_login(self, pooled: PooledDriver) -> None:
+        """Fill the login form in the browser and save the cookies"""
+        driver = pooled.driver
+        try:
+            driver.get(f"{self.base_url}{LOGIN_PATH}")
+
+            try:
+                username_input = driver.find_element(
+                    by=By.NAME, value="LoginForm[username]"
+                )
+
+                password_input = driver.find_element(
+                    by=By.NAME, value="LoginForm[password]"
+                )
+
+                username_input.send_keys(self.username)
+                password_input.send_keys(self.password)
+
+            except NoSuchElementException as e:
+                print(f"Campos de login ou senha não encontrados. {e}")
+
+            login_button = driver.find_element(by=By.NAME, value="yt0")
+            login_button.click()
+            self._save_cookies(pooled)
+        except TimeoutException as e:
+            print(f"Timeout: {e}")
+        except WebDriverException as e:
+            print(f"Error: {e}")
+
+    def nfe_data_scraping(
+        self, negociation_id: str, output_dir: str | None = None
+    ) -> NFeData | None:
+        """Scraping NFE data"""
+        scraped = self.scrape_nfe(negociation_id, output_dir)
+        return None if scraped is None else scraped[1]
+
+    def scrape_nfe(
+        self, negociation_id: str, output_dir: str | None = None
+    ) -> tuple[NFeData, NFeData] | None:
+        """Parsed NFe data of a negotiation and its reconciled copy"""
+        # The export does not depend on the NFe, it downloads while the page loads
+        pending = self.prefetch_pending_materials()
+        if self.backend == "http":
+            try:
+                with metrics.span("scraping.nfe_page", backend="http"):
+                    html: str = self._retry_expired(
+                        self.http_scraper.fetch_nfe_html, negociation_id
+                    )
+            except (requests.RequestException, ValueError, SessionExpired) as e:
+                print(f"Error: {e}")
+                return None
+            parsed = self.parse_nfe(html)
+            return parsed, self.reconcile_nfe(parsed, output_dir, pending)
+
+        try:
+            # Each negotiation navigates its own driver of the pool
+            with self.driver_pool.checkout(
+                self.checkout_timeout
+            ) as pooled, metrics.span("scraping.nfe_page", backend="selenium"):
+                driver = pooled.driver
+                self._add_browser_cookies(pooled)
+                compra_url = (
+                    f"{self.base_url}{COMPRA_PATH}?Compra%5Bnegociacao%5D={negociation_id}"
+                )
+                driver.get(compra_url)
+                if is_login_url(driver.current_url):
+                    self.refresh_session(pooled)
+                    # Another thread may have done the login with its own driver
+                    self._add_browser_cookies(pooled)
+                    driver.get(compra_url)
+                with metrics.span("scraping.wait_nfe"):
+                    nfe_checkbox = WebDriverWait(driver, 20).until(
+                        EC.presence_of_all_elements_located(
+                            (By.XPATH, '//*[@id="compraSelecionados_0"]')
+                        )
+                    )
+                nfe_checkbox[0].click()
+
+                nfe_view = driver.find_element(
+                    by=By.XPATH, value='//*[@id="linkVisualizar"]'
+                )
+                nfe_view.click()
+
+                html: str = driver.page_source
+            parsed = self.parse_nfe(html)
+            return parsed, self.reconcile_nfe(parsed, output_dir, pending)
+
+        except (TimeoutException, TimeoutError) as e:
+            print(f"Timeout: {e}")
+        except WebDriverException as e:
+            print(f"Error: {e}")
+        return None
+
+    def get_nfe_data(
+        self,
+        html: str,
+        output_dir: str | None = None,
+        pending: "Future[PendingLookup | None] | None" = None,
+    ) -> NFeData:
+        """Get data from HTML, saving it as JSON too when output_dir is given
+
+        pending is a prefetch_pending_materials started before the page was
+        scraped, without it the pending materials are got after the parsing.
+        """
+        return self.reconcile_nfe(self.parse_nfe(html), output_dir, pending)
+
+    def parse_nfe(self, html: str) -> NFeData:
+        """NFe data of the HTML as received, without pending materials"""
+        with metrics.span("parsing.nfe_page"):
+            nfe_number, supplier_name, orders = parse_nfe_page(html)
+            nfe_data: NFeData = NFeData(
+                date=dt.now().strftime("%d/%m/%Y"),
+                nfe_number=nfe_number,
+                supplier_name=supplier_name,
+                orders=list(orders),
+            )
+        metrics.count("nfe_orders", len(nfe_data.orders))
+        return nfe_data
+
+    def reconcile_nfe(
+        self,
+        parsed: NFeData,
+        output_dir: str | None = None,
+        pending: "Future[PendingLookup | None] | None" = None,
+    ) -> NFeData:
+        """Reconciled copy of parsed NFe data with the current pending materials"""
+        # Getting pending materials by codes in Nfe data scraping, reconcile sorts them by date.
+        codes: list[str] = [order.code for order in parsed.orders]
+        pending_materials = self.get_requested_materials(codes, pending)
+        if pending_materials is None:
+            raise ValueError("Não foi possível obter os materiais pendentes")
+        # The parsed orders are kept as received, to be reconciled again later
+        nfe_data = NFeData(
+            date=parsed.date,
+            nfe_number=parsed.nfe_number,
+            supplier_name=parsed.supplier_name,
+            orders=[order.copy() for order in parsed.orders],
+        )
+        with metrics.span("reconciliation"):
+            nfe_data.orders, nfe_data.pending_materials = reconcile(
+                nfe_data.orders, pending_materials
+            )
+        metrics.count("stock_orders", len(nfe_data.orders))
+        metrics.count("pending_materials", len(nfe_data.pending_materials))
+
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            nfe_data.to_json(os.path.join(output_dir, "nfe_data.json"))
+        return nfe_data
+
+    @property
+    def pending_cache_valid(self) -> bool:
+        """Whether the cached pending materials export can still be used"""
+        return (
+            self._pending_cache is not None
+            and time.monotonic() - self._pending_cache_time < self.pending_cache_ttl
+        )
+
+    def invalidate_pending_cache(self) -> None:
+        """Drop the cached pending materials export"""
+        with self._pending_cache_lock:
+            self._pending_cache = None
+
+    @property
+    def pending_cache_age(self) -> float | None:
+        """Seconds since the cached pending materials export was downloaded"""
+        if self.pending_mirror is not None:
+            return self.pending_mirror.age
+        if self._pending_cache is None:
+            return None
+        return time.monotonic() - self._pending_cache_time
+
+    def refresh_pending_cache(self) -> bool:
+        """Download the export again, the old one keeps serving until it arrives"""
+        if self.pending_mirror is not None:
+            return self._sync_pending_mirror()
+        # Each NFe queries its own codes, there is no export to keep
+        if self.pending_source == "codes":
+            return False
+        index = self._download_pending_materials()
+        if index is None:
+            return False
+        with self._pending_cache_lock:
+            self._pending_cache = index
+            self._pending_cache_time = time.monotonic()
+        return True
+
+    def _get_pending_materials_index(self) -> Dict[str, List[Material]] | None:
+        """Get the pending materials export indexed by code, downloading it on a miss"""
+        with self._pending_cache_lock:
+            if self.pending_cache_valid:
+                self.pending_cache_hits += 1
+                metrics.count("pending_cache", result="hit")
+                return self._pending_cache
+
+            self.pending_cache_misses += 1
+            metrics.count("pending_cache", result="miss")
+            index = self._download_pending_materials()
+            if index is not None:
+                self._pending_cache = index
+                self._pending_cache_time = time.monotonic()
+            return index
+
+    @metrics.timed("scraping.pending_export")
+    def _download_pending_materials(self) -> Dict[str, List[Material]] | None:
+        """Download and parse the whole pending materials export"""
+        start = time.perf_counter()
+        # Its own list, the keeper thread or the mirror may download at the same time
+        stats: List[ChunkStats] = []
+        try:
+            index: Dict[str, List[Material]] = self._retry_expired(
+                self._fetch_pending_materials, stats
+            )
+        except SessionExpired as e:
+            print(f"Error to get pending_materials: {e}")
+            return None
+        except requests.RequestException as e:
+            print(f"Error to get pending_materials: {e}")
+            return None
+        except ValueError as e:
+            print(f"Error: {e}")
+            return None
+        metrics.count(
+            "pending_export_materials", sum(len(materials) for materials in index.values())
+        )
+        self._record_strategy("export", stats, time.perf_counter() - start)
+        return index
+
+    def _fetch_pending_materials(
+        self, stats: List[ChunkStats]
+    ) -> Dict[str, List[Material]]:
+        """Download the pending materials export of the year and index it by code"""
+        index: Dict[str, List[Material]] = {}
+        for material in self.export_fetcher.iter_materials(
+            self.year, self.requests_cookies, stats
+        ):
+            index.setdefault(material.code, []).append(material)
+        return index
+
+    def _fetch_export_rows(self, start: date, end: date) -> Iterator[List[str]]:
+        """Cells of the export rows created between the dates"""
+        return self.export_fetcher.iter_cells(start, end, self.requests_cookies)
+
+    @metrics.timed("scraping.pending_mirror_sync")
+    def _sync_pending_mirror(self) -> bool:
+        """Bring the pending materials mirror up to date with the export"""
+        try:
+            stats = self._retry_expired(
+                self.pending_mirror.sync, self._fetch_export_rows
+            )
+        except (SessionExpired, requests.RequestException, ValueError) as e:
+            print(f"Error to sync pending_materials: {e}")
+            return False
+        kind = "completa" if stats.full else "incremental"
+        print(
+            f"Sincronização {kind} dos materiais pendentes: {stats.fetched_rows} "
+            f"linhas de {stats.start:%d/%m/%Y} a {stats.end:%d/%m/%Y} em "
+            f"{stats.seconds:.1f}s, {stats.total_rows} no espelho"
+        )
+        return True
+
+    def _get_pending_mirror(self) -> bool:
+        """Sync the mirror when older than the TTL, whether it can answer lookups"""
+        age = self.pending_mirror.age
+        with self._pending_cache_lock:
+            if age is not None and age < self.pending_cache_ttl:
+                self.pending_cache_hits += 1
+                metrics.count("pending_cache", result="hit")
+                return True
+            self.pending_cache_misses += 1
+            metrics.count("pending_cache", result="miss")
+        if age is not None:
+            # The old rows answer now, a single background sync updates them
+            if self._mirror_sync_lock.acquire(blocking=False):
+                self._mirror_sync_executor.submit(
+                    self._sync_pending_mirror_in_background
+                )
+            return True
+        # An empty mirror has nothing to answer with, its first sync is waited once
+        with self._mirror_sync_lock:
+            return self.pending_mirror.age is not None or self._sync_pending_mirror()
+
+    def _sync_pending_mirror_in_background(self) -> None:
+        try:
+            self._sync_pending_mirror()
+        finally:
+            self._mirror_sync_lock.release()
+
+    def _get_pending_lookup(self) -> PendingLookup | None:
+        """Get the export or the mirror ready, None when neither can be used"""
+        if self.pending_mirror is not None:
+            if not self._get_pending_mirror():
+                return None
+            return functools.partial(
+                self.pending_mirror.lookup, min_year=self.year
+            )
+        # The codes are only known once the NFe page is parsed
+        if self.pending_source in ("codes", "auto"):
+            return self._query_pending_materials
+        index = self._get_pending_materials_index()
+        if index is None:
+            return None
+        return lambda codes: index
+
+    def _query_pending_materials(
+        self, codes: List[str]
+    ) -> Dict[str, List[Material]] | None:
+        """Query each code, or in auto mode the export when it is expected to be faster"""
+        codes = list(dict.fromkeys(codes))
+        if self.pending_source == "auto":
+            # A cached export answers without any request
+            strategy = (
+                "export"
+                if self.pending_cache_valid
+                else self.query_planner.choose(len(codes))
+            )
+            metrics.count("pending_strategy", strategy=strategy)
+            if strategy == "export":
+                return self._get_pending_materials_index()
+        return self._download_codes(codes)
+
+    def _download_codes(self, codes: List[str]) -> Dict[str, List[Material]] | None:
+        """Query the pending materials of each code, filtered by the server"""
+        start = time.perf_counter()
+        try:
+            index, stats = self._retry_expired(self._fetch_codes, codes)
+        except (SessionExpired, requests.RequestException, ValueError) as e:
+            print(f"Error to get pending_materials: {e}")
+            return None
+        self._record_strategy("codes", stats, time.perf_counter() - start)
+        return index
+
+    def _fetch_codes(
+        self, codes: List[str]
+    ) -> tuple[Dict[str, List[Material]], List[ChunkStats]]:
+        return self.export_fetcher.fetch_codes(
+            codes, self.year, self.requests_cookies
+        )
+
+    def _record_strategy(
+        self, strategy: str, stats: List[ChunkStats], seconds: float
+    ) -> None:
+        """Report the requests, bytes and time of a pending materials lookup"""
+        self.query_planner.record(strategy, stats, seconds)
+        metrics.count("pending_requests", len(stats), strategy=strategy)
+        metrics.count(
+            "pending_bytes", sum(chunk.bytes for chunk in stats), strategy=strategy
+        )
+        metrics.count(
+            "pending_retries",
+            sum(chunk.attempts - 1 for chunk in stats),
+            strategy=strategy,
+        )
+        metrics.observe("pending_lookup", seconds, strategy=strategy)
+
+    def prefetch_pending_materials(self) -> "Future[PendingLookup | None]":
+        """Start getting the export or syncing the mirror in the background"""
+        return self._pending_executor.submit(self._get_pending_lookup)
+
+    def get_requested_materials(
+        self,
+        nfe_material_code: List[str],
+        pending: "Future[PendingLookup | None] | None" = None,
+    ) -> List[Material] | None:
+        """Get the data of pending materials in production orders on CargaMaquina
+
+        With a prefetch_pending_materials future, waits for it instead of
+        getting the export here.
+        """
+        if pending is None:
+            lookup = self._get_pending_lookup()
+        else:
+            # Only what is left of the download after the NFe page was scraped
+            with metrics.span("scraping.pending_wait"):
+                lookup = pending.result()
+        if lookup is None:
+            return None
+        index = lookup(nfe_material_code)
+        if index is None:
+            return None
+
+        # Each code keeps the export order, reconcile changes copies of the cached ones
+        return [
+            material.copy()
+            for code in dict.fromkeys(nfe_material_code)
+            for material in index.get(code, [])
+        ]
+
+
+if __name__ == "__main__":
+    client = CargaMaquinaClient(username="your username", password="your password")
+    client.nfe_data_scraping(negociation_id="your negociation id")
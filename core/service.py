@@ -0,0 +1,419 @@
+"""Module to run the label generator as a local HTTP service
+
+The service keeps one logged in client, the pending materials export and
+the fonts warm between requests, so each receipt only waits for its own NFe.
+
+    POST /jobs                  {"negociation_id": "...", "print": false,
+                                 "rescrape": false}
+    POST /jobs?wait=1           same, answering when the labels are ready
+    GET  /jobs/<job_id>         status of a job
+    GET  /jobs/<job_id>/<file>  label document of a finished job
+    GET  /health                client and pending materials cache state
+    GET  /metrics               Prometheus text, when the metrics are on
+"""
+
+import dataclasses
+import itertools
+import json
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from core.batch import process_negociation
+from core.generate_labels import TMP_FOLDER, register_fonts
+from core.job_store import JobStore
+from core.metrics import metrics
+from core.print_labels import get_print_queue, wait_jobs
+from core.scraping import CargaMaquinaClient
+
+SERVICE_FOLDER: pathlib.Path = TMP_FOLDER / "service"
+CONTENT_TYPES: dict[str, str] = {
+    ".pdf": "application/pdf",
+    ".zpl": "text/plain; charset=utf-8",
+    ".epl": "text/plain; charset=cp850",
+}
+MAX_BODY: int = 64 * 1024
+
+
+@dataclass
+class ServiceJob:
+    """A negotiation submitted to the service and its labels"""
+
+    job_id: int
+    negociation_id: str
+    print_labels: bool = False
+    rescrape: bool = False
+    cached: bool = False
+    stale: bool = False
+    submitted_at: float = field(default_factory=time.perf_counter)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    status: str = "queued"
+    error: str = ""
+    documents: Dict[str, bytes] = field(default_factory=dict, repr=False)
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job is done or failed"""
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait the end of the job, True when it finished"""
+        return self._done.wait(timeout)
+
+    def finish(self, status: str, error: str = "") -> None:
+        """Record the end of the job and wake up who is waiting for it"""
+        self.status = status
+        self.error = error
+        self.finished_at = time.perf_counter()
+        self._done.set()
+
+    def to_dict(self) -> dict:
+        """Status of the job as answered by the API"""
+        queued = (self.started_at or time.perf_counter()) - self.submitted_at
+        running = (
+            (self.finished_at or time.perf_counter()) - self.started_at
+            if self.started_at
+            else 0.0
+        )
+        return {
+            "job_id": self.job_id,
+            "negociation_id": self.negociation_id,
+            "status": self.status,
+            "error": self.error,
+            "print": self.print_labels,
+            "cached": self.cached,
+            "stale": self.stale,
+            "queued_seconds": round(queued, 3),
+            "running_seconds": round(running, 3),
+            "files": {
+                name: f"/jobs/{self.job_id}/{name}" for name in self.documents
+            },
+        }
+
+
+class LabelService:
+    """Warm client and bounded pool that turn negotiations into labels"""
+
+    def __init__(
+        self,
+        client: CargaMaquinaClient,
+        label_format: str = "pdf",
+        render_workers: int = 1,
+        workers: int = 4,
+        output_root: pathlib.Path = SERVICE_FOLDER,
+        max_jobs: int = 500,
+        store: JobStore | None = None,
+    ):
+        self.client = client
+        self.store = store
+        self.label_format = label_format
+        self.render_workers = render_workers
+        self.output_root = output_root
+        self.max_jobs = max_jobs
+        self.started_at = time.time()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="service"
+        )
+        self._jobs: OrderedDict[int, ServiceJob] = OrderedDict()
+        self._active: dict[str, ServiceJob] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._keeper: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Load the fonts and the pending materials before the first request"""
+        register_fonts()
+        self.client.refresh_pending_cache()
+        self._keeper = threading.Thread(target=self._keep_warm, daemon=True)
+        self._keeper.start()
+
+    def _keep_warm(self) -> None:
+        """Download the pending materials export again before it expires"""
+        # Refreshed at 80% of the TTL, so a request never finds it expired
+        interval = max(self.client.pending_cache_ttl * 0.8, 1)
+        while not self._stop.is_set():
+            age = self.client.pending_cache_age
+            wait = interval if age is None else max(interval - age, 0)
+            if self._stop.wait(wait):
+                return
+            age = self.client.pending_cache_age
+            if age is None or age >= interval:
+                self.client.refresh_pending_cache()
+
+    def submit(
+        self, negociation_id: str, print_labels: bool = False, rescrape: bool = False
+    ) -> ServiceJob:
+        """Queue a negotiation, or return its job when it is already being processed"""
+        with self._lock:
+            # Two jobs of the same negotiation would write the same folder
+            active = self._active.get(negociation_id)
+            if active is not None and not active.finished:
+                return active
+            job = ServiceJob(next(self._ids), negociation_id, print_labels, rescrape)
+            self._active[negociation_id] = job
+            self._jobs[job.job_id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job)
+        return job
+
+    def _forget_old_jobs(self) -> None:
+        """Drop the oldest finished jobs and their documents over max_jobs"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                return
+            job = self._jobs[job_id]
+            if job.finished:
+                del self._jobs[job_id]
+                if self._active.get(job.negociation_id) is job:
+                    del self._active[job.negociation_id]
+
+    def _run(self, job: ServiceJob) -> None:
+        job.started_at = time.perf_counter()
+        job.status = "running"
+        try:
+            with metrics.span("service.job"):
+                result = process_negociation(
+                    self.client,
+                    job.negociation_id,
+                    self.output_root,
+                    self.label_format,
+                    self.render_workers,
+                    self.store,
+                    job.rescrape,
+                )
+            if not result.ok:
+                job.finish("failed", result.error)
+                return
+            job.documents = result.documents
+            job.cached = result.cached
+            job.stale = result.stale
+            if job.print_labels:
+                # Done only once the printer finished, ?wait=1 answers after it
+                print_jobs = get_print_queue().submit_documents(result.documents)
+                if not wait_jobs(print_jobs):
+                    errors = "; ".join(
+                        f"{print_job.name}: {print_job.error}"
+                        for print_job in print_jobs
+                        if not print_job.ok
+                    )
+                    job.finish("failed", f"Erro ao imprimir {errors}")
+                    return
+            job.finish("done")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # A job left running would block its waiters and its negotiation
+            print(f"Error: {e}")
+            job.finish("failed", str(e))
+        finally:
+            metrics.flush()
+
+    def get(self, job_id: int) -> ServiceJob | None:
+        """Job by its ID, None when unknown or already forgotten"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def health(self) -> dict:
+        """State of the warm client, answered by GET /health"""
+        with self._lock:
+            jobs: List[ServiceJob] = list(self._jobs.values())
+        age = self.client.pending_cache_age
+        mirror = self.client.pending_mirror
+        return {
+            "status": "ok",
+            "backend": self.client.backend,
+            "label_format": self.label_format,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "pending_cache": {
+                "age_seconds": None if age is None else round(age, 1),
+                "hits": self.client.pending_cache_hits,
+                "misses": self.client.pending_cache_misses,
+            },
+            "pending_strategies": self.client.query_planner.report(),
+            "pending_mirror_sync": (
+                dataclasses.asdict(mirror.last_sync)
+                if mirror is not None and mirror.last_sync is not None
+                else None
+            ),
+            "jobs": {
+                status: sum(1 for job in jobs if job.status == status)
+                for status in ("queued", "running", "done", "failed")
+            },
+        }
+
+    def close(self) -> None:
+        """Stop the cache refresh and finish the running jobs"""
+        self._stop.set()
+        self._executor.shutdown(wait=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Handler of the service API, each request timed from parse to answer"""
+
+    service: LabelService
+    protocol_version = "HTTP/1.1"
+
+    def _start(self) -> None:
+        self._request_start = time.perf_counter()
+        self._route = "unknown"
+        self._close = False
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        elapsed = time.perf_counter() - self._request_start
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Server-Timing", f"total;dur={elapsed * 1000:.1f}")
+        if self._close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+        metrics.observe(
+            "service.request", elapsed, route=self._route, status=str(status)
+        )
+        print(
+            f"{self.command} {self.path} {status} {elapsed * 1000:.1f} ms",
+            flush=True,
+        )
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self._send(status, body, "application/json; charset=utf-8")
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json(status, {"error": message})
+
+    def _read_body(self) -> bytes | None:
+        """Body of the request, None once answered with 400 or 413"""
+        try:
+            length = int(self.headers.get("Content-Length", 0) or 0)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # Without its length the body can't be skipped, nor the connection reused
+            self._close = True
+            self._send_error(400, "Content-Length inválido")
+            return None
+        if length > MAX_BODY:
+            self._close = True
+            self._send_error(413, "Corpo da requisição muito grande")
+            return None
+        return self.rfile.read(length)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Requests are logged with their latency by _send"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the job status, the label documents, health and metrics"""
+        self._start()
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts == ["health"]:
+            self._route = "health"
+            self._send_json(200, self.service.health())
+        elif parts == ["metrics"]:
+            self._route = "metrics"
+            if not metrics.enabled:
+                self._send_error(404, "Métricas desativadas, use --metrics")
+                return
+            self._send(
+                200,
+                metrics.prometheus_text().encode("utf-8"),
+                "text/plain; version=0.0.4; charset=utf-8",
+            )
+        elif len(parts) in (2, 3) and parts[0] == "jobs":
+            self._route = "job" if len(parts) == 2 else "document"
+            job = self.service.get(int(parts[1])) if parts[1].isdigit() else None
+            if job is None:
+                self._send_error(404, "Job não encontrado")
+            elif len(parts) == 2:
+                self._send_json(200, job.to_dict())
+            elif parts[2] not in job.documents:
+                self._send_error(404, "Documento não encontrado")
+            else:
+                content_type = CONTENT_TYPES.get(
+                    pathlib.Path(parts[2]).suffix, "application/octet-stream"
+                )
+                self._send(200, job.documents[parts[2]], content_type)
+        else:
+            self._send_error(404, "Rota não encontrada")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Submit a negotiation, from a JSON body or the query string"""
+        self._start()
+        url = urlparse(self.path)
+        # Read before any answer, a body left unread would start the next request
+        raw_body = self._read_body()
+        if raw_body is None:
+            return
+        if url.path.rstrip("/") != "/jobs":
+            self._send_error(404, "Rota não encontrada")
+            return
+        self._route = "submit"
+        query = parse_qs(url.query)
+        try:
+            body = json.loads(raw_body or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("o corpo deve ser um objeto JSON")
+        except ValueError as e:
+            self._send_error(400, f"JSON inválido: {e}")
+            return
+
+        negociation_id = str(
+            body.get("negociation_id") or query.get("negociation_id", [""])[0]
+        ).strip()
+        if not negociation_id:
+            self._send_error(400, "Informe o negociation_id")
+            return
+        print_labels = bool(body.get("print", query.get("print", [""])[0] == "1"))
+        wait = bool(body.get("wait", query.get("wait", [""])[0] == "1"))
+        rescrape = bool(body.get("rescrape", query.get("rescrape", [""])[0] == "1"))
+
+        job = self.service.submit(negociation_id, print_labels, rescrape)
+        if not wait:
+            self._send_json(202, job.to_dict())
+            return
+        job.wait()
+        self._send_json(200 if job.status == "done" else 502, job.to_dict())
+
+
+def serve(
+    service: LabelService, host: str = "127.0.0.1", port: int = 8765
+) -> ThreadingHTTPServer:
+    """Create the HTTP server of the service, port 0 picks a free port"""
+    handler = type("ConfiguredServiceHandler", (ServiceHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def run_service(
+    client: CargaMaquinaClient,
+    address: str,
+    label_format: str = "pdf",
+    render_workers: int = 1,
+    workers: int = 4,
+    store: JobStore | None = None,
+) -> None:
+    """Serve the API on host:port until interrupted"""
+    host, _, port = address.rpartition(":")
+    service = LabelService(
+        client, label_format, render_workers, workers, store=store
+    )
+    service.start()
+    server = serve(service, host or "127.0.0.1", int(port))
+    print(f"Serviço em http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,82 @@
+"""Module to keep the CargaMaquina session cookies between runs"""
+
+import json
+import pathlib
+
+import requests
+
+LOGIN_URL_MARK: str = "site/login"
+PROBE_PATH: str = "/"
+
+
+class SessionExpired(Exception):
+    """Raised when CargaMaquina redirects a request to the login page"""
+
+
+def is_login_url(url: str) -> bool:
+    """Whether the URL is the login page, where expired sessions are sent"""
+    return LOGIN_URL_MARK in url
+
+
+def check_response(response: requests.Response) -> None:
+    """Raise SessionExpired when the request was bounced to the login page"""
+    if is_login_url(response.url):
+        raise SessionExpired(f"Sessão expirada ao acessar {response.request.url}")
+
+
+class SessionStore:
+    """Cookies of the last login saved in tmp, validated before they are reused"""
+
+    def __init__(self, folder: str | pathlib.Path = "./tmp"):
+        self.folder = pathlib.Path(folder)
+        self.selenium_path = self.folder / "cookies.json"
+        self.requests_path = self.folder / "requests_cookies.json"
+
+    def save(self, selenium_cookies: list[dict], requests_cookies: dict) -> None:
+        """Save the browser and the requests cookies"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with open(self.selenium_path, "w", encoding="utf-8") as f:
+            json.dump(selenium_cookies, f, ensure_ascii=False, indent=4)
+        with open(self.requests_path, "w", encoding="utf-8") as f:
+            json.dump(requests_cookies, f, ensure_ascii=False, indent=4)
+
+    def load(self) -> tuple[list[dict], dict] | None:
+        """Load the saved cookies, None when there are none or they are unreadable"""
+        if not self.requests_path.exists():
+            return None
+        try:
+            with open(self.requests_path, "r", encoding="utf-8") as file:
+                requests_cookies: dict = json.load(file)
+            selenium_cookies: list[dict] = []
+            if self.selenium_path.exists():
+                with open(self.selenium_path, "r", encoding="utf-8") as file:
+                    selenium_cookies = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not requests_cookies:
+            return None
+        if not selenium_cookies:
+            # Saved by the http backend, the browser only needs name and value
+            selenium_cookies = [
+                {"name": name, "value": value}
+                for name, value in requests_cookies.items()
+            ]
+        return selenium_cookies, requests_cookies
+
+    def clear(self) -> None:
+        """Forget the saved session"""
+        for file_path in (self.selenium_path, self.requests_path):
+            file_path.unlink(missing_ok=True)
+
+    def probe(
+        self, session: requests.Session, base_url: str, timeout: float = 10
+    ) -> bool:
+        """Cheap request to check the session cookies are still logged in"""
+        try:
+            # Only the URL after the redirects matters, the body is not read
+            with session.get(
+                f"{base_url}{PROBE_PATH}", timeout=timeout, stream=True
+            ) as response:
+                return response.ok and not is_login_url(response.url)
+        except requests.RequestException:
+            return False
@@ -0,0 +1,104 @@
+"""Module to measure, fit and wrap label text with cached glyph widths"""
+
+import math
+from functools import lru_cache
+
+from reportlab.pdfbase import pdfmetrics
+
+WRAP_FONT_SIZE = 8
+
+_glyph_widths: dict[str, dict[str, float]] = {}
+
+
+def glyph_width(char: str, font_name: str) -> float:
+    """Get the advance width of a glyph in font units (1/1000 of the font size)"""
+    widths = _glyph_widths.setdefault(font_name, {})
+    width = widths.get(char)
+    if width is None:
+        width = pdfmetrics.getFont(font_name).stringWidth(char, 1000)
+        widths[char] = width
+    return width
+
+
+def text_units(text: str, font_name: str) -> float:
+    """Sum of the glyph widths of a text in font units"""
+    widths = _glyph_widths.get(font_name)
+    if widths is None:
+        return sum(glyph_width(char, font_name) for char in text)
+    total = 0.0
+    for char in text:
+        width = widths.get(char)
+        if width is None:
+            width = glyph_width(char, font_name)
+        total += width
+    return total
+
+
+def string_width(text: str, font_name: str, font_size: float) -> float:
+    """Width of a text in points, same result as pdf.stringWidth"""
+    return 0.001 * font_size * text_units(text, font_name)
+
+
+def fit_font_size(
+    text: str, font_name: str, font_size: float, max_width: float
+) -> float:
+    """Find the biggest size (font_size - n) where the text fits in max_width"""
+    units = text_units(text, font_name)
+
+    def fits(step: int) -> bool:
+        return 0.001 * (font_size - step) * units <= max_width
+
+    # Sizes are tried in 1pt steps down to the lower limit of 1pt
+    last_step = max(math.ceil(font_size - 1), 0)
+    low, high = 0, last_step
+    while low < high:
+        middle = (low + high) // 2
+        if fits(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return font_size - low
+
+
+def wrap_lines(
+    text: str, font_name: str, font_size: float, max_width: float
+) -> tuple[str, ...]:
+    """Break a text in lines that fit in max_width, measuring each word once"""
+    max_units = max_width / (0.001 * font_size)
+    space_units = glyph_width(" ", font_name)
+    lines: list[str] = []
+    current_line = ""
+    current_units = 0.0
+    # A line started by a word with tabs or newlines around it is stripped when
+    # the next word joins it, so only lines without them take the fast path
+    current_stripped = True
+    for word in text.split(" "):
+        word_units = text_units(word, font_name)
+        word_stripped = word == word.strip()
+        if current_line and current_stripped and word and word_stripped:
+            test_line = f"{current_line} {word}"
+            test_units = current_units + space_units + word_units
+        else:
+            test_line = f"{current_line} {word}".strip()
+            test_units = text_units(test_line, font_name)
+        if test_units <= max_units:
+            current_line = test_line
+            current_units = test_units
+            current_stripped = True
+        else:
+            lines.append(current_line)
+            current_line = word
+            current_units = word_units
+            current_stripped = word_stripped
+    lines.append(current_line)
+    return tuple(lines)
+
+
+@lru_cache(maxsize=4096)
+def layout_text(
+    text: str, font_name: str, font_size: float, max_width: float, wrap: bool = False
+) -> tuple[float, tuple[str, ...]]:
+    """Get the font size and the lines used to draw a text, memoized per batch"""
+    if wrap:
+        return WRAP_FONT_SIZE, wrap_lines(text, font_name, WRAP_FONT_SIZE, max_width)
+    return fit_font_size(text, font_name, font_size, max_width), (text,)
@@ -0,0 +1,323 @@
+"""Module to generate the labels in printer languages (ZPL and EPL) for thermal printers
+
+The layouts are the same as the PDFs of core.generate_labels, but the
+printer draws the text, boxes and QR codes itself, so nothing is
+rasterized on the computer.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, List
+
+from reportlab.lib.pagesizes import mm
+
+from core.generate_labels import HEIGHT, MARGIN, WIDTH, register_fonts
+from core.metrics import metrics
+from core.models import Material, NFeData, OrderData
+from core.text_layout import layout_text, string_width
+
+DPI: int = 203
+
+# EPL2 resident fonts: number -> (width, height) of a character in dots
+EPL_FONTS: dict[int, tuple[int, int]] = {
+    1: (8, 12),
+    2: (10, 16),
+    3: (12, 20),
+    4: (14, 24),
+    5: (32, 48),
+}
+
+
+def dots(points: float) -> int:
+    """Convert PDF points to printer dots"""
+    return round(points * DPI / 72)
+
+
+@dataclass
+class Box:
+    """Filled rectangle, top-left origin in dots"""
+
+    x: int
+    y: int
+    width: int
+    height: int
+    white: bool = False
+
+
+@dataclass
+class Text:
+    """Line of text, y is the baseline; centered in [x, x + width] when width is set"""
+
+    x: int
+    y: int
+    height: int
+    text: str
+    width: int = 0
+    reverse: bool = False
+
+
+@dataclass
+class QRCode:
+    """QR code, top-left origin in dots"""
+
+    x: int
+    y: int
+    size: int
+    data: str
+
+
+Element = Box | Text | QRCode
+
+
+def text_elements(
+    y: float,
+    text: str,
+    x: float | None = None,
+    max_width: float = 75 * mm,
+    font_name: str = "Arial-Bold",
+    font_size: float = 22,
+    pending: bool = False,
+    wrap: bool = False,
+    reverse: bool = False,
+) -> List[Text]:
+    """Same text placement as draw_text, converted to printer dots"""
+    font_size, lines = layout_text(text, font_name, font_size, max_width, wrap)
+    elements: List[Text] = []
+    for line in lines:
+        if x is None and not wrap:
+            # The printer centers the field itself
+            width = WIDTH - 10 * mm if pending else WIDTH
+            elements.append(
+                Text(0, dots(HEIGHT - y), dots(font_size), line, dots(width), reverse)
+            )
+        else:
+            if x is None:
+                x = (WIDTH - string_width(line, font_name, font_size)) / 2
+                if pending:
+                    x -= 5 * mm
+            elements.append(
+                Text(dots(x), dots(HEIGHT - y), dots(font_size), line, 0, reverse)
+            )
+        y -= font_size + 5
+    return elements
+
+
+def pending_label_elements(material: Material) -> List[Element]:
+    """Elements of a pending material label"""
+    return [
+        Box(0, 0, dots(WIDTH), dots(HEIGHT)),
+        Box(dots(WIDTH - 10 * mm), dots(MARGIN), dots(10 * mm), dots(HEIGHT - 2 * MARGIN), True),
+        Box(dots(5 * mm), dots(HEIGHT - 15 * mm), dots(WIDTH - 20 * mm), dots(10 * mm), True),
+        *text_elements(
+            HEIGHT - 15 * mm, material.op_number, pending=True, font_size=18, reverse=True
+        ),
+        *text_elements(
+            HEIGHT - 30 * mm,
+            material.product,
+            pending=True,
+            font_name="Arial",
+            font_size=21,
+            reverse=True,
+        ),
+        *text_elements(
+            HEIGHT - 45 * mm,
+            material.code,
+            pending=True,
+            font_name="Arial",
+            font_size=19.5,
+            reverse=True,
+        ),
+        *text_elements(
+            8 * mm,
+            f"QUANTIDADE: {int(material.pending_qty)} UND",
+            pending=True,
+            font_name="Arial",
+            font_size=10,
+        ),
+    ]
+
+
+def stock_label_elements(nfe_data: NFeData, order: OrderData) -> List[Element]:
+    """Elements of a stock label"""
+    # The white border box of the PDF is drawn on a white background, it is left out
+    return [
+        Box(0, dots(30 * mm), dots(WIDTH), dots(10 * mm)),
+        *text_elements(
+            HEIGHT - MARGIN, nfe_data.date, MARGIN, max_width=80 * mm, font_size=10
+        ),
+        QRCode(dots(MARGIN), dots(10 * mm), dots(15 * mm), f"{order.code};{int(order.qty)}"),
+        *text_elements(HEIGHT - 7 * mm, f"NF {nfe_data.nfe_number}", max_width=85 * mm, font_size=13),
+        *text_elements(
+            HEIGHT - 6 * mm,
+            order.address,
+            x=65 * mm,
+            max_width=15 * mm,
+            font_name="Arial",
+            font_size=5,
+            wrap=True,
+        ),
+        *text_elements(HEIGHT - 15 * mm, str(order.order), max_width=85 * mm, font_size=11),
+        *text_elements(
+            HEIGHT - 25 * mm, nfe_data.supplier_name, max_width=85 * mm, font_size=22
+        ),
+        *text_elements(
+            HEIGHT - 37 * mm,
+            order.code,
+            max_width=85 * mm,
+            font_name="Arial",
+            font_size=16,
+            reverse=True,
+        ),
+        *text_elements(
+            HEIGHT - 45 * mm,
+            order.description,
+            max_width=82 * mm,
+            font_name="Arial",
+            font_size=8,
+            wrap=True,
+        ),
+        *text_elements(
+            10 * mm,
+            f"Quantidade: {int(order.qty)} {order.unit_type}",
+            max_width=85 * mm,
+            font_name="Arial",
+            font_size=10,
+        ),
+        *text_elements(
+            MARGIN,
+            f"Lote Total: {int(order.qty_total)} {order.unit_type}",
+            max_width=85 * mm,
+            font_name="Arial",
+            font_size=10.5,
+        ),
+    ]
+
+
+def qr_magnification(size: int, data: str) -> int:
+    """Module size that makes the QR code close to the size of the PDF one"""
+    # Version 2 (25 modules) holds up to 20 bytes with error correction H
+    modules = 25 if len(data) <= 20 else 29 if len(data) <= 32 else 33
+    return max(1, min(10, round(size / (modules + 2))))
+
+
+def zpl_escape(text: str) -> str:
+    """Escape the ZPL control characters, used with ^FH"""
+    return text.replace("_", "_5F").replace("^", "_5E").replace("~", "_7E")
+
+
+def to_zpl(elements: List[Element], copies: int = 1) -> str:
+    """ZPL II of one label"""
+    commands: List[str] = ["^XA", "^CI28", f"^PW{dots(WIDTH)}", f"^LL{dots(HEIGHT)}"]
+    for element in elements:
+        if isinstance(element, Box):
+            thickness = min(element.width, element.height)
+            color = "W" if element.white else "B"
+            commands.append(
+                f"^FO{element.x},{element.y}"
+                f"^GB{element.width},{element.height},{thickness},{color}^FS"
+            )
+        elif isinstance(element, QRCode):
+            magnification = qr_magnification(element.size, element.data)
+            commands.append(
+                f"^FO{element.x},{element.y}^BQN,2,{magnification}"
+                f"^FH^FDHA,{zpl_escape(element.data)}^FS"
+            )
+        else:
+            field_block = f"^FB{element.width},1,0,C" if element.width else ""
+            reverse = "^FR" if element.reverse else ""
+            commands.append(
+                f"^FT{element.x},{element.y}^A0N,{element.height},{element.height}"
+                f"{field_block}{reverse}^FH^FD{zpl_escape(element.text)}^FS"
+            )
+    commands.append(f"^PQ{copies}")
+    commands.append("^XZ")
+    return "\n".join(commands) + "\n"
+
+
+def epl_font(text: Text) -> tuple[int, int, int]:
+    """Biggest resident font and multiplier not taller than the text and that fits"""
+    max_width = text.width or dots(WIDTH) - text.x
+    best = (1, 1, 1)
+    best_height = 0
+    for font, (char_width, char_height) in EPL_FONTS.items():
+        for multiplier in range(1, 5):
+            height = char_height * multiplier
+            fits = len(text.text) * char_width * multiplier <= max_width
+            if not fits or height > max(text.height, EPL_FONTS[1][1]):
+                continue
+            # Prefer the bigger font to the bigger multiplier, it is less blocky
+            if height > best_height or (height == best_height and multiplier < best[1]):
+                best, best_height = (font, multiplier, multiplier), height
+    return best
+
+
+def epl_escape(text: str) -> str:
+    """Escape the quotes and backslashes of an EPL string"""
+    return text.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_epl(elements: List[Element], copies: int = 1) -> str:
+    """EPL2 of one label"""
+    commands: List[str] = ["", "N", "I8,A,001", f"q{dots(WIDTH)}", f"Q{dots(HEIGHT)},24"]
+    for element in elements:
+        if isinstance(element, Box):
+            command = "LW" if element.white else "LO"
+            commands.append(
+                f"{command}{element.x},{element.y},{element.width},{element.height}"
+            )
+        elif isinstance(element, QRCode):
+            magnification = qr_magnification(element.size, element.data)
+            commands.append(
+                f'b{element.x},{element.y},Q,m2,s{magnification},eH,"{epl_escape(element.data)}"'
+            )
+        else:
+            font, h_multiplier, v_multiplier = epl_font(element)
+            char_width, char_height = EPL_FONTS[font]
+            x = element.x
+            if element.width:
+                text_width = len(element.text) * char_width * h_multiplier
+                x += max((element.width - text_width) // 2, 0)
+            y = max(element.y - char_height * v_multiplier, 0)
+            reverse = "R" if element.reverse else "N"
+            commands.append(
+                f'A{x},{y},0,{font},{h_multiplier},{v_multiplier},{reverse},'
+                f'"{epl_escape(element.text)}"'
+            )
+    commands.append(f"P1,{copies}")
+    return "\n".join(commands) + "\n"
+
+
+LANGUAGES: dict[str, tuple[Callable[..., str], str]] = {
+    "zpl": (to_zpl, "utf-8"),
+    "epl": (to_epl, "cp850"),
+}
+
+
+@metrics.timed("labels.printer")
+def generate_printer_labels(nfe_data: NFeData, language: str = "zpl") -> dict[str, bytes]:
+    """Generate the pending and stock labels of an NFe in a printer language"""
+    if language not in LANGUAGES:
+        raise ValueError(f"Language must be one of {tuple(LANGUAGES)}, got {language}")
+    to_language, encoding = LANGUAGES[language]
+    register_fonts()
+
+    documents: dict[str, bytes] = {}
+    pending_labels = [
+        to_language(pending_label_elements(material))
+        for material in nfe_data.pending_materials
+        if material.pending_qty != 0
+    ]
+    if pending_labels:
+        documents[f"pending_labels.{language}"] = "".join(pending_labels).encode(
+            encoding, errors="replace"
+        )
+    # The printer prints the second copy of each stock label by itself
+    stock_labels = [
+        to_language(stock_label_elements(nfe_data, order), copies=2)
+        for order in nfe_data.orders
+        if order.qty != 0
+    ]
+    if stock_labels:
+        documents[f"stock_labels.{language}"] = "".join(stock_labels).encode(
+            encoding, errors="replace"
+        )
+    return documents
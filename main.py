@@ -1,31 +1,310 @@
-"""Main module"""
-
-import os
-from getpass import getpass
-from core.generate_labels import generate_nfe_labels
-from core.print_labels import print_labels
-from core.scraping import CargaMaquinaClient
-
-
-def main() -> None:
-    """Main function"""
-
-    if not os.path.exists("./tmp"):
-        os.mkdir("./tmp")
-    print("Gerador de Etiquetas de Recebimento")
-    print("Feito por: Rafael Costa")
-    print("https://github.com/Rafaeros")
-    username: str = input("Usuário: ")
-    password: str = getpass(prompt="Senha: ")
-    client = CargaMaquinaClient(username=username, password=password)
-    while True:
-        negociation_id: str = input("ID da Negociação: ")
-        if negociation_id == "q":
-            client.close()
-            break
-        client.nfe_data_scraping(negociation_id)
-        generate_nfe_labels()
-        print_labels(["./tmp/pending_labels.pdf", "./tmp/stock_labels.pdf"])
-
-if __name__ == "__main__":
-    main()
+"""Main module
+
+Only light modules are imported before the credentials prompt. Selenium,
+requests and reportlab are imported by a warm-up thread while the user
+types, see warm_up.
+"""
+
+import argparse
+import os
+import threading
+import time
+from getpass import getpass
+from typing import TYPE_CHECKING
+from core.metrics import SINKS, metrics
+from core.options import BACKENDS, LABEL_FORMATS, PENDING_SOURCES, PRINT_BACKENDS
+from core.print_labels import (
+    configure_printer,
+    get_print_queue,
+    print_documents,
+    wait_jobs,
+)
+
+if TYPE_CHECKING:
+    from core.scraping import CargaMaquinaClient
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(description="Gerador de Etiquetas de Recebimento")
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="selenium",
+        help="selenium abre o Chrome, http usa apenas requisições HTTP",
+    )
+    parser.add_argument(
+        "--pending-source",
+        choices=PENDING_SOURCES,
+        default="export",
+        help=(
+            "export baixa o relatório inteiro, mirror consulta a cópia local em "
+            "SQLite, codes consulta cada código da NFe, auto escolhe entre codes "
+            "e export pela latência"
+        ),
+    )
+    parser.add_argument(
+        "--pending-first-year",
+        type=int,
+        help="primeiro ano copiado pelo mirror (padrão: o ano anterior)",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="IDS",
+        help="IDs de negociação separados por vírgula ou arquivos com um ID por linha",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        const="127.0.0.1:8765",
+        metavar="HOST:PORTA",
+        help="roda como serviço HTTP local (padrão: 127.0.0.1:8765)",
+    )
+    parser.add_argument(
+        "--reprint",
+        metavar="ID_OU_NF",
+        help="reimprime as etiquetas salvas de uma negociação ou número de NF",
+    )
+    parser.add_argument(
+        "--order",
+        metavar="CODIGO_OU_PEDIDO",
+        help="com --reprint, reimprime só as etiquetas deste código ou pedido",
+    )
+    parser.add_argument(
+        "--rescrape",
+        action="store_true",
+        help="consulta o CargaMaquina mesmo para negociações já salvas",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="negociações processadas em paralelo"
+    )
+    parser.add_argument(
+        "--no-print", action="store_true", help="apenas gera os PDFs do lote"
+    )
+    parser.add_argument(
+        "--printer-backend",
+        choices=PRINT_BACKENDS,
+        help="windows, cups, raw (porta 9100) ou directory (salva em pasta)",
+    )
+    parser.add_argument(
+        "--printer", help="nome da impressora, host[:porta] ou pasta de saída"
+    )
+    parser.add_argument(
+        "--label-format",
+        choices=LABEL_FORMATS,
+        default="pdf",
+        help="pdf, ou zpl/epl para impressoras térmicas (use com --printer-backend raw)",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help=(
+            "processos usados para gerar os PDFs de NFes grandes, "
+            "compartilhados por todas as negociações em paralelo"
+        ),
+    )
+    parser.add_argument(
+        "--lean-browser",
+        action="store_true",
+        help="Chrome sem janela e sem imagens, fontes e CSS (experimental)",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="SINKS",
+        help="jsonl, prometheus ou jsonl,prometheus (padrão: variável METRICS)",
+    )
+    parser.add_argument(
+        "--debug-dir",
+        help="pasta onde salvar o nfe_data.json e os PDFs de cada recebimento",
+    )
+    args = parser.parse_args()
+    if args.metrics is None:
+        args.metrics = os.environ.get("METRICS")
+    unknown = [
+        sink.strip()
+        for sink in (args.metrics or "").split(",")
+        if sink.strip() and sink.strip() not in SINKS
+    ]
+    if unknown:
+        parser.error(
+            f"métricas inválidas em --metrics ou METRICS: {', '.join(unknown)} "
+            f"(use {', '.join(SINKS)})"
+        )
+    return args
+
+
+def warm_up(label_format: str) -> None:
+    """Import the heavy modules and load the label assets in the background"""
+    # pylint: disable=import-outside-toplevel,unused-import
+    import core.scraping  # noqa: F401
+    from core.generate_labels import register_fonts
+
+    register_fonts()
+    if label_format == "pdf":
+        from core.qr_cache import qr_cache
+
+        qr_cache.warm_up()
+
+
+def reprint(args: argparse.Namespace) -> None:
+    """Print the saved labels of a negotiation or NFe number without logging in"""
+    # pylint: disable=import-outside-toplevel
+    from core.job_store import get_job_store, stored_documents
+
+    store = get_job_store()
+    negociation_id = store.find(args.reprint)
+    if negociation_id is None:
+        print(f"Nenhuma negociação ou NF {args.reprint} salva")
+        return
+    try:
+        with metrics.span("reprint"):
+            documents = stored_documents(
+                store, negociation_id, args.label_format, args.order or ""
+            )
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    print_documents(documents)
+
+
+def batch(client: "CargaMaquinaClient", args: argparse.Namespace) -> None:
+    """Process a list of negotiations and print their labels"""
+    # pylint: disable=import-outside-toplevel
+    from core.batch import print_summary, read_negociation_ids, run_batch
+    from core.job_store import get_job_store
+
+    negociation_ids = read_negociation_ids(args.batch)
+    start = time.perf_counter()
+    results = run_batch(
+        client,
+        negociation_ids,
+        workers=args.workers,
+        label_format=args.label_format,
+        render_workers=args.render_workers,
+        store=get_job_store(),
+        rescrape=args.rescrape,
+    )
+    print_summary(results, time.perf_counter() - start)
+    if args.no_print:
+        return
+    print_queue = get_print_queue()
+    jobs = [
+        job
+        for result in results
+        if result.ok
+        for job in print_queue.submit_documents(result.documents)
+    ]
+    wait_jobs(jobs)
+
+
+def receive(client: "CargaMaquinaClient", args: argparse.Namespace) -> None:
+    """Ask for negotiations one at a time and print their labels, until q"""
+    # pylint: disable=import-outside-toplevel
+    import requests
+
+    from core.generate_labels import generate_nfe_labels
+    from core.job_store import get_job_store, stored_documents
+    from core.session_store import SessionExpired
+
+    while True:
+        negociation_id: str = input("ID da Negociação: ")
+        if negociation_id == "q":
+            return
+        store = get_job_store()
+        if not args.rescrape and negociation_id in store:
+            answer = input(
+                "Negociação já processada. Enter reimprime as etiquetas salvas, "
+                "um código ou pedido reimprime só ele, n consulta de novo: "
+            ).strip()
+            if answer.lower() != "n":
+                try:
+                    documents = stored_documents(
+                        store, negociation_id, args.label_format, answer
+                    )
+                except ValueError as e:
+                    print(f"Error: {e}")
+                    continue
+                print_documents(documents)
+                continue
+        try:
+            with metrics.span("receipt"):
+                scraped = client.scrape_nfe(negociation_id, args.debug_dir)
+                if scraped is not None:
+                    parsed, nfe_data = scraped
+                    documents = generate_nfe_labels(
+                        nfe_data, args.debug_dir, args.label_format, args.render_workers
+                    )
+                    store.save(
+                        negociation_id, nfe_data, documents, args.label_format, parsed
+                    )
+                    print_documents(documents)
+        except (ValueError, SessionExpired, requests.RequestException) as e:
+            # A failed export or page ends only this negotiation, not the session
+            print(f"Error: {e}")
+        metrics.flush()
+
+
+def main() -> None:
+    """Main function"""
+
+    args = parse_args()
+    configure_printer(args.printer_backend, args.printer)
+    metrics.configure(args.metrics)
+
+    if args.reprint:
+        reprint(args)
+        metrics.close()
+        return
+
+    threading.Thread(target=warm_up, args=(args.label_format,), daemon=True).start()
+
+    if not os.path.exists("./tmp"):
+        os.mkdir("./tmp")
+    print("Gerador de Etiquetas de Recebimento")
+    print("Feito por: Rafael Costa")
+    print("https://github.com/Rafaeros")
+    username: str = input("Usuário: ")
+    password: str = getpass(prompt="Senha: ")
+
+    # pylint: disable=import-outside-toplevel
+    from core.generate_labels import shutdown_render_pool
+    from core.job_store import get_job_store
+    from core.scraping import CargaMaquinaClient
+
+    # Batch and service mode scrape several negotiations at the same time
+    drivers = args.workers if args.batch or args.serve else 1
+    client = CargaMaquinaClient(
+        username=username,
+        password=password,
+        backend=args.backend,
+        drivers=drivers,
+        pending_source=args.pending_source,
+        pending_first_year=args.pending_first_year,
+        lean_browser=args.lean_browser,
+    )
+    try:
+        if args.batch:
+            batch(client, args)
+        elif args.serve:
+            from core.service import run_service
+
+            run_service(
+                client,
+                args.serve,
+                args.label_format,
+                args.render_workers,
+                args.workers,
+                get_job_store(),
+            )
+        else:
+            receive(client, args)
+    finally:
+        client.close()
+        shutdown_render_pool()
+        metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Legacy reconciliation loop and synthetic NFes shared by the tests and the benchmark"""
+
+import random
+from datetime import datetime as dt, timedelta
+
+from core.models import OrderData
+
+
+def legacy_reconcile(orders: list, pending_materials: list) -> tuple[list, list]:
+    """Nested loop reconciliation as done by get_nfe_data before the engine"""
+    pending_materials = sorted(
+        pending_materials, key=lambda x: dt.strptime(x["creation_date"], "%d/%m/%y")
+    )
+    for pending_material in pending_materials:
+        for order in orders:
+            if pending_material["code"] == order.code:
+                if order.qty == 0:
+                    pending_material["pending_qty"] = 0
+                if pending_material["pending_qty"] > order.qty:
+                    while pending_material["pending_qty"] > order.qty:
+                        pending_material["pending_qty"] -= 1
+                    order.qty -= pending_material["pending_qty"]
+                else:
+                    order.qty -= pending_material["pending_qty"]
+    pending_materials = [p for p in pending_materials if p["pending_qty"] > 0]
+    for order in orders:
+        if order.qty == 0:
+            orders.remove(order)
+    return orders, pending_materials
+
+
+def synthetic_nfe(
+    rng: random.Random,
+    lines: int,
+    unique_codes: bool,
+    max_qty: int = 500,
+    fractional: bool = False,
+) -> tuple[list, list]:
+    """Orders and pending materials (as the legacy dicts) of a synthetic NFe
+
+    Quantities are whole units, or have one decimal place when fractional,
+    as the KG and MT materials.
+    """
+    scale = 10 if fractional else 1
+    codes = [f"MP{index:05d}" for index in range(lines if unique_codes else lines // 3 + 1)]
+    orders = [
+        OrderData(
+            address="A1",
+            order=index,
+            code=codes[index] if unique_codes else rng.choice(codes),
+            description="",
+            qty=qty / scale,
+            qty_total=qty / scale,
+            unit_type="UN",
+        )
+        for index, qty in enumerate(
+            rng.randint(0, max_qty * scale) for _ in range(lines)
+        )
+    ]
+    start = dt(2026, 1, 1)
+    pending_materials = [
+        {
+            "creation_date": (start + timedelta(days=rng.randint(0, 280))).strftime(
+                "%d/%m/%y"
+            ),
+            "code": rng.choice(codes),
+            "op_number": f"OP {index}",
+            "product": "PRODUTO",
+            "pending_qty": rng.randint(1, max_qty * scale) / scale,
+        }
+        for index in range(lines * 2)
+    ]
+    return orders, pending_materials
@@ -0,0 +1,32 @@
+"""Size bound of the driver pool"""
+
+from core.driver_pool import DriverPool
+
+
+class StubDriver:
+    """Browser that always answers"""
+
+    current_url = "about:blank"
+
+    def quit(self) -> None:
+        pass
+
+
+def test_warm_up_opens_the_missing_drivers():
+    pool = DriverPool(3, factory=StubDriver)
+    pool.warm_up(2)
+    pool.warm_up()
+    assert pool.created == 3
+    pool.close()
+
+
+def test_warm_up_does_not_grow_a_busy_pool():
+    """With every slot checked out, warming up opens nothing"""
+    pool = DriverPool(2, factory=StubDriver)
+    with pool.checkout(1), pool.checkout(1):
+        pool.warm_up()
+    assert pool.created == 2
+    with pool.checkout(1):
+        pool.warm_up()
+    assert pool.created == 2
+    pool.close()
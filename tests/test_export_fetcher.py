@@ -0,0 +1,128 @@
+"""Chunked and paginated download of the pending materials export"""
+
+from datetime import date
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from benchmarks.fixtures import pending_materials_rows, render_pending_materials
+from benchmarks.standin_server import (
+    SESSION_COOKIE,
+    SESSION_ID,
+    StandinConfig,
+    start_server,
+)
+from core.export_fetcher import PendingMaterialsFetcher, range_chunks
+from core.scraping import PENDING_MATERIALS_PATH, create_session
+
+COOKIES = {SESSION_COOKIE: SESSION_ID}
+
+
+class StubAdapter(BaseAdapter):
+    """Answers every request with the next status of the list and the same page"""
+
+    def __init__(self, statuses: list[int], html: str):
+        super().__init__()
+        self.statuses = statuses
+        self.html = html
+        self.requests = 0
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        status = self.statuses[min(self.requests, len(self.statuses) - 1)]
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = status
+        response._content = self.html.encode("utf-8")  # pylint: disable=protected-access
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def stub_fetcher(
+    statuses: list[int], html: str
+) -> tuple[PendingMaterialsFetcher, StubAdapter]:
+    """Fetcher whose session only talks to a StubAdapter, without waiting to retry"""
+    session = requests.Session()
+    adapter = StubAdapter(statuses, html)
+    session.mount("http://", adapter)
+    fetcher = PendingMaterialsFetcher(
+        session, "http://stub/export", workers=1, retry_backoff=0
+    )
+    return fetcher, adapter
+
+
+@pytest.fixture(scope="module")
+def standin_url():
+    """URL of the export served by a stand-in with a few hundred rows"""
+    server = start_server(config=StandinConfig(pending_rows=300, codes=40))
+    yield f"http://127.0.0.1:{server.server_address[1]}{PENDING_MATERIALS_PATH}"
+    server.shutdown()
+
+
+def test_range_chunks_across_the_year():
+    assert range_chunks(date(2025, 11, 15), date(2026, 2, 10)) == [
+        (date(2025, 11, 15), date(2025, 11, 30)),
+        (date(2025, 12, 1), date(2025, 12, 31)),
+        (date(2026, 1, 1), date(2026, 1, 31)),
+        (date(2026, 2, 1), date(2026, 2, 10)),
+    ]
+    assert range_chunks(date(2025, 11, 1), date(2026, 3, 31), 3) == [
+        (date(2025, 11, 1), date(2026, 1, 31)),
+        (date(2026, 2, 1), date(2026, 3, 31)),
+    ]
+
+
+def test_pages_and_chunks_match_a_single_page(standin_url):
+    """Small pages over monthly chunks return the rows of one big page"""
+    start, end = date(date.today().year - 1, 11, 1), date(date.today().year, 12, 31)
+    single = PendingMaterialsFetcher(
+        create_session(), standin_url, page_size=10_000, months_per_chunk=24
+    )
+    expected = list(single.iter_cells(start, end, COOKIES))
+    assert len(single.last_stats) == 1
+
+    paged = PendingMaterialsFetcher(create_session(), standin_url, page_size=7)
+    rows = list(paged.iter_cells(start, end, COOKIES))
+    assert sorted(rows) == sorted(expected)
+    assert len(rows) == 300
+    assert max(stats.page for stats in paged.last_stats) > 1
+    chunk_starts = {stats.start for stats in paged.last_stats}
+    assert {start, date(start.year + 1, 1, 1)} <= chunk_starts
+
+
+def test_stops_when_the_page_parameter_is_ignored():
+    """A server that repeats the first page is read once"""
+    html = render_pending_materials(pending_materials_rows(5))
+    fetcher, adapter = stub_fetcher([200], html)
+    fetcher.page_size = 5
+    rows = list(fetcher.iter_cells(date(2026, 1, 1), date(2026, 1, 31)))
+    assert len(rows) == 5
+    assert adapter.requests == 2
+
+
+def test_server_errors_are_retried():
+    html = render_pending_materials(pending_materials_rows(3))
+    fetcher, adapter = stub_fetcher([500, 503, 200], html)
+    rows = list(fetcher.iter_cells(date(2026, 1, 1), date(2026, 1, 31)))
+    assert len(rows) == 3
+    assert adapter.requests == 3
+    assert [stats.attempts for stats in fetcher.last_stats] == [3]
+
+
+def test_retries_are_bounded():
+    fetcher, adapter = stub_fetcher([500], render_pending_materials([]))
+    with pytest.raises(requests.HTTPError):
+        list(fetcher.iter_cells(date(2026, 1, 1), date(2026, 1, 31)))
+    assert adapter.requests == fetcher.retries + 1
+
+
+def test_client_errors_are_not_retried():
+    fetcher, adapter = stub_fetcher([404], render_pending_materials([]))
+    with pytest.raises(requests.HTTPError):
+        list(fetcher.iter_cells(date(2026, 1, 1), date(2026, 1, 31)))
+    assert adapter.requests == 1
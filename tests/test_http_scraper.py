@@ -0,0 +1,39 @@
+"""NFe view link of the compra search results"""
+
+import pytest
+from bs4 import BeautifulSoup
+
+from benchmarks.fixtures import compra_list_page
+from core.scraping import nfe_view_url
+
+PAGE_URL = "https://example.com/compra?Compra%5Bnegociacao%5D=1000"
+ROW = '<tr><td><input type="checkbox" id="compraSelecionados_0" value="7"></td>{link}</tr>'
+
+
+def view_url(html: str) -> str | None:
+    """View URL found in a search results page"""
+    soup = BeautifulSoup(html, "html.parser")
+    return nfe_view_url(soup, soup.find(id="compraSelecionados_0"), PAGE_URL)
+
+
+def test_view_link_of_the_results_page():
+    assert view_url(compra_list_page("1000", "7")) == (
+        "https://example.com/compra/visualizar/id/7"
+    )
+
+
+def test_view_link_of_the_compra_row():
+    html = (
+        '<a id="linkVisualizar" href="#">Visualizar</a><table>'
+        + ROW.format(link='<td><a href="/compra/visualizar/id/7?x=1">ver</a></td>')
+        + "</table>"
+    )
+    assert view_url(html) == "https://example.com/compra/visualizar/id/7?x=1"
+
+
+@pytest.mark.parametrize(
+    "link", ['<a id="linkVisualizar" href="javascript:void(0)">Visualizar</a>', ""]
+)
+def test_no_view_link(link):
+    """Opened only by a script, the URL is not guessed"""
+    assert view_url(link + "<table>" + ROW.format(link="") + "</table>") is None
@@ -0,0 +1,149 @@
+"""Saved receipts and their reuse by the batch without scraping"""
+
+import sqlite3
+from datetime import date
+
+import pytest
+
+from core import batch
+from core.job_store import JobStore, stored_documents
+from core.models import Material, NFeData, OrderData
+from core.scraping import CargaMaquinaClient
+
+
+def parsed_nfe(nfe_number: int = 123) -> NFeData:
+    """NFe as parsed, two orders of a code"""
+    return NFeData(
+        date="01/10/2026",
+        nfe_number=nfe_number,
+        supplier_name="Fornecedor",
+        orders=[
+            OrderData("A-1", 10, "4001", "Chapa", 6.0, 6.0, "UN"),
+            OrderData("A-2", 11, "4001", "Chapa", 4.0, 4.0, "UN"),
+        ],
+    )
+
+
+class FakeClient:
+    """Client whose NFe page is parsed_nfe and whose pending materials are a list"""
+
+    reconcile_nfe = CargaMaquinaClient.reconcile_nfe
+
+    def __init__(self, pending_qty: float):
+        self.pending = [
+            Material(date(2026, 9, 1), "4001", "OP-1", "Chapa", pending_qty)
+        ]
+        self.scraped = 0
+
+    def get_requested_materials(self, codes, _pending=None):
+        return [material.copy() for material in self.pending if material.code in codes]
+
+    def scrape_nfe(self, _negociation_id, output_dir=None):
+        self.scraped += 1
+        parsed = parsed_nfe()
+        return parsed, self.reconcile_nfe(parsed, output_dir)
+
+
+@pytest.fixture
+def store(tmp_path):
+    job_store = JobStore(tmp_path / "jobs.sqlite3")
+    yield job_store
+    job_store.close()
+
+
+@pytest.fixture
+def render(monkeypatch):
+    """Labels that tell the stock and pending quantities apart, without reportlab"""
+    rendered: list[NFeData] = []
+
+    def generate_nfe_labels(nfe_data, *_args):
+        rendered.append(nfe_data)
+        return {"labels.pdf": nfe_data.to_compact().encode("utf-8")}
+
+    monkeypatch.setattr(batch, "generate_nfe_labels", generate_nfe_labels)
+    return rendered
+
+
+def test_save_keeps_the_parsed_nfe(store):
+    parsed = parsed_nfe()
+    reconciled = NFeData(parsed.date, 123, "Fornecedor", parsed.orders[1:])
+    store.save("9", reconciled, {"labels.pdf": b"%PDF"}, parsed=parsed)
+    # A reprint saves the documents again without the parsed NFe
+    store.save("9", reconciled, {"labels.zpl": b"^XA"}, "zpl")
+    assert store.get_parsed_nfe("9") == parsed
+    assert store.get_nfe_data("9") == reconciled
+    assert store.get_documents("9") == {"labels.pdf": b"%PDF"}
+    assert store.find("123") == "9"
+
+
+def test_store_made_before_the_parsed_nfe(tmp_path):
+    """An old database gets the column, its receipts have no parsed NFe"""
+    path = tmp_path / "jobs.sqlite3"
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE receipts (negociation_id TEXT PRIMARY KEY, "
+            "nfe_number INTEGER NOT NULL, supplier_name TEXT NOT NULL, "
+            "nfe_data TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        connection.execute(
+            "INSERT INTO receipts VALUES ('9', 123, 'Fornecedor', ?, 0, 0)",
+            (parsed_nfe().to_compact(),),
+        )
+    store = JobStore(path)
+    assert "9" in store
+    assert store.get_parsed_nfe("9") is None
+    store.save("9", parsed_nfe(), {}, parsed=parsed_nfe())
+    assert store.get_parsed_nfe("9") == parsed_nfe()
+    store.close()
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3", max_bytes=10)
+    store.save("1", parsed_nfe(1), {"labels.pdf": b"12345"})
+    store.save("2", parsed_nfe(2), {"labels.pdf": b"12345"})
+    store.get_documents("1")
+    store.save("3", parsed_nfe(3), {"labels.pdf": b"12345"})
+    assert ("1" in store, "2" in store, "3" in store) == (True, False, True)
+    assert store.total_bytes() == 10
+    store.close()
+
+
+def test_reprint_of_one_order(store):
+    store.save("9", parsed_nfe(), {"labels.pdf": b"%PDF"})
+    with pytest.raises(ValueError):
+        stored_documents(store, "9", order="999")
+    assert stored_documents(store, "9") == {"labels.pdf": b"%PDF"}
+
+
+def test_batch_reuses_the_labels_of_unchanged_receipts(store, render, tmp_path):
+    client = FakeClient(pending_qty=5)
+    first = batch.process_negociation(client, "9", tmp_path, store=store)
+    again = batch.process_negociation(client, "9", tmp_path, store=store)
+    assert (first.cached, again.cached, again.stale) == (False, True, False)
+    assert again.documents == first.documents
+    assert (client.scraped, len(render)) == (1, 1)
+    # The parsed quantities are saved, not the reconciled ones
+    assert [order.qty for order in store.get_parsed_nfe("9").orders] == [6.0, 4.0]
+
+
+def test_batch_reconciles_again_when_the_pending_materials_change(
+    store, render, tmp_path
+):
+    client = FakeClient(pending_qty=5)
+    first = batch.process_negociation(client, "9", tmp_path, store=store)
+    client.pending[0].pending_qty = 8
+    again = batch.process_negociation(client, "9", tmp_path, store=store)
+    assert (again.ok, again.cached, again.stale) == (True, True, True)
+    assert again.documents != first.documents
+    assert client.scraped == 1
+    nfe_data = store.get_nfe_data("9")
+    assert [material.pending_qty for material in nfe_data.pending_materials] == [8]
+    assert [order.qty for order in nfe_data.orders] == [2.0]
+
+
+def test_batch_scrapes_receipts_without_the_parsed_nfe(store, render, tmp_path):
+    store.save("9", parsed_nfe(), {"labels.pdf": b"%PDF"})
+    client = FakeClient(pending_qty=5)
+    result = batch.process_negociation(client, "9", tmp_path, store=store)
+    assert (result.cached, client.scraped, len(render)) == (False, 1, 1)
+    assert store.get_parsed_nfe("9") == parsed_nfe()
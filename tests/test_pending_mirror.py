@@ -0,0 +1,145 @@
+"""SQLite mirror of the pending materials export and the client lookups on it"""
+
+import threading
+import time
+from datetime import date, datetime as dt
+
+import pytest
+
+from benchmarks.fixtures import material_code
+from benchmarks.standin_server import StandinConfig, start_server
+from core import scraping
+from core.pending_mirror import PendingMaterialsMirror
+
+
+def cells(creation_date: date, code: str, op_number: str, qty: str) -> list[str]:
+    """Cells of an export row"""
+    return [f"{creation_date:%d/%m/%y}", code, "", op_number, "", "Chapa", "", "", qty]
+
+
+class FakeExport:
+    """Rows of the export by creation date, recording the requested ranges"""
+
+    def __init__(self, rows: list[list[str]]):
+        self.rows = rows
+        self.ranges: list[tuple[date, date]] = []
+
+    def __call__(self, start: date, end: date) -> list[list[str]]:
+        self.ranges.append((start, end))
+        return [
+            row
+            for row in self.rows
+            if start <= dt.strptime(row[0], "%d/%m/%y").date() <= end
+        ]
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    pending_mirror = PendingMaterialsMirror(
+        tmp_path / "mirror.sqlite3", first_year=2025
+    )
+    yield pending_mirror
+    pending_mirror.close()
+
+
+def test_lookup_by_code_year_and_unit(mirror):
+    export = FakeExport(
+        [
+            cells(date(2025, 3, 1), "4001", "OP-2", "1.200 UN"),
+            cells(date(2025, 1, 5), "4001", "OP-1", "5 UN"),
+            cells(date(2026, 2, 1), "4001", "OP-3", "7 mt"),
+            cells(date(2026, 2, 1), "4002", "OP-4", "2 KG"),
+        ]
+    )
+    stats = mirror.sync(export)
+    assert (stats.full, stats.start, stats.fetched_rows) == (True, date(2025, 1, 1), 4)
+    index = mirror.lookup(["4001", "4002", "9999"], min_year=2025)
+    assert [material.op_number for material in index["4001"]] == ["OP-1", "OP-2"]
+    assert index["4001"][1].pending_qty == 1200
+    assert list(index) == ["4001", "4002"]
+    assert mirror.lookup(["4001"], min_year=2026) == {}
+    assert len(mirror.lookup(["4001"], min_year=2025, skip_units=())["4001"]) == 3
+
+
+def test_incremental_sync_replaces_the_range_since_the_watermark(mirror):
+    today = date.today()
+    export = FakeExport(
+        [
+            cells(date(2025, 1, 5), "4001", "OP-1", "5 UN"),
+            cells(today, "4001", "OP-2", "3 UN"),
+        ]
+    )
+    mirror.sync(export)
+    export.rows[1] = cells(today, "4001", "OP-2", "1 UN")
+    stats = mirror.sync(export)
+    assert (stats.full, stats.start, stats.removed_rows) == (False, today, 1)
+    quantities = [m.pending_qty for m in mirror.lookup(["4001"], 2025)["4001"]]
+    assert quantities == [5, 1]
+    assert mirror.age is not None and mirror.age < 60
+
+
+def test_full_sync_drops_the_supplied_rows(mirror):
+    export = FakeExport(
+        [
+            cells(date(2025, 1, 5), "4001", "OP-1", "5 UN"),
+            cells(date(2025, 6, 1), "4001", "OP-2", "3 UN"),
+        ]
+    )
+    mirror.sync(export)
+    # OP-1 was supplied and left the export, only a full sync sees it
+    del export.rows[0]
+    assert mirror.sync(export).start == date.today()
+    assert len(mirror.lookup(["4001"], 2025)["4001"]) == 2
+    stats = mirror.sync(export, full=True)
+    assert (stats.removed_rows, stats.total_rows) == (2, 1)
+    assert [m.op_number for m in mirror.lookup(["4001"], 2025)["4001"]] == ["OP-2"]
+
+
+def test_first_year_defaults_to_the_year_before(tmp_path):
+    pending_mirror = PendingMaterialsMirror(tmp_path / "mirror.sqlite3")
+    export = FakeExport([])
+    pending_mirror.sync(export)
+    assert export.ranges == [(date(date.today().year - 1, 1, 1), date.today())]
+    pending_mirror.close()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """HTTP client of the stand-in whose pending materials come from a mirror"""
+    monkeypatch.chdir(tmp_path)
+    server = start_server(config=StandinConfig(pending_rows=200))
+    client = scraping.CargaMaquinaClient(
+        "user",
+        "password",
+        backend="http",
+        base_url=f"http://127.0.0.1:{server.server_address[1]}",
+        pending_source="mirror",
+        pending_cache_ttl=0,
+    )
+    yield client
+    client.close()
+    server.shutdown()
+
+
+def test_lookups_do_not_wait_for_a_stale_mirror_sync(client, monkeypatch):
+    """Only the first sync is waited, later ones run behind the lookups"""
+    code = material_code(1)
+    assert client.get_requested_materials([code])
+    sync = client.pending_mirror.sync
+    release = threading.Event()
+    syncs: list[float] = []
+
+    def slow_sync(*args, **kwargs):
+        syncs.append(time.monotonic())
+        release.wait(10)
+        return sync(*args, **kwargs)
+
+    monkeypatch.setattr(client.pending_mirror, "sync", slow_sync)
+    start = time.monotonic()
+    for _ in range(3):
+        assert client.get_requested_materials([code])
+    assert time.monotonic() - start < 2
+    release.set()
+    client.close()
+    # Started once, the stale lookups did not queue a sync each
+    assert len(syncs) == 1
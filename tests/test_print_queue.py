@@ -0,0 +1,124 @@
+"""Print queue and the backends that run without a Windows printer"""
+
+import os
+import socket
+import stat
+import sys
+import threading
+
+import pytest
+
+from core.print_queue import (
+    CupsBackend,
+    DirectoryBackend,
+    PrintBackend,
+    PrintError,
+    PrintJob,
+    PrintQueue,
+    RawSocketBackend,
+    create_backend,
+)
+
+
+class FailingBackend(PrintBackend):
+    """Fails the jobs whose name starts with "bad" """
+
+    name = "failing"
+
+    def print_document(self, job: PrintJob) -> None:
+        if job.name.startswith("bad"):
+            raise PrintError("sem papel")
+
+
+def fake_command(folder, name: str, body: str) -> None:
+    """Python script run as the command name, first on the PATH"""
+    path = folder / name
+    path.write_text(f"#!{sys.executable}\n{body}\n", encoding="utf-8")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+
+def test_backend_must_print():
+    with pytest.raises(TypeError):
+        PrintBackend()  # pylint: disable=abstract-class-instantiated
+
+
+def test_queue_records_done_and_failed_jobs():
+    print_queue = PrintQueue(FailingBackend(), workers=2)
+    jobs = print_queue.submit_documents({"labels.pdf": b"%PDF", "bad.pdf": b"%PDF"})
+    assert all(job.wait(5) for job in jobs)
+    print_queue.close()
+    assert [(job.status, job.error) for job in jobs] == [
+        ("done", ""),
+        ("failed", "sem papel"),
+    ]
+    assert all(job.latency > 0 for job in jobs)
+
+
+def test_directory_backend_saves_each_job(tmp_path):
+    backend = create_backend("directory", str(tmp_path))
+    assert isinstance(backend, DirectoryBackend)
+    print_queue = PrintQueue(backend)
+    jobs = print_queue.submit_documents({"a.zpl": b"^XA^XZ", "b.zpl": b"^XA^FD^XZ"})
+    print_queue.close()
+    assert all(job.ok for job in jobs)
+    saved = sorted(tmp_path.iterdir())
+    assert [path.read_bytes() for path in saved] == [b"^XA^XZ", b"^XA^FD^XZ"]
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_raw_backend_sends_the_document():
+    received = bytearray()
+    with socket.create_server(("127.0.0.1", 0)) as server:
+
+        def accept() -> None:
+            connection, _ = server.accept()
+            with connection:
+                while chunk := connection.recv(4096):
+                    received.extend(chunk)
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+        backend = RawSocketBackend("127.0.0.1", server.getsockname()[1], timeout=5)
+        backend.print_document(PrintJob(1, "labels.zpl", b"^XA" * 10_000))
+        thread.join(5)
+    assert bytes(received) == b"^XA" * 10_000
+
+
+def test_raw_backend_without_printer():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    with pytest.raises(PrintError):
+        RawSocketBackend("127.0.0.1", port, timeout=1).print_document(
+            PrintJob(1, "labels.zpl", b"^XA")
+        )
+
+
+@pytest.mark.skipif(os.name != "posix", reason="fake lp is a POSIX script")
+def test_cups_backend_waits_the_request(tmp_path, monkeypatch):
+    fake_command(
+        tmp_path,
+        "lp",
+        "import sys; sys.stdin.buffer.read(); print('request id is fake-7 (1 file(s))')",
+    )
+    # The request is still not completed on the first lpstat
+    fake_command(
+        tmp_path,
+        "lpstat",
+        "import pathlib\n"
+        f"marker = pathlib.Path({str(tmp_path / 'polled')!r})\n"
+        "print('' if marker.exists() else 'fake-7 user 1024')\n"
+        "marker.touch()",
+    )
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    CupsBackend(poll_interval=0.01).print_document(PrintJob(1, "labels.pdf", b"%PDF"))
+    assert (tmp_path / "polled").exists()
+
+
+@pytest.mark.skipif(os.name != "posix", reason="fake lp is a POSIX script")
+def test_cups_backend_gives_up_on_a_hung_lp(tmp_path, monkeypatch):
+    fake_command(tmp_path, "lp", "import time; time.sleep(30)")
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    with pytest.raises(PrintError, match="lp não respondeu"):
+        CupsBackend(command_timeout=0.5).print_document(
+            PrintJob(1, "labels.pdf", b"%PDF")
+        )
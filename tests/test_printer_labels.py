@@ -0,0 +1,86 @@
+"""Golden file tests of the ZPL and EPL labels
+
+The expected labels are in tests/golden. After an intended layout change,
+regenerate them with UPDATE_GOLDEN=1 python -m pytest tests/test_printer_labels.py
+and review the diff of the golden files.
+"""
+
+import os
+import pathlib
+from datetime import date
+
+import pytest
+
+from core.models import Material, NFeData, OrderData
+from core.zpl_labels import generate_printer_labels
+
+GOLDEN_FOLDER: pathlib.Path = pathlib.Path(__file__).parent / "golden"
+
+
+def golden_nfe_data() -> NFeData:
+    """Fixed NFe with long, accented and escaped texts and a fractional quantity"""
+    return NFeData(
+        date="17/10/2026",
+        nfe_number=123456,
+        supplier_name="FORNECEDOR DE AÇO E PLÁSTICOS LTDA",
+        orders=[
+            OrderData(
+                address="RUA 3 PRATELEIRA 12",
+                order=4521,
+                code="MP00001",
+                description="PARAFUSO SEXTAVADO M8 X 30 ZINCADO",
+                qty=150.0,
+                qty_total=200.0,
+                unit_type="UN",
+            ),
+            OrderData(
+                address="RUA 1",
+                order="PC-77/B",
+                code="MP00042",
+                description=(
+                    "CHAPA DE AÇO CARBONO 1020 LAMINADA A FRIO 2,00 MM X 1200 MM "
+                    'X 3000 MM "ESPECIAL" ^_~\\'
+                ),
+                qty=12.5,
+                qty_total=12.5,
+                unit_type="KG",
+            ),
+            OrderData(
+                address="",
+                order=9,
+                code="MP00100",
+                description="ARRUELA",
+                qty=0.0,
+                qty_total=10.0,
+                unit_type="PC",
+            ),
+        ],
+        pending_materials=[
+            Material(
+                creation_date=date(2026, 2, 1),
+                code="MP00001",
+                op_number="OP 31337",
+                product="PRODUTO 118 - SUPORTE DE MOTOR",
+                pending_qty=50.0,
+            ),
+            Material(
+                creation_date=date(2026, 3, 15),
+                code="MP00042",
+                op_number="OP 7",
+                product="PRODUTO COM NOME MUITO LONGO PARA QUEBRAR EM VÁRIAS LINHAS",
+                pending_qty=0.0,
+            ),
+        ],
+    )
+
+
+@pytest.mark.parametrize("language", ["zpl", "epl"])
+def test_labels_match_golden_files(language):
+    documents = generate_printer_labels(golden_nfe_data(), language)
+    assert sorted(documents) == [f"pending_labels.{language}", f"stock_labels.{language}"]
+    for name, document in documents.items():
+        golden_file = GOLDEN_FOLDER / name
+        if os.environ.get("UPDATE_GOLDEN"):
+            GOLDEN_FOLDER.mkdir(exist_ok=True)
+            golden_file.write_bytes(document)
+        assert document == golden_file.read_bytes(), f"{name} differs from {golden_file}"
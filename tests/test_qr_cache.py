@@ -0,0 +1,17 @@
+"""QR codes of the memory and disk caches"""
+
+from core.qr_cache import QRCodeCache
+
+
+def test_disk_cache_keeps_payloads_apart(tmp_path):
+    """Payloads that differ only in punctuation get their own images"""
+    cache = QRCodeCache(disk_path=tmp_path)
+    first = cache.get_png("123.45;2")
+    second = cache.get_png("123/45;2")
+    assert first != second
+    assert len(list(tmp_path.glob("*.png"))) == 2
+
+    # A new cache reads them back from the disk
+    cache = QRCodeCache(disk_path=tmp_path)
+    assert cache.get_png("123.45;2") == first
+    assert cache.get_png("123/45;2") == second
@@ -0,0 +1,116 @@
+"""Randomized checks of the NFe reconciliation against the legacy loop"""
+
+import copy
+import random
+
+import pytest
+
+from core.models import Material, OrderData
+from core.reconciliation import reconcile
+from tests.reconciliation_cases import legacy_reconcile, synthetic_nfe
+
+
+def check_invariants(orders_before: list, result: tuple) -> None:
+    """Quantities are conserved per received code and never negative"""
+    orders_after, pending_after = result
+    received: dict = {}
+    for order in orders_before:
+        received[order.code] = received.get(order.code, 0) + order.qty
+    remaining: dict = {}
+    for order in orders_after:
+        assert order.qty > 0
+        remaining[order.code] = remaining.get(order.code, 0) + order.qty
+    allocated: dict = {}
+    for pending_material in pending_after:
+        assert pending_material.pending_qty > 0
+        code = pending_material.code
+        allocated[code] = allocated.get(code, 0) + pending_material.pending_qty
+    for code, qty in received.items():
+        assert abs(qty - remaining.get(code, 0) - allocated.get(code, 0)) < 1e-9
+
+
+def random_nfes(
+    seed: int, count: int, unique_codes: bool | None = None, fractional: bool = False
+):
+    """Orders and pending materials of random small NFes"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        unique = rng.random() < 0.5 if unique_codes is None else unique_codes
+        yield synthetic_nfe(rng, rng.randint(1, 30), unique, 20, fractional)
+
+
+@pytest.mark.parametrize("fractional", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_quantities_are_conserved(seed, fractional):
+    for orders, pending_materials in random_nfes(seed, 100, fractional=fractional):
+        orders_before = copy.deepcopy(orders)
+        result = reconcile(
+            orders, [Material.from_dict(material) for material in pending_materials]
+        )
+        check_invariants(orders_before, result)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_legacy_loop_with_unique_codes(seed):
+    for orders, pending_materials in random_nfes(seed, 100, unique_codes=True):
+        legacy_orders, legacy_pending = legacy_reconcile(
+            copy.deepcopy(orders), copy.deepcopy(pending_materials)
+        )
+        result_orders, result_pending = reconcile(
+            orders, [Material.from_dict(material) for material in pending_materials]
+        )
+        # The legacy loop can skip zero quantity orders while removing them
+        legacy_orders = [order for order in legacy_orders if order.qty != 0]
+        assert [o.qty for o in legacy_orders] == [o.qty for o in result_orders]
+        assert [p["pending_qty"] for p in legacy_pending] == [
+            p.pending_qty for p in result_pending
+        ]
+
+
+def pending_material(creation_date: str, op_number: str, pending_qty: float):
+    """Pending material of the code MP00001"""
+    return Material.from_dict(
+        {
+            "creation_date": creation_date,
+            "code": "MP00001",
+            "op_number": op_number,
+            "product": "PRODUTO",
+            "pending_qty": pending_qty,
+        }
+    )
+
+
+def test_oldest_pending_material_is_supplied_first():
+    orders = [OrderData("A1", 1, "MP00001", "", 10.0, 10.0, "UN")]
+    pending_materials = [
+        pending_material("10/03/26", "OP 2", 6.0),
+        pending_material("05/01/26", "OP 1", 6.0),
+    ]
+    remaining_orders, allocated = reconcile(orders, pending_materials)
+    assert remaining_orders == []
+    assert [(p.op_number, p.pending_qty) for p in allocated] == [
+        ("OP 1", 6.0),
+        ("OP 2", 4.0),
+    ]
+
+
+def test_less_than_a_unit_received_is_not_over_allocated():
+    """0.3 KG received against 0.5 and 0.8 pending stays in stock"""
+    orders = [OrderData("A1", 1, "MP00001", "", 0.3, 0.3, "KG")]
+    pending_materials = [
+        pending_material("05/01/26", "OP 1", 0.5),
+        pending_material("10/03/26", "OP 2", 0.8),
+    ]
+    remaining_orders, allocated = reconcile(orders, pending_materials)
+    assert allocated == []
+    assert [order.qty for order in remaining_orders] == [0.3]
+
+
+def test_fractional_part_is_kept():
+    """5.5 pending with 3.2 received is reduced in whole units to 2.5"""
+    orders = [OrderData("A1", 1, "MP00001", "", 3.2, 3.2, "KG")]
+    remaining_orders, allocated = reconcile(
+        orders, [pending_material("05/01/26", "OP 1", 5.5)]
+    )
+    assert [p.pending_qty for p in allocated] == [2.5]
+    assert [order.qty for order in remaining_orders] == [pytest.approx(0.7)]
@@ -0,0 +1,90 @@
+"""Logins of the pending materials prefetch and the scraping threads"""
+
+import functools
+import threading
+import time
+
+import pytest
+
+from benchmarks.fixtures import material_code
+from benchmarks.standin_server import StandinConfig, start_server
+from core import scraping
+from core.driver_pool import DriverPool
+
+
+class FakeElement:
+    """Login form field or button"""
+
+    def send_keys(self, *_) -> None:
+        pass
+
+    def click(self) -> None:
+        pass
+
+
+class FakeDriver:
+    """Browser whose login always gets the stand-in session"""
+
+    current_url = "about:blank"
+
+    def get(self, url: str) -> None:
+        self.current_url = url
+
+    def find_element(self, **_) -> FakeElement:
+        return FakeElement()
+
+    def get_cookies(self) -> list[dict]:
+        return [{"name": "PHPSESSID", "value": "standin-session"}]
+
+    def add_cookie(self, cookie: dict) -> None:
+        pass
+
+    def quit(self) -> None:
+        pass
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Selenium client of the stand-in with a single fake driver"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        scraping, "DriverPool", functools.partial(DriverPool, factory=FakeDriver)
+    )
+    server = start_server(config=StandinConfig(pending_rows=200, latency=0.1))
+    client = scraping.CargaMaquinaClient(
+        "user",
+        "password",
+        base_url=f"http://127.0.0.1:{server.server_address[1]}",
+        drivers=1,
+        pending_cache_ttl=0,
+    )
+    yield client
+    client.close()
+    server.shutdown()
+
+
+def test_prefetch_login_does_not_wait_for_the_held_driver(client):
+    """The prefetch logs in while the only driver is on a login page"""
+    with client.driver_pool.checkout(5) as pooled:
+        # The session expires while this thread scrapes an NFe
+        client.session.cookies.clear()
+        client.requests_cookies = {}
+        client.session_store.clear()
+        pending = client.prefetch_pending_materials()
+        deadline = time.monotonic() + 5
+        # pylint: disable-next=protected-access
+        while not client._login_lock.locked() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # Lands on the login page and logs in again with the driver it holds
+        refresh = threading.Thread(
+            target=client.refresh_session, args=(pooled,), daemon=True
+        )
+        refresh.start()
+        refresh.join(10)
+        assert not refresh.is_alive()
+
+    lookup = pending.result(timeout=10)
+    assert lookup is not None
+    assert lookup([material_code(1)])
+    assert client.session_store.probe(client.session, client.base_url)
@@ -0,0 +1,112 @@
+"""HTTP API of the label service with a stubbed pipeline and printer"""
+
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from core import service
+from core.batch import BatchResult
+from core.print_queue import PrintBackend, PrintError, PrintJob, PrintQueue
+
+
+class SlowBackend(PrintBackend):
+    """Takes a while to print and fails the documents named "bad" """
+
+    name = "slow"
+
+    def __init__(self):
+        self.printed: list[str] = []
+
+    def print_document(self, job: PrintJob) -> None:
+        time.sleep(0.2)
+        if job.name.startswith("bad"):
+            raise PrintError("sem papel")
+        self.printed.append(job.name)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Connection to a service whose negotiations give one document"""
+    backend = SlowBackend()
+    print_queue = PrintQueue(backend)
+
+    def process_negociation(_client, negociation_id, *_args):
+        name = "bad.pdf" if negociation_id == "bad" else "stock_labels.pdf"
+        return BatchResult(negociation_id, True, "", 0.0, documents={name: b"%PDF"})
+
+    monkeypatch.setattr(service, "process_negociation", process_negociation)
+    monkeypatch.setattr(service, "get_print_queue", lambda: print_queue)
+    label_service = service.LabelService(client=None, workers=2)
+    server = service.serve(label_service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection(
+        "127.0.0.1", server.server_address[1], timeout=10
+    )
+    yield connection, backend
+    connection.close()
+    server.shutdown()
+    server.server_close()
+    label_service.close()
+    print_queue.close()
+
+
+def request(connection, method: str, path: str, body: bytes = b"", headers=None):
+    """Status, JSON body and Connection header of one request"""
+    connection.request(method, path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    body = json.loads(response.read())
+    return response.status, body, response.getheader("Connection")
+
+
+def test_print_job_is_done_after_printing(api):
+    connection, backend = api
+    status, job, _ = request(
+        connection, "POST", "/jobs?wait=1&print=1&negociation_id=1"
+    )
+    assert (status, job["status"]) == (200, "done")
+    assert backend.printed == ["stock_labels.pdf"]
+
+
+def test_failed_print_fails_the_job(api):
+    connection, _ = api
+    status, job, _ = request(
+        connection, "POST", "/jobs?wait=1&print=1&negociation_id=bad"
+    )
+    assert (status, job["status"]) == (502, "failed")
+    assert "sem papel" in job["error"]
+    assert job["files"]
+
+
+def test_bad_content_length_is_a_bad_request(api):
+    connection, _ = api
+    status, body, connection_header = request(
+        connection, "POST", "/jobs", headers={"Content-Length": "abc"}
+    )
+    assert status == 400
+    assert "Content-Length" in body["error"]
+    assert connection_header == "close"
+
+
+def test_large_body_closes_the_connection(api):
+    connection, _ = api
+    connection.putrequest("POST", "/jobs")
+    connection.putheader("Content-Length", str(service.MAX_BODY + 1))
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 413
+    assert response.getheader("Connection") == "close"
+    response.read()
+
+
+def test_unknown_route_keeps_the_connection_usable(api):
+    """The body of a 404 is read, the next request on the connection works"""
+    connection, _ = api
+    status, _, _ = request(connection, "POST", "/nope", b'{"negociation_id": "1"}')
+    assert status == 404
+    status, job, _ = request(
+        connection, "POST", "/jobs?wait=1", b'{"negociation_id": "2"}'
+    )
+    assert (status, job["negociation_id"], job["status"]) == (200, "2", "done")